@@ -1,10 +1,223 @@
 from abc import ABC, abstractmethod
+from collections import deque
+import asyncio
+import aiohttp
+from Utilities.KlineFormatter import KlineFormatter
+from Utilities.OrderBookStream import OrderBookStream
+
+class ExchangeAPIError(Exception):
+    """Erreur de l'API d'un exchange : réponse en erreur, exchange injoignable ou trop de tentatives."""
+
+class InvalidRequestError(ExchangeAPIError, ValueError):
+    """Requête refusée par l'exchange ou par l'adapter : symbole ou intervalle invalide."""
 
 class Exchange(ABC):
+    # Nombre maximal de shards (pages) de chandelles téléchargés en parallèle
+    max_concurrency = 8
+
+    # Paramètres du pool de connexions HTTP partagé par toutes les méthodes de l'adapter
+    session_limit = 200           # Connexions simultanées au total (flux WebSocket compris)
+    session_limit_per_host = 0    # Connexions simultanées par hôte (0 : pas de limite)
+    dns_cache_ttl = 300           # Durée de vie (s) du cache DNS
+    keepalive_timeout = 30        # Durée (s) de conservation des connexions inactives
+    verify_ssl = True             # Vérification des certificats TLS (REST et WebSocket)
+    session = None
+
+    # Limiteur de débit partagé par toutes les requêtes REST de l'adapter (défini par chaque exchange)
+    rate_limiter = None
+    max_retries = 5  # Nombre de tentatives sur une limite de débit ou une erreur serveur
+
+    # Nombre de niveaux par côté transmis par défaut au callback de subscribe_order_book
+    order_book_depth = 10
+    truncate_order_book = False  # True si l'exchange ne diffuse que les meilleurs niveaux, selon la profondeur d'abonnement
+    order_book_depths = ()       # Profondeurs d'abonnement proposées par un tel exchange (voir OrderBookStream.venue_depth)
+
+    # Flux WebSocket des carnets d'ordres, multiplexés (voir Utilities.OrderBookStream)
+    ws_order_book_url = None
+    ws_max_symbols = 100   # Symboles par connexion
+    ws_message_rate = 5    # Messages envoyés par seconde et par connexion
+    ws_heartbeat = 30      # Intervalle (s) des pings : une connexion muette est fermée puis rouverte
+    ws_reconnect_delay = 1        # Délai (s) avant la première tentative de reconnexion
+    ws_max_reconnect_delay = 60   # Délai maximal (s) entre deux tentatives
+    order_book_stream = None
+    instruments = {}  # Pas de cotation par symbole, renseignés par le SymbolCatalog (voir get_instruments)
+
+    @abstractmethod
+    def iter_historical_klines(self, symbol, interval, start_time, end_time):
+        """
+        Générateur asynchrone des pages de chandelles de [start_time, end_time] (ms),
+        au format colonne (voir KlineFormatter) et par ordre chronologique.
+        """
+        pass
+
+    async def get_historical_klines(self, symbol, interval, start_time, end_time):
+        """Retourne toutes les chandelles de [start_time, end_time] (ms) au format colonne."""
+        pages = [page async for page in self.iter_historical_klines(symbol, interval, start_time, end_time)]
+        return KlineFormatter.merge(*pages)
+
+    @abstractmethod
+    async def get_instruments(self) -> dict[str, dict]:
+        """
+        Retourne les paires de trading de l'exchange (format natif) et leurs pas de cotation :
+        {symbole: {"tick_size": "0.01", "lot_size": "0.00001"}} (chaînes décimales).
+        """
+        pass
+
+    async def get_available_trading_pairs(self):
+        return list(await self.get_instruments())
+
     @abstractmethod
-    async def get_historical_klines(self, symbol, interval, start_date=None, end_date=None):
+    def order_book_subscribe_message(self, symbols: list[str], depth: int = None) -> dict:
+        """
+        Message WebSocket abonnant une connexion aux carnets de `symbols` (format natif).
+        `depth` n'est fourni que si l'exchange tronque ses carnets (truncate_order_book).
+        """
         pass
 
     @abstractmethod
-    def get_available_trading_pairs(self):
-        pass
\ No newline at end of file
+    def order_book_unsubscribe_message(self, symbols: list[str], depth: int = None) -> dict:
+        """Message WebSocket désabonnant une connexion des carnets de `symbols` (abonnés à la profondeur `depth`)."""
+        pass
+
+    @abstractmethod
+    async def handle_order_book_message(self, stream: OrderBookStream, connection, data):
+        """
+        Traite un message reçu sur une connexion du flux : met à jour le carnet concerné (stream.books)
+        puis appelle stream.publish(symbol).
+        """
+        pass
+
+    def get_order_book_stream(self) -> OrderBookStream:
+        if self.order_book_stream is None:
+            self.order_book_stream = OrderBookStream(self)
+        return self.order_book_stream
+
+    async def subscribe_order_book(self, symbol: str, callback, depth: int = None):
+        """
+        Abonne `callback` au carnet d'ordres de `symbol` (format natif) : il reçoit
+        {"bids": [[prix, quantité], ...], "asks": [...], "timestamp": ...} (au moins `depth` meilleurs niveaux,
+        order_book_depth par défaut) à chaque mise à jour, jusqu'à l'annulation de la tâche ou un appel à unsubscribe_order_book.
+        """
+        stream = self.get_order_book_stream()
+        done = await stream.subscribe(symbol, callback, depth)
+        try:
+            await done
+        finally:
+            await stream.unsubscribe(symbol, callback)
+
+    def set_order_book_depth(self, symbol: str, callback, depth: int = None):
+        """Change le nombre de niveaux transmis à `callback` pour le carnet de `symbol`."""
+        self.get_order_book_stream().set_depth(symbol, callback, depth)
+
+    def unsubscribe_order_book(self, symbol: str, callback=None):
+        """Arrête l'abonnement de `callback` au carnet de `symbol` (tous les abonnements si None)."""
+        self.get_order_book_stream().stop(symbol, callback)
+
+    def get_session(self) -> aiohttp.ClientSession:
+        """
+        Retourne la session HTTP de l'adapter (REST et WebSocket), en la créant si nécessaire.
+        Les connexions TCP/TLS et les résolutions DNS sont ainsi réutilisées d'une requête à l'autre.
+        """
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(
+                ssl=self.verify_ssl,
+                limit=self.session_limit,
+                limit_per_host=self.session_limit_per_host,
+                ttl_dns_cache=self.dns_cache_ttl,
+                keepalive_timeout=self.keepalive_timeout
+            )
+            self.session = aiohttp.ClientSession(connector=connector)
+        return self.session
+
+    async def close_session(self):
+        """Ferme la session HTTP de l'adapter (appelé à l'arrêt du serveur)."""
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+    async def request_json(self, url: str, params: dict = None, weight: float = 1):
+        """
+        Effectue un GET via la session partagée en respectant le limiteur de débit de l'exchange,
+        et retourne le JSON décodé. Les réponses 418/429 et 5xx sont rejouées après la pause imposée.
+        Lève une InvalidRequestError si l'exchange rejette la requête (400, 404 : symbole inconnu,
+        paramètre invalide), une ExchangeAPIError s'il reste injoignable.
+        """
+        for attempt in range(self.max_retries):
+            await self.rate_limiter.acquire(weight)
+            try:
+                async with self.get_session().get(url, params=params) as response:
+                    if self.rate_limiter.update_from_headers(response.status, response.headers):
+                        continue
+                    if response.status >= 500:
+                        print(f"[{self.name}] Server error {response.status}, retrying...")
+                        self.rate_limiter.penalize(self.rate_limiter.default_backoff * 2 ** attempt)
+                        continue
+                    if response.status in (400, 404):
+                        raise InvalidRequestError(f"{self.name} API error: {response.status} - {await response.text()}")
+                    return await response.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                raise ExchangeAPIError(f"{self.name} API error: {e!r}") from e
+        raise ExchangeAPIError(f"{self.name} API error: too many failed attempts on {url}")
+
+    def resolve_interval(self, interval: str) -> str:
+        """
+        Retourne l'intervalle natif à télécharger pour servir `interval` : lui-même s'il est natif,
+        sinon le plus long intervalle natif dont les chandelles s'agrègent exactement en `interval`
+        (voir KlineFormatter.resample). Lève une ValueError si aucun ne convient.
+        """
+        if interval in self.valid_intervals:
+            return interval
+        target_ms = KlineFormatter.interval_to_ms(interval)
+        candidates = []
+        for native in self.valid_intervals:
+            native_ms = KlineFormatter.interval_to_ms(native)
+            if interval[-1] == "M":
+                # Mois calendaires : à partir de mois natifs, ou d'un intervalle qui découpe exactement la journée
+                valid = int(interval[:-1]) % int(native[:-1]) == 0 if native[-1] == "M" else 86_400_000 % native_ms == 0
+            elif native[-1] == "M":
+                valid = False
+            elif interval[-1] == "w":
+                # Semaines commençant le lundi : l'intervalle natif doit découper exactement la journée
+                valid = 86_400_000 % native_ms == 0
+            else:
+                valid = target_ms % native_ms == 0
+            if valid:
+                candidates.append((native_ms, native))
+        if not candidates:
+            raise InvalidRequestError(f"Invalid interval '{interval}'. Valid intervals are: {', '.join(self.valid_intervals.keys())} or any multiple of them")
+        return max(candidates)[1]
+
+    def split_range(self, interval: str, start_time: int, end_time: int) -> list[tuple[int, int]]:
+        """
+        Découpe [start_time, end_time] (ms, bornes incluses) en shards d'au plus self.limit chandelles,
+        de sorte que chaque shard corresponde à une page de l'API.
+        """
+        shard_size = KlineFormatter.interval_to_ms(interval) * self.limit
+        return [
+            (shard_start, min(shard_start + shard_size - 1, end_time))
+            for shard_start in range(start_time, end_time + 1, shard_size)
+        ]
+
+    async def iter_shards(self, shards: list[tuple[int, int]], fetch_shard):
+        """
+        Exécute fetch_shard(start, end) sur chaque shard, avec au plus self.max_concurrency
+        requêtes simultanées, et renvoie les chandelles brutes de chaque shard dans l'ordre des shards,
+        triées par ordre chronologique et sans doublon (clé : timestamp d'ouverture en première position).
+        Seule une fenêtre de self.max_concurrency shards est gardée en mémoire.
+        """
+        shards = iter(shards)
+        pending = deque(
+            asyncio.create_task(fetch_shard(*shard))
+            for _, shard in zip(range(self.max_concurrency), shards)
+        )
+        try:
+            while pending:
+                page = await pending.popleft()
+                next_shard = next(shards, None)
+                if next_shard is not None:
+                    pending.append(asyncio.create_task(fetch_shard(*next_shard)))
+                klines = {int(kline[0]): kline for kline in page}
+                yield [klines[ts] for ts in sorted(klines)]
+        finally:
+            for task in pending:
+                task.cancel()
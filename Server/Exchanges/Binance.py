@@ -1,8 +1,9 @@
-from Exchanges.Abstract import Exchange
-import requests
+from Exchanges.Abstract import Exchange, ExchangeAPIError
 import asyncio
 import aiohttp
-from datetime import datetime
+from Utilities.RateLimiter import RateLimiter
+from Utilities.KlineFormatter import KlineFormatter
+from Utilities.OrderBook import SequenceGap
 
 binance_order_books = {}
 
@@ -15,9 +16,18 @@ class Binance(Exchange):
         self.BASE_REST_SPOT_URL = "https://api.binance.com"
         self.KLINE_URL = "/api/v3/klines"
         self.SYMBOLE_URL = "/api/v3/exchangeInfo"
+        self.DEPTH_URL = "/api/v3/depth"
         self.limit = 1000
-        self.ws_url = "wss://stream.binance.com:9443/ws"
-        self.stop_events = {}
+        self.ws_order_book_url = "wss://stream.binance.com:9443/stream"  # Flux combinés
+        self.ws_max_symbols = 200  # Binance accepte jusqu'à 1024 flux par connexion
+        self.ws_request_id = 0
+
+        # Binance autorise 6000 unités de poids par minute et par IP ;
+        # le poids consommé est renvoyé dans l'en-tête X-MBX-USED-WEIGHT-1M.
+        self.rate_limiter = RateLimiter(capacity=6000, refill_rate=100, used_weight_header="X-MBX-USED-WEIGHT-1M")
+        self.KLINE_WEIGHT = 2
+        self.EXCHANGE_INFO_WEIGHT = 20
+        self.DEPTH_WEIGHT = 50  # Snapshot de 1000 niveaux
 
         self.valid_intervals = {
             "1m": 60,
@@ -39,128 +49,139 @@ class Binance(Exchange):
 
     def process_klines(self, klines):
         """
-        Convertit les données
+        Convertit les données brutes en colonnes typées.
+        Format d'une chandelle Binance : [ open_time, open, high, low, close, volume, close_time, ... ]
         """
-        return [
-            {
-                "timestamp": int(kline[0]),
-                "date": datetime.utcfromtimestamp(int(kline[0]) / 1000).strftime('%Y-%m-%d %H:%M:%S'),
-                "open": float(kline[1]),
-                "high": float(kline[2]),
-                "low": float(kline[3]),
-                "close": float(kline[4]),
-                "volume": float(kline[5]),
-
-            }
-            for kline in klines
-        ]
+        return KlineFormatter.from_raw(klines, (0, 1, 2, 3, 4, 5))
 
-    async def get_historical_klines(self, symbol, interval, start_time, end_time):
+    async def iter_historical_klines(self, symbol, interval, start_time, end_time):
         """
-        Récupère des chandelles historiques entre start_time et end_time.
+        Récupère des chandelles historiques entre start_time et end_time, page par page.
 
         :param symbol: Symbole de trading (ex: 'BTCUSDT').
         :param interval: Intervalle des chandelles (ex: '1m', '5m', '1h', '1d').
         :param start_time: Timestamp Unix (ms) de début.
         :param end_time: Timestamp Unix (ms) de fin.
-        :param perpetual: Booléen indiquant si on utilise les données futures perpétuelles (par défaut: False).
-        :return: DataFrame des chandelles.
+        :return: Générateur des pages de chandelles au format colonne, par ordre chronologique.
         """
         if "-" in symbol:
             symbol = symbol.replace("-", "")
 
-        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=False)) as session:
-            endpoint = f"{self.BASE_REST_SPOT_URL}{self.KLINE_URL}"
+        endpoint = f"{self.BASE_REST_SPOT_URL}{self.KLINE_URL}"
+
+        async def fetch_shard(shard_start, shard_end):
             klines = []
-            while start_time < end_time:
+            while shard_start <= shard_end:
                 params = {
                     "symbol": symbol,
                     "interval": interval,
-                    "startTime": start_time,
-                    "endTime": end_time,
+                    "startTime": shard_start,
+                    "endTime": shard_end,
                     "limit": self.limit
                 }
-                async with session.get(endpoint, params=params) as response:
-                    data = await response.json()
-                    if isinstance(data, list):
-                        if not len(data):
-                            break
-                        klines.extend(data)
-
-                        # Avance le start_time à la fin de la dernière chandelle récupérée
-                        start_time = data[-1][0] + 1
-                        await asyncio.sleep(0.1)  # Petite pause pour éviter les limitations d'API
-                    else:
-                        print(data, "Error, retrying...")
-                        await asyncio.sleep(5)  # Pause plus longue en cas d'erreur
-
-            return self.process_klines(klines)
+                data = await self.request_json(endpoint, params=params, weight=self.KLINE_WEIGHT)
+                if not isinstance(data, list):
+                    raise ExchangeAPIError(f"Binance API error: {data}")
+                if not len(data):
+                    break
+                klines.extend(data)
+
+                # Avance le start à la fin de la dernière chandelle récupérée
+                shard_start = data[-1][0] + 1
+            return klines
+
+        # Les shards (une page chacun) sont téléchargés en parallèle et renvoyés dans l'ordre chronologique
+        async for page in self.iter_shards(self.split_range(interval, start_time, end_time), fetch_shard):
+            yield self.process_klines(page)
     
-    def get_available_trading_pairs(self):
+    async def get_instruments(self):
         base_url = self.BASE_REST_SPOT_URL + self.SYMBOLE_URL
-        response = requests.get(base_url)
-        if response.status_code == 200:
-            data = response.json()
-            return [symbol_info['symbol'] for symbol_info in data['symbols']]
-        else:
-            raise Exception(f"Binance API error: {response.status_code} - {response.text}")
+        data = await self.request_json(base_url, weight=self.EXCHANGE_INFO_WEIGHT)
+        if "symbols" not in data:
+            raise ExchangeAPIError(f"Binance API error: {data}")
+        instruments = {}
+        for symbol_info in data['symbols']:
+            # Les pas de cotation sont donnés par les filtres PRICE_FILTER (tickSize) et LOT_SIZE (stepSize)
+            filters = {f["filterType"]: f for f in symbol_info.get("filters", [])}
+            instruments[symbol_info['symbol']] = {
+                "tick_size": filters.get("PRICE_FILTER", {}).get("tickSize"),
+                "lot_size": filters.get("LOT_SIZE", {}).get("stepSize")
+            }
+        return instruments
 
-    async def subscribe_order_book(self, symbol: str, callback):
+    async def get_order_book_snapshot(self, symbol: str, limit: int = 1000):
         """
-        Se connecte au WebSocket Binance pour le symbol donné (ex: BTCUSDT@depth10)
-        et envoie les données du carnet d'ordres au callback jusqu'à ce qu'on 
-        appelle unsubscribe_order_book(symbol).
+        Récupère un snapshot REST du carnet d'ordres (niveaux et lastUpdateId),
+        point de départ de l'application des mises à jour du flux de diffs.
         """
-        # On génère le stream
-        stream = f"{symbol.lower()}@depth10"
-        url = f"{self.ws_url}/{stream}"
-
-        # On crée l'Event s'il n'existe pas
-        if symbol not in self.stop_events:
-            self.stop_events[symbol] = asyncio.Event()
-        stop_event = self.stop_events[symbol]
-        stop_event.clear()  # On s'assure qu'il n'est pas déjà set
-
-        # Connexion WS
-        async with aiohttp.ClientSession() as session:
-            async with session.ws_connect(url) as ws:
-                print(f"[Binance] Subscribed to {symbol}@depth10")
-                async for msg in ws:
-                    # Check si on doit arrêter
-                    if stop_event.is_set():
-                        print(f"[Binance] Unsubscribing from {symbol}@depth10")
-                        break
-
-                    if msg.type == aiohttp.WSMsgType.TEXT:
-                        data = msg.json()
-                        # Première réception : snapshot
-                        if "lastUpdateId" in data:
-                            standardized = {
-                                "bids": [[float(p), float(q)] for p, q in data.get("bids", [])],
-                                "asks": [[float(p), float(q)] for p, q in data.get("asks", [])],
-                                "timestamp": None
-                            }
-                            callback(standardized)
-                        # Mises à jour incrémentielles (depthUpdate)
-                        elif data.get("e") == "depthUpdate":
-                            standardized = {
-                                "bids": [[float(p), float(q)] for p, q in data.get("b", [])],
-                                "asks": [[float(p), float(q)] for p, q in data.get("a", [])],
-                                "timestamp": data.get("E")
-                            }
-                            callback(standardized)
-                    elif msg.type == aiohttp.WSMsgType.ERROR:
-                        print("[Binance] WebSocket error on", symbol)
-                        break
-
-                print(f"[Binance] Connection closed for {symbol}@depth10")
-
-    def unsubscribe_order_book(self, symbol: str):
+        endpoint = f"{self.BASE_REST_SPOT_URL}{self.DEPTH_URL}"
+        data = await self.request_json(endpoint, params={"symbol": symbol, "limit": limit}, weight=self.DEPTH_WEIGHT)
+        if "lastUpdateId" not in data:
+            raise ExchangeAPIError(f"Binance API error: {data}")
+        return data
+
+    def order_book_subscribe_message(self, symbols, depth=None):
+        self.ws_request_id += 1
+        return {"method": "SUBSCRIBE", "params": [f"{symbol.lower()}@depth@100ms" for symbol in symbols], "id": self.ws_request_id}
+
+    def order_book_unsubscribe_message(self, symbols, depth=None):
+        self.ws_request_id += 1
+        return {"method": "UNSUBSCRIBE", "params": [f"{symbol.lower()}@depth@100ms" for symbol in symbols], "id": self.ws_request_id}
+
+    async def handle_order_book_message(self, stream, connection, data):
         """
-        Déclenche l'arrêt de la boucle d'écoute 
-        (si subscribe_order_book tourne encore pour ce symbol).
+        Applique un événement du flux de diffs (ex: btcusdt@depth@100ms) au carnet local, maintenu
+        à partir d'un snapshot REST selon la procédure documentée par Binance :
+        - les événements reçus avant le snapshot sont mis en attente ;
+        - ceux dont u <= lastUpdateId sont ignorés, le premier appliqué doit vérifier U <= lastUpdateId + 1 <= u ;
+        - chaque événement suivant doit commencer à u + 1 du précédent, sinon un nouveau snapshot est demandé.
         """
-        if symbol in self.stop_events:
-            self.stop_events[symbol].set()
+        # Flux combiné : {"stream": "btcusdt@depth@100ms", "data": {"e": "depthUpdate", "s": "BTCUSDT", ...}}
+        event = data.get("data", {})
+        if event.get("e") != "depthUpdate":
+            return
+        symbol = event["s"]
+        book = stream.books.get(symbol)
+        if book is None:
+            return
+        if not book.synced:
+            # Le snapshot est demandé après l'abonnement, pour ne perdre aucun événement
+            book.pending.append(event)
+            stream.start_task(symbol, self._sync_order_book(stream, symbol))
+        elif self._apply_depth_updates(book, [event]):
+            stream.publish(symbol)
         else:
-            print(f"[Binance] No active subscription to unsubscribe for {symbol}")
\ No newline at end of file
+            print(f"[Binance] Order book gap on {symbol}, fetching a new snapshot")
+            stream.mark_stale(symbol)
+            stream.start_task(symbol, self._sync_order_book(stream, symbol))
+
+    def _apply_depth_updates(self, book, events) -> bool:
+        """
+        Applique des événements au carnet. En cas de trou, les événements restants sont remis
+        en attente du prochain snapshot et la méthode retourne False.
+        """
+        for index, event in enumerate(events):
+            try:
+                book.apply_delta(event["b"], event["a"], sequence=event["u"], first_sequence=event["U"], timestamp=event["E"])
+            except SequenceGap:
+                book.pending = events[index:] + book.pending
+                return False
+        return True
+
+    async def _sync_order_book(self, stream, symbol):
+        """Télécharge un snapshot puis rejoue les événements en attente, jusqu'à obtenir un carnet cohérent."""
+        try:
+            while True:
+                snapshot = await self.get_order_book_snapshot(symbol)
+                book = stream.books.get(symbol)
+                if book is None:
+                    return
+                book.apply_snapshot(snapshot["bids"], snapshot["asks"], sequence=snapshot["lastUpdateId"])
+                events, book.pending = book.pending, []
+                if self._apply_depth_updates(book, events):
+                    stream.publish(symbol)
+                    return
+                # Snapshot antérieur aux événements en attente : on en demande un plus récent
+        except Exception as e:
+            # Le prochain événement relancera la synchronisation
+            print(f"[Binance] Error fetching order book snapshot for {symbol}: {e}")
@@ -1,8 +1,9 @@
-from Exchanges.Abstract import Exchange
-import requests
+from Exchanges.Abstract import Exchange, ExchangeAPIError, InvalidRequestError
 import asyncio
 import aiohttp
 from datetime import datetime
+from Utilities.RateLimiter import RateLimiter
+from Utilities.KlineFormatter import KlineFormatter
 
 class CoinbasePro(Exchange):
     """
@@ -15,6 +16,11 @@ class CoinbasePro(Exchange):
         self.KLINE_URL = "/products/{symbol}/candles"
         self.SYMBOL_URL = "/products"
         self.limit = 300  # Coinbase Pro limite à 300 chandelles par requête
+        self.max_concurrency = 5
+        self.ws_order_book_url = "wss://ws-feed.exchange.coinbase.com"
+
+        # Coinbase Pro autorise 10 requêtes publiques par seconde, avec des rafales jusqu'à 15
+        self.rate_limiter = RateLimiter(capacity=15, refill_rate=10)
 
         # Mapping des intervalles acceptés par Coinbase Pro
         self.valid_intervals = {
@@ -28,76 +34,45 @@ class CoinbasePro(Exchange):
     
     def process_klines(self, klines):
         """
-        Convertit les données
+        Convertit les données brutes (triées par ordre chronologique) en colonnes typées.
+        Format d'une chandelle Coinbase Pro : [ time (s), low, high, open, close, volume ]
         """
-        klines = klines[::-1]
-        
-        return [
-            {
-                "timestamp": kline[0] * 1000,
-                "date": datetime.utcfromtimestamp(kline[0]).strftime('%Y-%m-%d %H:%M:%S'),
-                "open": kline[3],
-                "high": kline[2],
-                "low": kline[1],
-                "close": kline[4],
-                "volume": ""
-            }
-            for kline in klines
-        ]
+        return KlineFormatter.from_raw(klines, (0, 3, 2, 1, 4, 5), time_scale=1000)
 
-    async def get_historical_klines(self, symbol, interval, start_time, end_time):
+    async def iter_historical_klines(self, symbol, interval, start_time, end_time):
         """
-        Récupère des chandelles historiques entre start_time et end_time.
+        Récupère des chandelles historiques entre start_time et end_time, page par page.
 
         :param symbol: Symbole de trading (ex: 'BTC-USD').
         :param interval: Intervalle des chandelles (ex: '1m', '5m', '1h', '1d').
         :param start_time: Timestamp Unix (ms) de début.
         :param end_time: Timestamp Unix (ms) de fin.
-        :return: Liste des chandelles.
+        :return: Générateur des pages de chandelles au format colonne, par ordre chronologique.
         """
         # Vérifier si l'intervalle est valide
         if interval not in self.valid_intervals:
-            raise ValueError(f"Invalid interval '{interval}'. Valid intervals are: {', '.join(self.valid_intervals.keys())}")
-
-        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=False)) as session:
-            endpoint = f"{self.BASE_REST_URL}{self.KLINE_URL.format(symbol=symbol)}"
-            klines = []
-
-            # Convertir les timestamps en secondes (Coinbase Pro utilise des timestamps en secondes)
-            start_time = start_time // 1000
-            end_time = end_time // 1000
-            granularity = self.valid_intervals[interval]
-            max_data_points = 300
-
-            while start_time < end_time - granularity:
-                
-                # Calculer la fin de la plage de temps pour cette requête
-                request_end_time = min(end_time, start_time + granularity * max_data_points)
-                print(datetime.utcfromtimestamp(start_time).isoformat(), datetime.utcfromtimestamp(request_end_time).isoformat())
-
-                params = {
-                    "start": datetime.utcfromtimestamp(start_time).isoformat(),
-                    "end": datetime.utcfromtimestamp(request_end_time).isoformat(),
-                    "granularity": granularity
-                }
-
-                async with session.get(endpoint, params=params) as response:
-                    data = await response.json()
-
-                    if isinstance(data, list):
-                        if not len(data):
-                            break
-                        klines.extend(data)
-
-                        # Avance le start_time à la fin de la dernière chandelle récupérée
-                        last_candle_time = int(data[1][0])
-                        start_time = last_candle_time + granularity
-                        await asyncio.sleep(0.1)  # Petite pause pour éviter les limitations d'API
-                    else:
-                        print(data, "Error, retrying...")
-                        await asyncio.sleep(5)  # Pause plus longue en cas d'erreur
-
-            return self.process_klines(klines)
+            raise InvalidRequestError(f"Invalid interval '{interval}'. Valid intervals are: {', '.join(self.valid_intervals.keys())}")
+
+        endpoint = f"{self.BASE_REST_URL}{self.KLINE_URL.format(symbol=symbol)}"
+        granularity = self.valid_intervals[interval]
+
+        async def fetch_shard(shard_start, shard_end):
+            # Chaque shard couvre au plus self.limit chandelles : une seule requête suffit.
+            # Coinbase Pro utilise des timestamps en secondes.
+            params = {
+                "start": datetime.utcfromtimestamp(shard_start // 1000).isoformat(),
+                "end": datetime.utcfromtimestamp(shard_end // 1000).isoformat(),
+                "granularity": granularity
+            }
+            data = await self.request_json(endpoint, params=params)
+            if not isinstance(data, list):
+                raise ExchangeAPIError(f"Coinbase Pro API error: {data}")
+            # Coinbase peut déborder d'une chandelle sur les bornes demandées
+            return [kline for kline in data if shard_start <= kline[0] * 1000 <= shard_end]
+
+        # Les shards (une page chacun) sont téléchargés en parallèle et renvoyés dans l'ordre chronologique
+        async for page in self.iter_shards(self.split_range(interval, start_time, end_time), fetch_shard):
+            yield self.process_klines(page)
         
     # async def get_historical_klines(self, symbol, interval, start_time, end_time):
     #     """
@@ -148,70 +123,41 @@ class CoinbasePro(Exchange):
 
     #         return klines
         
-    def get_available_trading_pairs(self):
+    async def get_instruments(self):
         """
-        Récupère la liste des paires de trading disponibles sur Coinbase Pro.
+        Récupère les paires de trading disponibles sur Coinbase Pro et leurs pas de cotation
+        (quote_increment pour le prix, base_increment pour la quantité).
         """
-        response = requests.get(self.BASE_REST_URL + self.SYMBOL_URL)
-        if response.status_code == 200:
-            data = response.json()
-            return [product['id'] for product in data]
-        else:
-            raise Exception(f"Coinbase Pro API error: {response.status_code} - {response.text}")
+        data = await self.request_json(self.BASE_REST_URL + self.SYMBOL_URL)
+        if not isinstance(data, list):
+            raise ExchangeAPIError(f"Coinbase Pro API error: {data}")
+        return {
+            product['id']: {"tick_size": product.get("quote_increment"), "lot_size": product.get("base_increment")}
+            for product in data
+        }
 
-    async def subscribe_order_book(self, symbol: str, callback):
+    def order_book_subscribe_message(self, symbols, depth=None):
+        return {"type": "subscribe", "product_ids": list(symbols), "channels": ["level2"]}
+
+    def order_book_unsubscribe_message(self, symbols, depth=None):
+        return {"type": "unsubscribe", "product_ids": list(symbols), "channels": ["level2"]}
+
+    async def handle_order_book_message(self, stream, connection, data):
         """
-        Connect to Coinbase Pro’s WebSocket and subscribe to level2 order book updates for a given symbol.
-        The callback is called with standardized order book data.
-        
-        :param symbol: Trading pair symbol (e.g., 'BTC-USD')
-        :param callback: A function to be called with the standardized order book dict.
+        Applique un message du canal "level2" : un "snapshot" (carnet complet) puis des "l2update"
+        qui donnent la nouvelle quantité de chaque niveau modifié (0 : niveau supprimé).
+        Le canal ne numérote pas ses messages : le carnet repose sur le snapshot et l'ordre de livraison du flux.
         """
-        ws_endpoint = "wss://ws-feed.exchange.coinbase.com"
-        # Build a subscription message to the "level2" channel
-        subscription_message = {
-            "type": "subscribe",
-            "channels": [{
-                "name": "level2",
-                "product_ids": [symbol]
-            }]
-        }
-        async with aiohttp.ClientSession() as session:
-            async with session.ws_connect(ws_endpoint) as ws:
-                await ws.send_json(subscription_message)
-                async for msg in ws:
-                    if msg.type == aiohttp.WSMsgType.TEXT:
-                        data = msg.json()
-                        # Coinbase Pro sends a "snapshot" message (full order book) first and then "l2update" messages.
-                        # A production system would merge the snapshot with incremental updates.
-                        if data.get("type") == "snapshot":
-                            standardized = {
-                                "exchange": "coinbase_pro",
-                                "symbol": data.get("product_id"),
-                                "bids": [[float(price), float(size)] for price, size in data.get("bids", [])],
-                                "asks": [[float(price), float(size)] for price, size in data.get("asks", [])],
-                                "timestamp": None  # The snapshot does not include a timestamp, so you might use the current time.
-                            }
-                            callback(standardized)
-                        elif data.get("type") == "l2update":
-                            # l2update messages include only the changes.
-                            changes = data.get("changes", [])
-                            bids = []
-                            asks = []
-                            for change in changes:
-                                side, price, size = change
-                                if side.lower() == "buy":
-                                    bids.append([float(price), float(size)])
-                                else:
-                                    asks.append([float(price), float(size)])
-                            standardized = {
-                                "exchange": "coinbase_pro",
-                                "symbol": data.get("product_id", symbol),
-                                "bids": bids,
-                                "asks": asks,
-                                "timestamp": data.get("time")  # typically an ISO timestamp
-                            }
-                            callback(standardized)
-                    elif msg.type == aiohttp.WSMsgType.ERROR:
-                        print("WebSocket error on Coinbase Pro")
-                        break
\ No newline at end of file
+        book = stream.books.get(data.get("product_id"))
+        if book is None:
+            return
+        if data.get("type") == "snapshot":
+            book.apply_snapshot(data.get("bids", []), data.get("asks", []))
+        elif data.get("type") == "l2update" and book.synced:
+            # Chaque changement : [côté ("buy" / "sell"), prix, nouvelle quantité]
+            bids = [[price, size] for side, price, size in data.get("changes", []) if side.lower() == "buy"]
+            asks = [[price, size] for side, price, size in data.get("changes", []) if side.lower() != "buy"]
+            book.apply_delta(bids, asks, timestamp=data.get("time"))
+        else:
+            return
+        stream.publish(data["product_id"])
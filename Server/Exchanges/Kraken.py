@@ -1,9 +1,9 @@
 # /Server/Exchanges/Kraken.py
-from Exchanges.Abstract import Exchange
-import requests
+from Exchanges.Abstract import Exchange, ExchangeAPIError, InvalidRequestError
 import asyncio
 import aiohttp
-from datetime import datetime
+from Utilities.RateLimiter import RateLimiter
+from Utilities.KlineFormatter import KlineFormatter
 
 class Kraken(Exchange):
     name = "kraken"
@@ -11,6 +11,8 @@ class Kraken(Exchange):
     def __init__(self):
         # URL de base pour les appels REST
         self.BASE_REST_URL = "https://api.kraken.com"
+        # Préfixes des erreurs d'une requête invalide (paire inconnue, paramètre invalide)
+        self.INVALID_REQUEST_ERRORS = ("EQuery:", "EGeneral:Invalid arguments")
         # Mapping des intervalles (en minutes) supportés par Kraken
         self.valid_intervals = {
             "1m": 1,
@@ -21,48 +23,69 @@ class Kraken(Exchange):
             "4h": 240,
             "1d": 1440,
             "1w": 10080,
-            "1M": 21600  # Attention : Kraken ne supporte pas forcément "1M" tel quel, adaptez au besoin.
+            "15d": 21600  # Les mois ("1M") sont reconstitués à partir des chandelles journalières
         }
         # URL de l'API WebSocket de Kraken
-        self.ws_url = "wss://ws.kraken.com"
+        self.ws_order_book_url = "wss://ws.kraken.com"
+        self.truncate_order_book = True
+        # Profondeurs du canal "book" : l'abonnement suit la plus petite qui couvre la profondeur demandée
+        self.order_book_depths = (10, 25, 100, 500, 1000)
 
-    def get_available_trading_pairs(self):
+        # Kraken limite les endpoints publics à environ une requête par seconde
+        self.rate_limiter = RateLimiter(capacity=3, refill_rate=1)
+
+    async def request_json(self, url: str, params: dict = None, weight: float = 1):
+        """
+        Comme Exchange.request_json, en rejouant aussi les requêtes refusées pour dépassement de limite :
+        Kraken signale ces erreurs dans le corps de la réponse ("EAPI:Rate limit exceeded").
         """
-        Récupère la liste des paires de trading disponibles sur Kraken.
+        for attempt in range(self.max_retries):
+            data = await super().request_json(url, params=params, weight=weight)
+            errors = data.get("error") or []
+            if not any("Rate limit" in error or "Too many requests" in error for error in errors):
+                return data
+            self.rate_limiter.penalize(self.rate_limiter.default_backoff * 2 ** attempt)
+        raise ExchangeAPIError(f"Kraken API error: {errors}")
+
+    async def get_instruments(self):
+        """
+        Récupère les paires de trading disponibles sur Kraken et leurs pas de cotation
+        (tick_size, à défaut pair_decimals ; lot_decimals pour la quantité).
         """
         endpoint = f"{self.BASE_REST_URL}/0/public/AssetPairs"
-        response = requests.get(endpoint)
-        if response.status_code == 200:
-            data = response.json()
-            if data.get("error"):
-                raise Exception(f"Kraken API error: {data['error']}")
-            pairs = []
-            for key, value in data["result"].items():
-                # Si le champ 'wsname' est présent, on l'utilise pour afficher le nom de la paire (ex: "XBT/USD")
-                if "wsname" in value:
-                    pairs.append(value["wsname"])
-                else:
-                    pairs.append(key)
-            return pairs
-        else:
-            raise Exception(f"Kraken API error: {response.status_code} - {response.text}")
+        data = await self.request_json(endpoint)
+        if data.get("error"):
+            raise ExchangeAPIError(f"Kraken API error: {data['error']}")
+        instruments = {}
+        for key, value in data["result"].items():
+            # Si le champ 'wsname' est présent, on l'utilise pour afficher le nom de la paire (ex: "XBT/USD")
+            pair = value.get("wsname", key)
+            tick_size = value.get("tick_size")
+            if tick_size is None and "pair_decimals" in value:
+                tick_size = f"1e-{value['pair_decimals']}"
+            instruments[pair] = {
+                "tick_size": tick_size,
+                "lot_size": f"1e-{value['lot_decimals']}" if "lot_decimals" in value else None
+            }
+        return instruments
 
-    async def get_historical_klines(self, symbol, interval, start_time, end_time):
+    async def iter_historical_klines(self, symbol, interval, start_time, end_time):
         """
-        Récupère les chandelles historiques (OHLC) depuis Kraken.
+        Récupère les chandelles historiques (OHLC) depuis Kraken, page par page.
         
         :param symbol: Paire de trading (ex: 'XBT/USD'). À fournir dans le format attendu par Kraken.
         :param interval: Intervalle des chandelles (ex: '1m', '5m', etc.)
         :param start_time: Date de début en timestamp Unix (ms).
         :param end_time: Date de fin en timestamp Unix (ms).
-        :return: Liste de chandelles standardisées.
+        :return: Générateur des pages de chandelles au format colonne, par ordre chronologique.
         """
         if interval not in self.valid_intervals:
-            raise ValueError(f"Invalid interval '{interval}'. Valid intervals are: {', '.join(self.valid_intervals.keys())}")
+            raise InvalidRequestError(f"Invalid interval '{interval}'. Valid intervals are: {', '.join(self.valid_intervals.keys())}")
         ohlc_endpoint = f"{self.BASE_REST_URL}/0/public/OHLC"
         # Kraken attend un paramètre 'since' en secondes
         current_since = int(start_time / 1000)
-        all_candles = []
+        # Les pages successives peuvent se recouvrir : on ne renvoie que les chandelles postérieures à la page précédente
+        next_time = start_time
         
         while current_since * 1000 < end_time:
             params = {
@@ -70,12 +93,11 @@ class Kraken(Exchange):
                 "interval": self.valid_intervals[interval],
                 "since": current_since
             }
-            response = requests.get(ohlc_endpoint, params=params)
-            if response.status_code != 200:
-                raise Exception(f"Kraken API error: {response.status_code} - {response.text}")
-            data = response.json()
+            data = await self.request_json(ohlc_endpoint, params=params)
+            if any(error.startswith(self.INVALID_REQUEST_ERRORS) for error in data.get("error") or []):
+                raise InvalidRequestError(f"Kraken API error: {data['error']}")
             if data.get("error"):
-                raise Exception(f"Kraken API error: {data['error']}")
+                raise ExchangeAPIError(f"Kraken API error: {data['error']}")
             result = data.get("result", {})
             # La clé correspondant à la paire peut différer de 'symbol'. On ignore la clé 'last'
             pair_key = None
@@ -90,129 +112,47 @@ class Kraken(Exchange):
             new_since = int(result.get("last", current_since))
             if new_since == current_since:
                 break  # Évite la boucle infinie s'il n'y a pas de nouvelles données
-            for candle in candles:
-                # Format d'une chandelle Kraken : [ time, open, high, low, close, vwap, volume, count ]
-                ts = int(candle[0]) * 1000  # conversion en ms
-                if ts < start_time or ts > end_time:
-                    continue
-                standardized = {
-                    "timestamp": ts,
-                    "date": datetime.utcfromtimestamp(int(candle[0])).strftime('%Y-%m-%d %H:%M:%S'),
-                    "open": float(candle[1]),
-                    "high": float(candle[2]),
-                    "low": float(candle[3]),
-                    "close": float(candle[4]),
-                    "volume": float(candle[6])
-                }
-                all_candles.append(standardized)
             current_since = new_since
-            await asyncio.sleep(1)  # Petite pause pour éviter de saturer l'API
-        return all_candles
-
-    async def subscribe_order_book(self, symbol: str, callback):
-        """
-        Se connecte au WebSocket de Kraken et s'abonne aux mises à jour du carnet d'ordres pour une paire donnée.
-        Les mises à jour sont appliquées sur un carnet en mémoire qui met à jour la quantité pour chaque prix.
-        Si la quantité devient 0, le niveau est supprimé.
-        Lorsque le message heartbeat est reçu, le carnet (agrégé et trié) est envoyé via callback.
-        
-        :param symbol: Paire de trading (ex: 'XBT/USD')
-        :param callback: Fonction à appeler avec le dictionnaire de données agrégées.
-        """
-        subscription_message = {
-            "event": "subscribe",
-            "pair": [symbol],
-            "subscription": {
-                "name": "book",
-                "depth": 10  # Profondeur du carnet, modifiable selon vos besoins
-            }
-        }
 
-        # Le carnet d'ordres en mémoire :
-        # On utilise deux dictionnaires pour les bids et asks, avec pour clé le prix (float) et pour valeur la quantité (float)
-        order_book = {
-            "bids": {},
-            "asks": {}
-        }
+            # Format d'une chandelle Kraken : [ time (s), open, high, low, close, vwap, volume, count ]
+            klines = KlineFormatter.merge(KlineFormatter.from_raw(candles, (0, 1, 2, 3, 4, 6), time_scale=1000))
+            page = KlineFormatter.slice(klines, next_time, end_time)
+            if len(page["timestamp"]):
+                next_time = int(page["timestamp"][-1]) + 1
+                yield page
 
-        async with aiohttp.ClientSession() as session:
-            async with session.ws_connect(self.ws_url) as ws:
-                await ws.send_json(subscription_message)
-                async for msg in ws:
-                    if msg.type == aiohttp.WSMsgType.TEXT:
-                        data = msg.json()
-                        # Si c'est un message événementiel, on vérifie s'il s'agit d'un heartbeat.
-                        if isinstance(data, dict):
-                            if data.get("event") == "heartbeat":
-                                # À la réception du heartbeat, on prépare la donnée agrégée.
-                                # Pour faciliter la lecture, on convertit les dictionnaires en listes triées.
-                                bids_list = [[price, qty] for price, qty in order_book["bids"].items()]
-                                # Tri décroissant pour les bids (les meilleurs prix en premier)
-                                bids_list.sort(key=lambda x: x[0], reverse=True)
-                                asks_list = [[price, qty] for price, qty in order_book["asks"].items()]
-                                # Tri croissant pour les asks
-                                asks_list.sort(key=lambda x: x[0])
-                                aggregated = {
-                                    "bids": bids_list,
-                                    "asks": asks_list,
-                                    "timestamp": None  # Vous pouvez ajouter un timestamp ici si besoin
-                                }
-                                # Tri décroissant pour les bids (les meilleurs prix en premier)
-                                aggregated["bids"].sort(key=lambda x: x[0], reverse=True)
-                                # Tri croissant pour les asks
-                                aggregated["asks"].sort(key=lambda x: x[0])
-                                # Prendre 10 niveaux pour chaque côté du carnet
-                                aggregated["bids"] = aggregated["bids"][:10]
-                                aggregated["asks"] = aggregated["asks"][:10]
+    def order_book_subscribe_message(self, symbols, depth=None):
+        return {"event": "subscribe", "pair": list(symbols), "subscription": {"name": "book", "depth": depth or self.order_book_depth}}
 
-                                # Envoie les données agrégées via la callback
-                                callback(aggregated)
-                                # On continue sans modifier le carnet (les mises à jour continueront d'être appliquées)
-                                continue
-                            # On ignore les autres événements comme "subscriptionStatus"
-                            elif data.get("event") in ["subscriptionStatus"]:
-                                continue
+    def order_book_unsubscribe_message(self, symbols, depth=None):
+        return {"event": "unsubscribe", "pair": list(symbols), "subscription": {"name": "book", "depth": depth or self.order_book_depth}}
 
-                        # Les mises à jour du carnet arrivent sous forme de liste
-                        elif isinstance(data, list):
-                            if len(data) < 4:
-                                continue
-                            update = data[1]
-                            # Traitement des bids
-                            if "bs" in update:  # Snapshot initiale
-                                for item in update["bs"]:
-                                    price = float(item[0])
-                                    qty = float(item[1])
-                                    if qty > 0:
-                                        order_book["bids"][price] = qty
-                                    elif price in order_book["bids"]:
-                                        del order_book["bids"][price]
-                            elif "b" in update:  # Mises à jour incrémentielles
-                                for item in update["b"]:
-                                    price = float(item[0])
-                                    qty = float(item[1])
-                                    if qty > 0:
-                                        order_book["bids"][price] = qty
-                                    elif price in order_book["bids"]:
-                                        del order_book["bids"][price]
-
-                            # Traitement des asks
-                            if "as" in update:  # Snapshot initiale
-                                for item in update["as"]:
-                                    price = float(item[0])
-                                    qty = float(item[1])
-                                    if qty > 0:
-                                        order_book["asks"][price] = qty
-                                    elif price in order_book["asks"]:
-                                        del order_book["asks"][price]
-                            elif "a" in update:  # Mises à jour incrémentielles
-                                for item in update["a"]:
-                                    price = float(item[0])
-                                    qty = float(item[1])
-                                    if qty > 0:
-                                        order_book["asks"][price] = qty
-                                    elif price in order_book["asks"]:
-                                        del order_book["asks"][price]
-                    elif msg.type == aiohttp.WSMsgType.ERROR:
-                        print("WebSocket error on Kraken")
-                        break
\ No newline at end of file
+    async def handle_order_book_message(self, stream, connection, data):
+        """
+        Applique un message du canal "book". Le premier message d'une paire contient le snapshot ("as" / "bs"),
+        les suivants les niveaux modifiés ("a" / "b", quantité nulle : niveau supprimé). Comme le demande Kraken,
+        le carnet local est tronqué à la profondeur de l'abonnement après chaque mise à jour.
+        """
+        # Les messages événementiels (heartbeat, subscriptionStatus...) sont des dictionnaires
+        # Les données du carnet arrivent sous forme de liste :
+        # [channelID, {"a": [...]}, {"b": [...]}, "book-10", "XBT/USD"] (un ou deux dictionnaires)
+        if not isinstance(data, list) or len(data) < 4:
+            return
+        symbol = data[-1]
+        book = stream.books.get(symbol)
+        if book is None:
+            return
+        updates = [update for update in data[1:-2] if isinstance(update, dict)]
+        # Chaque niveau : [prix, quantité, timestamp (s)]
+        levels = [level for update in updates for side in ("as", "bs", "a", "b") for level in update.get(side, [])]
+        timestamp = int(max(float(level[2]) for level in levels) * 1000) if levels else None
+        if any("as" in update or "bs" in update for update in updates):
+            snapshot = {side: level for update in updates for side, level in update.items()}
+            book.apply_snapshot(snapshot.get("bs", []), snapshot.get("as", []), timestamp=timestamp)
+        elif book.synced:
+            bids = [level for update in updates for level in update.get("b", [])]
+            asks = [level for update in updates for level in update.get("a", [])]
+            book.apply_delta(bids, asks, timestamp=timestamp)
+        else:
+            return
+        stream.publish(symbol)
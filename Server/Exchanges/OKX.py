@@ -1,8 +1,9 @@
-from Exchanges.Abstract import Exchange
-import requests
+from Exchanges.Abstract import Exchange, ExchangeAPIError, InvalidRequestError
 import asyncio
 import aiohttp
-from datetime import datetime
+from Utilities.RateLimiter import RateLimiter
+from Utilities.KlineFormatter import KlineFormatter
+from Utilities.OrderBook import SequenceGap
 
 class OKX(Exchange):
     """
@@ -14,7 +15,17 @@ class OKX(Exchange):
         self.KLINE_URL = "/api/v5/market/candles"
         self.SYMBOLE_URL = "/api/v5/public/instruments"
         self.limit = 100  # OKX limite à 100 chandelles par requête
+        # Codes d'erreur d'une requête invalide (paramètre invalide, instrument inconnu)
+        self.INVALID_REQUEST_CODES = ("51000", "51001")
+        self.ws_order_book_url = "wss://ws.okx.com:8443/ws/v5/public"
+        self.max_concurrency = 4
 
+        # OKX limite l'endpoint des chandelles à 40 requêtes / 2s (20 / 2s pour les instruments)
+        self.rate_limiter = RateLimiter(capacity=40, refill_rate=20)
+
+        # Au-delà de 4h, les chandelles OKX par défaut suivent l'heure de Hong Kong (UTC+8) :
+        # on demande les chandelles UTC ("utc"), alignées sur celles des autres exchanges
+        # et sur les regroupements de KlineFormatter (jours UTC, semaines commençant le lundi)
         self.valid_intervals = {
             "1m": "1m",
             "3m": "3m",
@@ -24,136 +35,128 @@ class OKX(Exchange):
             "1h": "1H",
             "2h": "2H",
             "4h": "4H",
-            "6h": "6H",
-            "12h": "12H",
-            "1d": "1D",
-            "2d": "2D",
-            "3d": "3D",
-            "1w": "1W",
-            "1M": "1M",
-            "3M": "3M",
+            "6h": "6Hutc",
+            "12h": "12Hutc",
+            "1d": "1Dutc",
+            "2d": "2Dutc",
+            "3d": "3Dutc",
+            "1w": "1Wutc",
+            "1M": "1Mutc",
+            "3M": "3Mutc",
         }
 
     def process_klines(self, klines):
         """
-        Convertit les données
+        Convertit les données brutes (triées par ordre chronologique) en colonnes typées.
+        Format d'une chandelle OKX : [ ts, open, high, low, close, vol, volCcy, volCcyQuote, confirm ]
         """
-        klines = klines[::-1]
-        
-        return [
-            {
-                "timestamp": int(kline[0]),
-                "date": datetime.utcfromtimestamp(int(kline[0]) / 1000).strftime('%Y-%m-%d %H:%M:%S'),
-                "open": float(kline[1]),
-                "high": float(kline[2]),
-                "low": float(kline[3]),
-                "close": float(kline[4]),
-                "volume": float(kline[5]),
-            }
-            for kline in klines
-        ]
+        return KlineFormatter.from_raw(klines, (0, 1, 2, 3, 4, 5))
 
-    async def get_historical_klines(self, symbol, interval, start_time, end_time):
+    async def iter_historical_klines(self, symbol, interval, start_time, end_time):
         """
-        Récupère des chandelles historiques entre start_time et end_time.
+        Récupère des chandelles historiques entre start_time et end_time, page par page.
 
         :param symbol: Symbole de trading (ex: 'BTC-USDT').
         :param interval: Intervalle des chandelles (ex: '1m', '5m', '1H', '1D').
         :param start_time: Timestamp Unix (ms) de début.
         :param end_time: Timestamp Unix (ms) de fin.
-        :return: Liste des chandelles.
+        :return: Générateur des pages de chandelles au format colonne, par ordre chronologique.
         """
         
-        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=False)) as session:
-            endpoint = f"{self.BASE_REST_URL}{self.KLINE_URL}"
+        endpoint = f"{self.BASE_REST_URL}{self.KLINE_URL}"
+
+        async def fetch_shard(shard_start, shard_end):
+            # OKX pagine à rebours : "after" renvoie les chandelles plus anciennes que ce timestamp
             klines = []
-            old_data = {}
-            while start_time < end_time:
+            after = shard_end + 1
+            while after > shard_start:
                 params = {
                     "instId": symbol,  # Instrument ID
                     "bar": self.valid_intervals[interval],   # Intervalle
-                    "after": end_time,  # Temps de début
+                    "after": after,  # Renvoie les chandelles antérieures à ce timestamp
                     "limit": self.limit  # Maximum par requête
                 }
-                async with session.get(endpoint, params=params) as response:
-                    data = await response.json()
+                data = await self.request_json(endpoint, params=params)
+                if data.get("code") in self.INVALID_REQUEST_CODES:
+                    raise InvalidRequestError(f"OKX API error: {data}")
+                if "data" not in data or data.get("code") not in (None, "0"):
+                    raise ExchangeAPIError(f"OKX API error: {data}")
+                if not len(data["data"]):
+                    break
+                klines.extend(data["data"])
 
-                    if "data" in data:
-                        if not len(data["data"]) or data == old_data:
-                            break
-                        klines.extend(data["data"])
+                # Recule jusqu'à la plus ancienne chandelle récupérée
+                oldest_candle_time = int(data["data"][-1][0])
+                if oldest_candle_time >= after:
+                    break  # Évite la boucle infinie si l'API ne recule plus
+                after = oldest_candle_time
 
-                        # Avance le start_time à la fin de la dernière chandelle récupérée
-                        last_candle_time = int(data["data"][-1][0])  # Timestamp de la dernière chandelle
-                        end_time = last_candle_time - 1
-                        old_data = data
-                        await asyncio.sleep(0.2)  # Petite pause pour éviter les limitations d'API
-                    else:
-                        print(data, "Error, retrying...")
-                        await asyncio.sleep(5)  # Pause plus longue en cas d'erreur
+            # Filtrer les chandelles hors du shard
+            return [kline for kline in klines if shard_start <= int(kline[0]) <= shard_end]
 
-            # Filtrer les chandelles avec un timestamp inférieur à start_time
-            klines = [kline for kline in klines if int(kline[0]) >= start_time]
-            return self.process_klines(klines)
+        # Les shards (une page chacun) sont téléchargés en parallèle et renvoyés dans l'ordre chronologique
+        async for page in self.iter_shards(self.split_range(interval, start_time, end_time), fetch_shard):
+            yield self.process_klines(page)
 
-    def get_available_trading_pairs(self):
+    async def get_instruments(self):
         """
-        Récupère la liste des paires de trading disponibles sur OKX.
+        Récupère les paires de trading disponibles sur OKX et leurs pas de cotation (tickSz, lotSz).
         """
         base_url = f"{self.BASE_REST_URL}{self.SYMBOLE_URL}"
         params = {"instType": "SPOT"}  # Exemple pour récupérer uniquement les instruments Spot
-        response = requests.get(base_url, params=params)
-        if response.status_code == 200:
-            data = response.json()
-            if "data" in data:
-                return [instrument["instId"] for instrument in data["data"]]
-            else:
-                raise Exception("OKX API error: No data found in response.")
+        # L'endpoint des instruments a un budget deux fois plus faible que celui des chandelles
+        data = await self.request_json(base_url, params=params, weight=2)
+        if "data" in data:
+            return {
+                instrument["instId"]: {"tick_size": instrument.get("tickSz"), "lot_size": instrument.get("lotSz")}
+                for instrument in data["data"]
+            }
         else:
-            raise Exception(f"OKX API error: {response.status_code} - {response.text}")
+            raise ExchangeAPIError(f"OKX API error: No data found in response: {data}")
 
-    async def subscribe_order_book(self, symbol: str, callback):
+    def order_book_subscribe_message(self, symbols, depth=None):
+        return {"op": "subscribe", "args": [{"channel": "books", "instId": symbol} for symbol in symbols]}
+
+    def order_book_unsubscribe_message(self, symbols, depth=None):
+        return {"op": "unsubscribe", "args": [{"channel": "books", "instId": symbol} for symbol in symbols]}
+
+    async def handle_order_book_message(self, stream, connection, data):
         """
-        Connect to OKX’s WebSocket and subscribe to order book updates for a given symbol.
-        The callback is called with standardized order book data.
-        
-        :param symbol: Trading pair symbol (e.g., 'BTC-USDT')
-        :param callback: A function to be called with the standardized order book dict.
+        Applique un message du canal "books" (snapshot de 400 niveaux puis mises à jour incrémentielles).
+        Chaque mise à jour porte son seqId et celui de la précédente (prevSeqId) : en cas de trou,
+        on se réabonne au symbole pour recevoir un nouveau snapshot.
         """
-        # OKX WebSocket public endpoint
-        ws_endpoint = "wss://ws.okx.com:8443/ws/v5/public"
-        # Build a subscription message – here we use the "books5" channel (a 5‐level order book)
-        subscription_message = {
-            "op": "subscribe",
-            "args": [{
-                "channel": "books5",
-                "instId": symbol
-            }]
-        }
-        async with aiohttp.ClientSession() as session:
-            async with session.ws_connect(ws_endpoint) as ws:
-                # Send the subscription message
-                await ws.send_json(subscription_message)
-                async for msg in ws:
-                    if msg.type == aiohttp.WSMsgType.TEXT:
-                        data = msg.json()
-                        # OKX typically sends messages in the format:
-                        # {
-                        #   "arg": {"channel": "books5", "instId": "BTC-USDT"},
-                        #   "data": [{
-                        #         "bids": [["9999", "0.2", "1"], ...],
-                        #         "asks": [["10000", "0.1", "1"], ...],
-                        #         "ts": "1578969180502"
-                        #     }]
-                        # }
-                        if "data" in data:
-                            order_data = data["data"][0]
-                            standardized = {
-                                "bids": [[float(item[0]), float(item[1])] for item in order_data.get("bids", [])],
-                                "asks": [[float(item[0]), float(item[1])] for item in order_data.get("asks", [])],
-                                "timestamp": order_data.get("ts")
-                            }
-                            callback(standardized)
-                    elif msg.type == aiohttp.WSMsgType.ERROR:
-                        print("WebSocket error on OKX")
-                        break
\ No newline at end of file
+        # Format des messages :
+        # {
+        #   "arg": {"channel": "books", "instId": "BTC-USDT"},
+        #   "action": "snapshot" | "update",
+        #   "data": [{
+        #         "bids": [["9999", "0.2", "0", "1"], ...],
+        #         "asks": [["10000", "0.1", "0", "1"], ...],
+        #         "ts": "1578969180502", "seqId": 123, "prevSeqId": 122, "checksum": ...
+        #     }]
+        # }
+        if "data" not in data:
+            return
+        symbol = data["arg"]["instId"]
+        book = stream.books.get(symbol)
+        if book is None:
+            return
+        order_data = data["data"][0]
+        if data.get("action") == "snapshot":
+            book.apply_snapshot(order_data["bids"], order_data["asks"], sequence=order_data["seqId"], timestamp=order_data.get("ts"))
+        elif not book.synced:
+            return  # Réabonnement en cours : on attend le snapshot
+        else:
+            try:
+                book.apply_delta(
+                    order_data["bids"], order_data["asks"],
+                    sequence=order_data["seqId"], prev_sequence=order_data["prevSeqId"], timestamp=order_data.get("ts")
+                )
+            except SequenceGap as e:
+                print(f"[OKX] Order book gap on {symbol} ({e}), resubscribing")
+                stream.mark_stale(symbol)
+                await connection.send(self.order_book_unsubscribe_message([symbol]))
+                await connection.send(self.order_book_subscribe_message([symbol]))
+                return
+        stream.publish(symbol)
@@ -1,9 +1,10 @@
+from Exchanges.Abstract import ExchangeAPIError, InvalidRequestError
 from Exchanges.Binance import Binance, binance_order_books
 from Exchanges.OKX import OKX
 from Exchanges.CoinbasePro import CoinbasePro
 from Exchanges.Kraken import Kraken
 
-__all__ = ["Binance", "OKX", "CoinbasePro", "Kraken", "binance_order_books"]
+__all__ = ["Binance", "OKX", "CoinbasePro", "Kraken", "binance_order_books", "ExchangeAPIError", "InvalidRequestError"]
 
 exchange_dict = {
     "binance": Binance(),
@@ -1,26 +1,30 @@
 from Utilities.Authentification import LoginRequest, RegisterRequest, TokenResponse, create_token, verify_token, verify_ws_token, invalidate_token
 from Utilities.DataBaseManager import dbm
-from Utilities.SubscriptionManager import AggregatedSubscriptionManager
-from Utilities.SymbolFormatter import AdvancedSymbolFormatter
+from Utilities.SubscriptionManager import AggregatedSubscriptionManager, ClientConnection, PUBLISH_MODES, parse_view_options
+from Utilities.SymbolCatalog import symbol_catalog
 from Utilities.TWAPOrder import simulate_twap_order, TWAPOrderRequest
-from Exchanges import exchange_dict
-from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, Query, Depends
+from Utilities.KlineCache import kline_cache, KlineBatchRequest
+from Utilities.Compression import CompressionMiddleware, strip_etag_encoding
+from Utilities.KlineFormatter import KlineFormatter, KlineStreamEncoder, KLINE_FORMATS, KLINE_STREAM_FORMATS
+from Exchanges import exchange_dict, ExchangeAPIError, InvalidRequestError
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect, Query, Depends, Response, Header
+from fastapi.responses import StreamingResponse, JSONResponse
 from fastapi.security import HTTPAuthorizationCredentials
 from datetime import datetime
 import pandas as pd
 import asyncio
+import hashlib
+import time
 
 
 
 
 app = FastAPI(title="Exchange API", description="dev version")
+# Compression négociée (zstd, br, gzip) des réponses de plus de 1 Ko
+app.add_middleware(CompressionMiddleware, minimum_size=1024, levels={"gzip": 6, "br": 4, "zstd": 3})
 
-symbols_dict = {
-    exchange: exchange_obj.get_available_trading_pairs()
-    for exchange, exchange_obj in exchange_dict.items()
-}
-
-formatter = AdvancedSymbolFormatter(symbols_dict)
+# Le formatter des symboles est fourni par symbol_catalog (chargé depuis l'instantané disque au démarrage,
+# puis reconstruit en tâche de fond) : toujours y accéder via symbol_catalog.formatter
 subscription_manager = AggregatedSubscriptionManager()
 
 @app.get("/health")
@@ -43,12 +47,24 @@ async def get_exchanges():
 ############################################################################################################
 
 @app.get("/{exchange}/symbols")
-def get_symbols(exchange: str):
+async def get_symbols(exchange: str):
     """Endpoint to get list of available trading pairs for a given exchange"""
     if exchange not in exchange_dict:
         raise HTTPException(status_code=404, detail="Exchange not found")
     
-    return {"symbols": exchange_dict[exchange].get_available_trading_pairs()}
+    return {"symbols": await symbol_catalog.get_pairs(exchange)}
+
+@app.get("/listings/{symbol}")
+async def get_listings(symbol: str):
+    """
+    Endpoint to get the exchanges listing a trading pair (any input format), with their native symbol.
+    Example: /listings/BTC-USD -> {"symbol": "BTC-USD", "exchanges": {"binance": "BTCUSDT", "kraken": "XBT/USD", ...}}
+    """
+    formatter = symbol_catalog.formatter
+    listings = formatter.get_listings(symbol)
+    if not listings:
+        raise HTTPException(status_code=404, detail=f"Symbol '{symbol}' is not listed on any exchange")
+    return {"symbol": formatter.to_standard(symbol), "exchanges": listings}
 
 ############################################################################################################
 # Request historical data
@@ -62,43 +78,293 @@ def parse_date(date_str: str) -> int:
             pass
     raise ValueError(f"Invalid date format: {date_str}. Supported formats are YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS.")
 
+def parse_range(start_date: str, end_date: str) -> tuple[int, int]:
+    """
+    Convertit les dates de début et de fin en timestamps (ms), par défaut les 5 derniers jours.
+    Une date mal formée ou une plage vide donne une erreur 400.
+    """
+    try:
+        start_time = parse_date(start_date) if start_date is not None else None
+        end_time = parse_date(end_date) if end_date is not None else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if start_time is None:
+        start_time = int((pd.to_datetime("today") - pd.DateOffset(days=5)).timestamp() * 1000)
+    
+    if end_time is None:
+        end_time = int(pd.to_datetime("today").timestamp() * 1000)
+    
+    if start_time >= end_time:
+        raise HTTPException(status_code=400, detail="Invalid date range")
+    return start_time, end_time
+
+@app.get("/klines/{symbol}")
+async def get_aligned_klines(
+        symbol: str,
+        exchanges: str = Query(None, description="Comma-separated exchanges, e.g. binance,okx (default: all)"),
+        start_date: str = Query(None, description="Start date in format YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS"),
+        end_date: str = Query(None, description="End date in format YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS"),
+        interval: str = Query("1d", description="Candle interval, e.g., 1m, 5m, 1h"),
+        fill: str = Query("none", description="Missing candles: none (null values) or ffill (flat candle at the last close, zero volume)"),
+        composite: bool = Query(False, description="Add a volume-weighted composite series across exchanges")
+):
+    """
+    Chandelles d'un symbole standard sur plusieurs exchanges, récupérées en parallèle et alignées
+    sur un index de temps commun (format colonne). Les exchanges en erreur sont listés dans "errors".
+    """
+    formatter = symbol_catalog.formatter
+    # Par défaut, tous les exchanges qui listent le symbole
+    names = exchanges.split(",") if exchanges else [name for name in exchange_dict if formatter.is_listed(symbol, name)]
+    if not names:
+        raise HTTPException(status_code=404, detail=f"Symbol '{symbol}' is not listed on any exchange")
+    unknown = [name for name in names if name not in exchange_dict]
+    if unknown:
+        raise HTTPException(status_code=404, detail=f"Exchange not found: {', '.join(unknown)}")
+    if fill not in ("none", "ffill"):
+        raise HTTPException(status_code=400, detail=f"Invalid fill '{fill}'. Valid values are: none, ffill")
+
+    start_time, end_time = parse_range(start_date, end_date)
+
+    async def fetch(name: str):
+        if not formatter.is_listed(symbol, name):
+            raise ValueError(f"'{symbol}' is not listed on {name}")
+        exchange_obj = exchange_dict[name]
+        return await kline_cache.get_klines(exchange_obj, formatter.to_exchange(symbol, name), interval, start_time, end_time)
+
+    results = await asyncio.gather(*(fetch(name) for name in names), return_exceptions=True)
+    series, errors = {}, {}
+    for name, result in zip(names, results):
+        if isinstance(result, Exception):
+            print(f"Error fetching klines for {name} - {symbol}: {result}")
+            errors[name] = str(result)
+        else:
+            series[name] = result
+    if not series:
+        # Requête invalide partout (symbole non listé, intervalle invalide) : erreur du client ;
+        # sinon au moins un exchange est en erreur ou injoignable
+        invalid = all(isinstance(result, ValueError) for result in results)
+        raise HTTPException(status_code=400 if invalid else 502, detail={"errors": errors})
+
+    index, aligned = await asyncio.to_thread(KlineFormatter.align, series, fill)
+
+    def fields(columns: dict) -> dict:
+        # Le timestamp est commun à toutes les séries : il n'est renvoyé qu'une fois
+        return {key: values for key, values in KlineFormatter.to_columns_json(columns).items() if key != "timestamp"}
+
+    response = {
+        "symbol": symbol,
+        "interval": interval,
+        "timestamp": index.tolist(),
+        "exchanges": {name: fields(columns) for name, columns in aligned.items()},
+        "errors": errors,
+    }
+    if composite:
+        response["composite"] = fields(KlineFormatter.composite(aligned))
+    return response
+
+@app.post("/klines/batch")
+async def get_klines_batch(request: KlineBatchRequest):
+    """
+    Chandelles de nombreuses paires (exchange, symbole) sur un même intervalle et une même plage,
+    en une seule requête. Les téléchargements sont ordonnancés sous les limites de chaque exchange.
+    La réponse est une table "longue" au format colonne (une ligne par chandelle, avec les colonnes
+    "exchange" et "symbol"), en JSON ("columns"), Arrow ou Parquet. Les paires en erreur sont listées
+    dans "errors" (pour les formats binaires, leur nombre est renvoyé dans l'en-tête X-Kline-Errors).
+    # Example query:
+    {
+        "pairs": [{"exchange": "binance", "symbol": "BTC-USD"}, {"exchange": "okx", "symbol": "ETH-USD"}],
+        "interval": "1h",
+        "start_date": "2025-01-01",
+        "end_date": "2025-01-07"
+    }
+    """
+    if request.format not in ("columns", "arrow", "parquet"):
+        raise HTTPException(status_code=400, detail=f"Invalid format '{request.format}'. Valid formats are: columns, arrow, parquet")
+
+    unknown = {pair.exchange for pair in request.pairs if pair.exchange not in exchange_dict}
+    if unknown:
+        raise HTTPException(status_code=404, detail=f"Exchange not found: {', '.join(sorted(unknown))}")
+
+    # Les paramètres communs à toutes les paires sont validés une fois, avant les téléchargements :
+    # un intervalle refusé par tous les exchanges de la requête est une erreur du client
+    start_time, end_time = parse_range(request.start_date, request.end_date)
+    names = sorted({pair.exchange for pair in request.pairs})
+    interval_errors = {}
+    for name in names:
+        try:
+            exchange_dict[name].resolve_interval(request.interval)
+        except ValueError as e:
+            interval_errors[name] = str(e)
+    if names and len(interval_errors) == len(names):
+        raise HTTPException(status_code=400, detail={"errors": interval_errors})
+
+    pairs = [
+        (exchange_dict[pair.exchange], symbol_catalog.formatter.to_exchange(pair.symbol, pair.exchange))
+        for pair in request.pairs
+    ]
+    results = await kline_cache.get_batch(pairs, start_time, end_time, request.interval)
+
+    parts, errors = [], []
+    for pair, result in zip(request.pairs, results):
+        if isinstance(result, Exception):
+            print(f"Error fetching klines for {pair.exchange} - {pair.symbol}: {result}")
+            errors.append({"exchange": pair.exchange, "symbol": pair.symbol, "error": str(result)})
+        else:
+            parts.append(({"exchange": pair.exchange, "symbol": pair.symbol}, result))
+    table = await asyncio.to_thread(KlineFormatter.concat_labeled, parts, ("exchange", "symbol"))
+
+    if request.format == "columns":
+        return {
+            "interval": request.interval,
+            "exchange": table["exchange"].tolist(),
+            "symbol": table["symbol"].tolist(),
+            **KlineFormatter.to_columns_json(table),
+            "errors": errors,
+        }
+    try:
+        content = await asyncio.to_thread(KlineFormatter.encode, table, request.format)
+    except ImportError:
+        raise HTTPException(status_code=501, detail=f"Format '{request.format}' requires the optional 'pyarrow' dependency")
+    return Response(content=content, media_type=KLINE_FORMATS[request.format], headers={"X-Kline-Errors": str(len(errors))})
+
 @app.get("/klines/{exchange}/{symbol}")
 async def get_klines(
         exchange: str,
         symbol: str,
         start_date: str = Query(None, description="Start date in format YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS"),
         end_date: str = Query(None, description="End date in format YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS"),
-        interval: str = Query("1d", description="Candle interval, e.g., 1m, 5m, 1h")
+        interval: str = Query("1d", description="Candle interval, e.g., 1m, 5m, 1h"),
+        response_format: str = Query("json", alias="format", description="Response format: json (rows), columns (one array per field), arrow, parquet or npy"),
+        stream: bool = Query(False, description="Stream candles page by page as they arrive (json, columns or arrow only)"),
+        if_none_match: str = Header(None)
 ):
     if exchange not in exchange_dict:
         raise HTTPException(status_code=404, detail="Exchange not found")
+
+    if response_format not in KLINE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid format '{response_format}'. Valid formats are: {', '.join(KLINE_FORMATS.keys())}")
+
+    if stream and response_format not in KLINE_STREAM_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Format '{response_format}' cannot be streamed. Streamable formats are: {', '.join(KLINE_STREAM_FORMATS.keys())}")
     
     exchange_obj = exchange_dict[exchange]
 
     # Conversion du symbole standard en symbole propre à l'exchange.
     # Par exemple, "BTC-USD" devient "BTCUSDT" pour Binance, "BTC-USDT" pour OKX et "BTC/USD" pour Kraken.
-    formatted_symbol = formatter.to_exchange(symbol, exchange)
+    formatted_symbol = symbol_catalog.formatter.to_exchange(symbol, exchange)
     print(f"Input symbol: {symbol} converted to exchange-specific format: {formatted_symbol}")
 
-    if start_date is not None:
-        start_time = parse_date(start_date)
-    else:
-        start_time = int((pd.to_datetime("today") - pd.DateOffset(days=5)).timestamp() * 1000)
-    
-    if end_date is not None:
-        end_time = parse_date(end_date)
-    else:
-        end_time = int(pd.to_datetime("today").timestamp() * 1000)
-    
-    if start_time >= end_time:
-        raise HTTPException(status_code=400, detail="Invalid date range")
-    
-    if interval not in exchange_obj.valid_intervals:
-        raise HTTPException(status_code=400, detail=f"Invalid interval '{interval}'. Valid intervals are: {', '.join(exchange_obj.valid_intervals.keys())}")
+    start_time, end_time = parse_range(start_date, end_date)
+
+    # Les intervalles non natifs sont reconstitués à partir de l'intervalle natif le plus proche
+    try:
+        exchange_obj.resolve_interval(interval)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     print(f"Getting klines for {exchange} - {formatted_symbol} - {interval} - {start_date} - {end_date}")
-    klines = await exchange_obj.get_historical_klines(formatted_symbol, interval, start_time, end_time)
-    return klines
+    if stream:
+        # Le contenu n'est connu qu'une fois envoyé : pas d'ETag pour une réponse en flux
+        return await stream_klines(exchange_obj, formatted_symbol, interval, start_time, end_time, response_format)
+
+    # Les requêtes identiques simultanées partagent un même téléchargement et les résultats récents
+    # sont gardés en mémoire ; sinon les chandelles clôturées déjà connues sont servies depuis
+    # le stockage local et seules les plages manquantes sont demandées à l'exchange.
+    try:
+        klines = await kline_cache.get_klines(exchange_obj, formatted_symbol, interval, start_time, end_time)
+    except ExchangeAPIError as e:
+        raise exchange_http_error(e)
+
+    # L'ETag est calculé à partir des chandelles renvoyées : il ne change que si le contenu change
+    # (nouvelle chandelle, chandelle en cours modifiée, plage complétée après une réponse partielle)
+    etag = kline_etag(klines, response_format)
+    open_candle_start = int(KlineFormatter.bucket_starts([int(time.time() * 1000)], interval)[0])
+    closed = KlineFormatter.next_bucket_start(end_time, interval) <= open_candle_start
+    if closed and len(klines["timestamp"]) >= KlineFormatter.bucket_count(start_time, end_time, interval):
+        # Plage passée et complète : elle ne changera plus
+        cache_control = "public, max-age=31536000, immutable"
+    else:
+        # Plage en cours, ou plage passée vide ou incomplète (réponse partielle de l'exchange) :
+        # la réponse n'est gardée que le temps du cache mémoire
+        cache_control = f"public, max-age={int(kline_cache.ttl(interval, end_time))}"
+    cache_headers = {"ETag": etag, "Cache-Control": cache_control}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=cache_headers)
+
+    response = await encode_klines(klines, response_format)
+    if not isinstance(response, Response):
+        response = JSONResponse(content=response)
+    response.headers.update(cache_headers)
+    return response
+
+def exchange_http_error(error: ExchangeAPIError) -> HTTPException:
+    """
+    Erreur HTTP correspondant à une erreur de l'exchange : 400 si la requête est invalide
+    (symbole ou intervalle), 502 si l'exchange est en erreur ou injoignable.
+    """
+    print(f"Exchange error: {error}")
+    if isinstance(error, InvalidRequestError):
+        return HTTPException(status_code=400, detail=str(error))
+    return HTTPException(status_code=502, detail=str(error))
+
+def kline_etag(klines: dict, response_format: str) -> str:
+    """ETag fort calculé à partir des colonnes d'une réponse /klines et de son format."""
+    digest = hashlib.sha1(response_format.encode())
+    for field, values in klines.items():
+        digest.update(field.encode())
+        digest.update(values.tobytes())
+    return '"' + digest.hexdigest() + '"'
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Indique si l'en-tête If-None-Match du client désigne l'ETag courant."""
+    if not if_none_match:
+        return False
+    # Le suffixe d'encodage ajouté par CompressionMiddleware ('"abc-gzip"') est ignoré
+    candidates = [strip_etag_encoding(candidate.strip().removeprefix("W/")) for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+async def encode_klines(klines: dict, response_format: str):
+    """
+    Met en forme les chandelles (au format colonne) selon le format de réponse demandé.
+    Les formats binaires sont encodés hors de la boucle d'événements.
+    """
+    if response_format == "json":
+        return KlineFormatter.to_records(klines)
+    if response_format == "columns":
+        return KlineFormatter.to_columns_json(klines)
+    try:
+        content = await asyncio.to_thread(KlineFormatter.encode, klines, response_format)
+    except ImportError:
+        raise HTTPException(status_code=501, detail=f"Format '{response_format}' requires the optional 'pyarrow' dependency")
+    return Response(content=content, media_type=KLINE_FORMATS[response_format])
+
+async def stream_klines(exchange_obj, symbol: str, interval: str, start_time: int, end_time: int, response_format: str):
+    """
+    Réponse en flux : chaque page de chandelles est sérialisée et envoyée dès sa réception,
+    sans attendre la fin de la pagination ni garder toute la plage en mémoire.
+    La première page est attendue avant l'envoi des en-têtes, pour qu'une erreur de l'exchange
+    (symbole inconnu, exchange injoignable) reçoive encore un code HTTP adapté.
+    """
+    try:
+        encoder = KlineStreamEncoder(response_format)
+    except ImportError:
+        raise HTTPException(status_code=501, detail=f"Format '{response_format}' requires the optional 'pyarrow' dependency")
+
+    pages = kline_cache.iter_klines(exchange_obj, symbol, interval, start_time, end_time)
+    try:
+        first_page = await anext(pages, None)
+    except ExchangeAPIError as e:
+        raise exchange_http_error(e)
+
+    async def generate():
+        if first_page is not None:
+            yield await asyncio.to_thread(encoder.encode, first_page)
+            async for page in pages:
+                yield await asyncio.to_thread(encoder.encode, page)
+        yield encoder.close()
+
+    return StreamingResponse(generate(), media_type=KLINE_STREAM_FORMATS[response_format])
 
 ############################################################################################################
 # Authentification
@@ -185,8 +451,18 @@ async def websocket_endpoint(websocket: WebSocket, token: str = Query(...)):
        ws://localhost:8000/ws?token=VOTRE_TOKEN
     Les clients envoient des messages JSON de la forme :
       {"action": "subscribe", "exchange": "kraken", "symbol": "BTC-USD"}
+      {"action": "subscribe", "symbol": "BTC-USD", "mode": "delta"}
+      {"action": "subscribe", "symbol": "BTC-USD", "depth": 50, "max_rate": 1, "group": 1}
+      {"action": "resync", "symbol": "BTC-USD"}
       {"action": "unsubscribe", "exchange": "kraken", "symbol": "BTC-USD"}
-    Le serveur diffuse ensuite, toutes les secondes, les données agrégées des carnets d'ordres.
+    Sans "exchange", l'abonnement (ou le désabonnement) porte sur tous les exchanges qui listent le symbole
+    (voir /listings/{symbol}).
+    Le serveur diffuse ensuite les données agrégées des carnets d'ordres à chaque changement
+    (au plus une fois par min_publish_interval, voir AggregatedSubscriptionManager).
+    En mode "delta", le client reçoit un snapshot numéroté puis seulement les niveaux modifiés ;
+    s'il détecte un trou dans les numéros de séquence, il demande un nouveau snapshot avec "resync".
+    "depth" (niveaux par côté), "max_rate" (diffusions par seconde) et "group" (pas de regroupement des prix)
+    sont optionnels : les clients qui demandent les mêmes paramètres partagent la même diffusion.
     """
     try:
         # On attend que la fonction vérifie le token et retourne le username.
@@ -199,6 +475,8 @@ async def websocket_endpoint(websocket: WebSocket, token: str = Query(...)):
 
     # Si le token est valide, on accepte la connexion
     await websocket.accept()
+    # Tous les envois passent par la file du client (voir ClientConnection)
+    client = ClientConnection(websocket)
 
     # Le reste de votre logique d’abonnement, par exemple en utilisant votre AggregatedSubscriptionManager
     client_subscriptions = set()
@@ -211,22 +489,57 @@ async def websocket_endpoint(websocket: WebSocket, token: str = Query(...)):
             # Ici, vous pouvez (optionnellement) standardiser le symbole avec votre AdvancedSymbolFormatter
             # et ensuite gérer l'abonnement via votre gestionnaire
             if action == "subscribe":
-                client_subscriptions.add((exchange, symbol))
-                await subscription_manager.subscribe(websocket, exchange, symbol, formatter)
-                await websocket.send_json({"message": f"Subscribed to {exchange} {symbol}"})
+                formatter = symbol_catalog.formatter
+                mode = message.get("mode", "full")
+                if mode not in PUBLISH_MODES:
+                    await client.send_json({"error": f"Unknown mode '{mode}'. Valid modes are: {', '.join(PUBLISH_MODES)}"})
+                    continue
+                try:
+                    options = parse_view_options(message)
+                except ValueError as e:
+                    await client.send_json({"error": str(e)})
+                    continue
+                # Sans exchange précisé, on s'abonne sur tous les exchanges qui listent le symbole
+                exchanges = [exchange] if exchange else list(formatter.get_listings(symbol))
+                for exchange in exchanges:
+                    if exchange not in exchange_dict:
+                        await client.send_json({"error": f"Exchange '{exchange}' not found"})
+                    elif not formatter.is_listed(symbol, exchange):
+                        # Inutile d'ouvrir un flux qui ne produirait rien
+                        await client.send_json({"error": f"{symbol} is not listed on {exchange}"})
+                    else:
+                        client_subscriptions.add((exchange, symbol))
+                        await subscription_manager.subscribe(client, exchange, symbol, formatter, mode, **options)
+                        await client.send_json({"message": f"Subscribed to {exchange} {symbol}"})
+                if not exchanges:
+                    await client.send_json({"error": f"{symbol} is not listed on any exchange"})
+            elif action == "resync":
+                if not await subscription_manager.resync(client, symbol, symbol_catalog.formatter):
+                    await client.send_json({"error": "Not subscribed to this symbol"})
             elif action == "unsubscribe":
-                key = (exchange, symbol)
-                if key in client_subscriptions:
-                    client_subscriptions.remove(key)
-                    await subscription_manager.unsubscribe(websocket, exchange, symbol, formatter)
-                    await websocket.send_json({"message": f"Unsubscribed from {exchange} {symbol}"})
+                formatter = symbol_catalog.formatter
+                # Sans exchange précisé, on se désabonne de tous les exchanges qui listent le symbole,
+                # comme pour subscribe (et de ceux abonnés avant une mise à jour des listings)
+                if exchange:
+                    exchanges = [exchange]
                 else:
-                    await websocket.send_json({"error": "Not subscribed to this symbol"})
+                    subscribed = [name for name, subscribed_symbol in client_subscriptions if subscribed_symbol == symbol]
+                    exchanges = list(dict.fromkeys([*formatter.get_listings(symbol), *sorted(subscribed)]))
+                exchanges = [exchange for exchange in exchanges if (exchange, symbol) in client_subscriptions]
+                for exchange in exchanges:
+                    client_subscriptions.remove((exchange, symbol))
+                    await subscription_manager.unsubscribe(client, exchange, symbol, formatter)
+                    await client.send_json({"message": f"Unsubscribed from {exchange} {symbol}"})
+                if not exchanges:
+                    await client.send_json({"error": "Not subscribed to this symbol"})
             else:
-                await websocket.send_json({"error": "Unknown action"})
+                await client.send_json({"error": "Unknown action"})
     except WebSocketDisconnect:
+        pass
+    finally:
+        client.close()
         for (exchange, symbol) in client_subscriptions:
-            await subscription_manager.unsubscribe(websocket, exchange, symbol, formatter)
+            await subscription_manager.unsubscribe(client, exchange, symbol, symbol_catalog.formatter)
 
 ############################################################################################################
 # TWAP Orders
@@ -235,6 +548,10 @@ async def websocket_endpoint(websocket: WebSocket, token: str = Query(...)):
 # --- Endpoint REST: POST /orders/twap ---
 @app.post("/orders/twap", status_code=202)
 async def submit_twap_order(order_req: TWAPOrderRequest, username: str = Depends(verify_token)):
+    # La simulation s'appuie sur le carnet d'ordres Binance : le symbole doit y être listé
+    if not symbol_catalog.formatter.is_listed(order_req.symbol, "binance"):
+        raise HTTPException(status_code=400, detail=f"Symbol '{order_req.symbol}' is not listed on binance")
+
     try:
         dbm.create_order_token(order_req, username)
     except Exception as e:
@@ -264,9 +581,22 @@ async def get_order_detail(order_id: str, username: str = Depends(verify_token))
     return dbm.get_order_details(username, order_id)
 
 
+@app.on_event("startup")
+async def startup_event():
+    """Event handler for server startup"""
+    # Ouverture des sessions HTTP persistantes de chaque exchange
+    for exchange_obj in exchange_dict.values():
+        exchange_obj.get_session()
+
+    # Catalogue des paires : chargé depuis l'instantané disque, rafraîchi en tâche de fond
+    symbol_catalog.start()
+
 @app.on_event("shutdown")
 async def shutdown_event():
     """Event handler for server shutdown"""
+    await symbol_catalog.stop()
+    for exchange_obj in exchange_dict.values():
+        await exchange_obj.close_session()
     open_orders = dbm.get_orders(order_status="open")
     for order in open_orders:
         dbm.update_order_status(order["order_id"], "cancel")
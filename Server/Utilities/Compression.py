@@ -0,0 +1,179 @@
+import asyncio
+import re
+import zlib
+
+# brotli et zstandard sont des dépendances optionnelles (extra "compression") : sans elles, seul gzip est proposé
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Encodages disponibles, par ordre de préférence à qualité égale
+AVAILABLE_ENCODINGS = [
+    encoding for encoding, module in (("zstd", zstandard), ("br", brotli), ("gzip", zlib)) if module is not None
+]
+
+# Types de contenu compressibles (le Parquet est déjà compressé)
+COMPRESSIBLE_TYPES = (
+    "application/json",
+    "application/x-ndjson",
+    "application/vnd.apache.arrow.stream",
+    "application/octet-stream",
+    "text/",
+)
+
+ETAG_ENCODING_SUFFIX = re.compile(r'-(?:gzip|br|zstd)"$')
+
+
+class Compressor:
+    """
+    Compresseur incrémental : chaque appel à compress() renvoie des octets immédiatement
+    décodables par le client (vidage du tampon), finish() termine le flux.
+    """
+
+    def __init__(self, encoding: str, level: int):
+        self.encoding = encoding
+        if encoding == "gzip":
+            self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31 : en-tête gzip
+        elif encoding == "br":
+            self.compressor = brotli.Compressor(quality=level)
+        elif encoding == "zstd":
+            self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+        else:
+            raise ValueError(f"Unsupported encoding '{encoding}'")
+
+    def compress(self, data: bytes) -> bytes:
+        if self.encoding == "gzip":
+            return self.compressor.compress(data) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        if self.encoding == "br":
+            return self.compressor.process(data) + self.compressor.flush()
+        return self.compressor.compress(data) + self.compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self.compressor.finish()
+        return self.compressor.flush()
+
+
+def negotiate_encoding(accept_encoding: str) -> str:
+    """
+    Choisit l'encodage à partir de l'en-tête Accept-Encoding (valeurs q comprises).
+    Retourne None si aucun encodage disponible n'est accepté.
+    """
+    accepted = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        match = re.search(r"q=([0-9.]+)", params)
+        if match:
+            try:
+                quality = float(match.group(1))
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    candidates = [
+        (accepted.get(encoding, accepted.get("*", 0.0)), -rank, encoding)
+        for rank, encoding in enumerate(AVAILABLE_ENCODINGS)
+    ]
+    quality, _, encoding = max(candidates, default=(0.0, 0, None))
+    return encoding if quality > 0 else None
+
+
+def strip_etag_encoding(etag: str) -> str:
+    """Retire d'un ETag le suffixe d'encodage ajouté par CompressionMiddleware ('"abc-gzip"' -> '"abc"')."""
+    return ETAG_ENCODING_SUFFIX.sub('"', etag)
+
+
+class CompressionMiddleware:
+    """
+    Middleware ASGI compressant les réponses HTTP selon l'encodage négocié (zstd, br ou gzip).
+
+    - Les réponses d'un seul bloc sont compressées si elles dépassent `minimum_size` octets.
+    - Les réponses en flux sont compressées au fil de l'eau, chaque bloc restant décodable dès sa réception.
+    - La compression s'exécute hors de la boucle d'événements (asyncio.to_thread).
+    - L'ETag reçoit un suffixe par encodage ('"abc-gzip"'), deux représentations différentes
+      ne devant pas partager le même ETag fort.
+    """
+
+    def __init__(self, app, minimum_size: int = 1024, levels: dict[str, int] = None):
+        """
+        :param app: Application ASGI.
+        :param minimum_size: Taille (octets) en dessous de laquelle une réponse n'est pas compressée.
+        :param levels: Niveau de compression par encodage (par défaut gzip 6, br 4, zstd 3).
+        """
+        self.app = app
+        self.minimum_size = minimum_size
+        self.levels = {"gzip": 6, "br": 4, "zstd": 3, **(levels or {})}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = {key.decode("latin-1").lower(): value.decode("latin-1") for key, value in scope["headers"]}
+        encoding = negotiate_encoding(headers.get("accept-encoding", ""))
+        if_none_match = headers.get("if-none-match", "")
+        start_message = None
+        compressor = None
+
+        async def send_wrapper(message):
+            nonlocal start_message, compressor
+            if message["type"] == "http.response.start":
+                # L'envoi des en-têtes est différé jusqu'au premier bloc du corps
+                start_message = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if start_message is not None:
+                response_headers = list(start_message["headers"])
+                content_type = next((v.decode("latin-1") for k, v in response_headers if k.lower() == b"content-type"), "")
+                already_encoded = any(k.lower() == b"content-encoding" for k, _ in response_headers)
+                compressible = content_type.startswith(COMPRESSIBLE_TYPES) and not already_encoded
+                if compressible or start_message["status"] == 304:
+                    response_headers.append((b"vary", b"Accept-Encoding"))
+                if start_message["status"] == 304:
+                    # Un 304 renvoie l'ETag tel que le client l'a reçu (avec son suffixe d'encodage)
+                    if encoding:
+                        self._suffix_etag(response_headers, encoding, only_if_in=if_none_match)
+                elif encoding and compressible and (more_body or len(body) >= self.minimum_size):
+                    compressor = Compressor(encoding, self.levels[encoding])
+                    body = await asyncio.to_thread(self._compress, compressor, body, more_body)
+                    response_headers = [(k, v) for k, v in response_headers if k.lower() != b"content-length"]
+                    response_headers.append((b"content-encoding", encoding.encode()))
+                    if not more_body:
+                        response_headers.append((b"content-length", str(len(body)).encode()))
+                    self._suffix_etag(response_headers, encoding)
+                start_message["headers"] = response_headers
+                await send(start_message)
+                start_message = None
+            elif compressor is not None:
+                body = await asyncio.to_thread(self._compress, compressor, body, more_body)
+            await send({"type": "http.response.body", "body": body, "more_body": more_body})
+
+        await self.app(scope, receive, send_wrapper)
+
+    @staticmethod
+    def _compress(compressor: Compressor, body: bytes, more_body: bool) -> bytes:
+        data = compressor.compress(body) if body else b""
+        if not more_body:
+            data += compressor.finish()
+        return data
+
+    @staticmethod
+    def _suffix_etag(headers: list, encoding: str, only_if_in: str = None):
+        for index, (key, value) in enumerate(headers):
+            if key.lower() != b"etag":
+                continue
+            etag = value.decode("latin-1")
+            if etag.endswith('"'):
+                suffixed = f'{etag[:-1]}-{encoding}"'
+                if only_if_in is None or suffixed in only_if_in:
+                    headers[index] = (key, suffixed.encode("latin-1"))
@@ -0,0 +1,191 @@
+import asyncio
+import time
+from collections import OrderedDict
+import numpy as np
+from pydantic import BaseModel
+from Utilities.KlineFormatter import KlineFormatter
+from Utilities.KlineStore import kline_store
+
+
+# --- Modèles Pydantic pour la requête de chandelles en lot ---
+class KlinePair(BaseModel):
+    exchange: str       # Ex : "binance"
+    symbol: str         # Ex : "BTC-USD"
+
+class KlineBatchRequest(BaseModel):
+    pairs: list[KlinePair]
+    interval: str = "1d"
+    start_date: str = None  # Format YYYY-MM-DD ou YYYY-MM-DDTHH:MM:SS (par défaut : il y a 5 jours)
+    end_date: str = None    # Par défaut : maintenant
+    format: str = "columns"  # "columns" (JSON), "arrow" ou "parquet"
+
+
+class KlineCache:
+    """
+    Cache mémoire des réponses /klines, placé devant le KlineStore.
+
+    - Single-flight : une requête identique ou incluse dans une requête déjà en cours
+      attend le résultat de celle-ci au lieu de relancer une pagination auprès de l'exchange.
+    - Les intervalles non natifs de l'exchange sont reconstitués par agrégation des chandelles
+      de l'intervalle natif le plus proche (voir Exchange.resolve_interval), elles-mêmes mises en cache.
+    - LRU borné (en nombre de chandelles) des résultats récents, avec une durée de vie qui dépend
+      de la fraîcheur de la plage : longue pour une plage entièrement clôturée, courte si la plage
+      contient la chandelle en cours.
+    """
+
+    def __init__(self, store=kline_store, max_candles: int = 2_000_000, closed_ttl: float = 3600, max_live_ttl: float = 30):
+        """
+        :param store: Stockage sous-jacent (doit fournir get_klines).
+        :param max_candles: Nombre maximal de chandelles conservées en mémoire (toutes entrées confondues).
+        :param closed_ttl: Durée de vie (s) d'une plage entièrement clôturée.
+        :param max_live_ttl: Durée de vie maximale (s) d'une plage contenant la chandelle en cours.
+        """
+        self.store = store
+        self.max_candles = max_candles
+        self.closed_ttl = closed_ttl
+        self.max_live_ttl = max_live_ttl
+        self.entries = OrderedDict()  # mapping : (exchange, symbol, interval, start, end) -> (expires_at, served_until, columns)
+        self.series_entries = {}      # mapping : (exchange, symbol, interval) -> clés de self.entries de la série
+        self.candles = 0
+        self.in_flight = {}  # mapping : (exchange, symbol, interval) -> {(start, end): asyncio.Task}
+
+    def ttl(self, interval: str, end_time: int) -> float:
+        """
+        Durée de vie d'un résultat : les chandelles clôturées ne changent plus, celles de la plage
+        en cours sont rafraîchies environ douze fois par intervalle (de 1 s à max_live_ttl).
+        """
+        step = KlineFormatter.interval_to_ms(interval)
+        if end_time < int(time.time() * 1000) - step:
+            return self.closed_ttl
+        return min(max(step / 1000 / 12, 1), self.max_live_ttl)
+
+    def _lookup(self, series: tuple, start_time: int, end_time: int):
+        """
+        Cherche une entrée valide dont la plage couvre [start_time, end_time].
+        Seules les entrées de la série sont parcourues ; les entrées expirées rencontrées sont supprimées.
+        """
+        now = time.monotonic()
+        for key in list(self.series_entries.get(series, ())):
+            expires_at, served_until, columns = self.entries[key]
+            if expires_at <= now:
+                self._evict(key)
+                continue
+            if key[3] <= start_time and end_time <= served_until:
+                self.entries.move_to_end(key)
+                return columns
+        return None
+
+    def _evict(self, key: tuple):
+        _, _, columns = self.entries.pop(key)
+        self.candles -= len(columns["timestamp"])
+        keys = self.series_entries[key[:3]]
+        keys.discard(key)
+        if not keys:
+            del self.series_entries[key[:3]]
+
+    def _insert(self, key: tuple, columns: dict[str, np.ndarray], ttl: float):
+        size = len(columns["timestamp"])
+        if size > self.max_candles:
+            return
+        if key in self.entries:
+            self._evict(key)
+        # Une plage en cours peut servir, pendant sa durée de vie, des requêtes dont la fin est un peu plus tardive
+        served_until = key[4] if ttl >= self.closed_ttl else key[4] + int(ttl * 1000)
+        self.entries[key] = (time.monotonic() + ttl, served_until, columns)
+        self.series_entries.setdefault(key[:3], set()).add(key)
+        self.candles += size
+        while self.candles > self.max_candles:
+            self._evict(next(iter(self.entries)))
+
+    async def get_klines(self, exchange_obj, symbol: str, interval: str, start_time: int, end_time: int) -> dict[str, np.ndarray]:
+        """
+        Même interface que KlineStore.get_klines, avec déduplication des requêtes concurrentes
+        et mise en cache des résultats. `interval` peut être tout multiple d'un intervalle natif.
+        """
+        base_interval = exchange_obj.resolve_interval(interval)
+        if base_interval != interval:
+            # On télécharge les chandelles natives couvrant entièrement les chandelles agrégées demandées
+            base = await self.get_klines(
+                exchange_obj, symbol, base_interval,
+                int(KlineFormatter.bucket_starts([start_time], interval)[0]),
+                KlineFormatter.next_bucket_start(end_time, interval) - 1
+            )
+            resampled = await asyncio.to_thread(KlineFormatter.resample, base, interval)
+            return KlineFormatter.slice(resampled, start_time, end_time)
+
+        series = (exchange_obj.name, symbol, interval)
+        columns = self._lookup(series, start_time, end_time)
+        if columns is not None:
+            return KlineFormatter.slice(columns, start_time, end_time)
+
+        # Une requête en cours couvre-t-elle déjà la plage demandée ?
+        flights = self.in_flight.setdefault(series, {})
+        task = next(
+            (t for (s, e), t in flights.items() if s <= start_time and end_time <= e),
+            None
+        )
+        if task is None:
+            task = asyncio.create_task(self._fetch(exchange_obj, symbol, interval, start_time, end_time))
+            flights[(start_time, end_time)] = task
+        # shield : l'annulation d'un client (déconnexion) ne doit pas annuler la requête partagée
+        columns = await asyncio.shield(task)
+        return KlineFormatter.slice(columns, start_time, end_time)
+
+    async def get_batch(self, requests: list[tuple], start_time: int, end_time: int, interval: str) -> list:
+        """
+        Récupère les chandelles de nombreuses paires (exchange_obj, symbole natif) en une fois.
+        Au plus exchange_obj.max_concurrency paires sont téléchargées simultanément par exchange,
+        leurs pages partageant ensuite le limiteur de débit de l'exchange ; les exchanges avancent
+        en parallèle. Retourne, dans l'ordre des requêtes, les colonnes ou l'exception levée.
+        """
+        semaphores = {}  # mapping : exchange -> asyncio.Semaphore
+
+        async def fetch(exchange_obj, symbol):
+            semaphore = semaphores.setdefault(exchange_obj.name, asyncio.Semaphore(exchange_obj.max_concurrency))
+            async with semaphore:
+                return await self.get_klines(exchange_obj, symbol, interval, start_time, end_time)
+
+        return await asyncio.gather(*(fetch(*request) for request in requests), return_exceptions=True)
+
+    async def iter_klines(self, exchange_obj, symbol: str, interval: str, start_time: int, end_time: int):
+        """
+        Version en flux (voir KlineStore.iter_klines), sans cache mémoire.
+        Pour un intervalle agrégé, la dernière chandelle de chaque page est retenue
+        jusqu'à la page suivante, qui peut encore la compléter.
+        """
+        base_interval = exchange_obj.resolve_interval(interval)
+        if base_interval == interval:
+            async for page in self.store.iter_klines(exchange_obj, symbol, interval, start_time, end_time):
+                yield page
+            return
+
+        pending = KlineFormatter.empty()
+        async for page in self.store.iter_klines(
+                exchange_obj, symbol, base_interval,
+                int(KlineFormatter.bucket_starts([start_time], interval)[0]),
+                KlineFormatter.next_bucket_start(end_time, interval) - 1):
+            if not len(page["timestamp"]):
+                continue
+            pending = KlineFormatter.merge(pending, page)
+            last_bucket = KlineFormatter.bucket_starts(pending["timestamp"][-1:], interval)[0]
+            complete = KlineFormatter.slice(pending, pending["timestamp"][0], last_bucket - 1)
+            pending = KlineFormatter.slice(pending, last_bucket, pending["timestamp"][-1])
+            if len(complete["timestamp"]):
+                yield KlineFormatter.slice(KlineFormatter.resample(complete, interval), start_time, end_time)
+        if len(pending["timestamp"]):
+            yield KlineFormatter.slice(KlineFormatter.resample(pending, interval), start_time, end_time)
+
+    async def _fetch(self, exchange_obj, symbol: str, interval: str, start_time: int, end_time: int) -> dict[str, np.ndarray]:
+        series = (exchange_obj.name, symbol, interval)
+        try:
+            columns = await self.store.get_klines(exchange_obj, symbol, interval, start_time, end_time)
+            self._insert((*series, start_time, end_time), columns, self.ttl(interval, end_time))
+            return columns
+        finally:
+            flights = self.in_flight.get(series, {})
+            flights.pop((start_time, end_time), None)
+            if not flights:
+                self.in_flight.pop(series, None)
+
+
+kline_cache = KlineCache()
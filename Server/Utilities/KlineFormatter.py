@@ -0,0 +1,367 @@
+import io
+import json
+import numpy as np
+
+# Champs numériques d'une chandelle (en plus du timestamp d'ouverture en ms)
+KLINE_FIELDS = ("open", "high", "low", "close", "volume")
+
+# Durée (en ms) de chaque unité d'intervalle
+INTERVAL_UNITS_MS = {
+    "m": 60_000,
+    "h": 3_600_000,
+    "d": 86_400_000,
+    "w": 604_800_000,
+    "M": 2_592_000_000,  # Mois approximé à 30 jours (comme dans Binance.valid_intervals)
+}
+
+# Les semaines commencent le lundi (1970-01-05) et non le jeudi 1970-01-01, comme sur les exchanges
+WEEK_ORIGIN_MS = 4 * 86_400_000
+
+# Formats de réponse disponibles pour les chandelles et leur type MIME
+KLINE_FORMATS = {
+    "json": "application/json",                          # Liste de chandelles (une ligne = un objet)
+    "columns": "application/json",                       # Un tableau JSON par champ
+    "arrow": "application/vnd.apache.arrow.stream",      # Arrow IPC (nécessite pyarrow)
+    "parquet": "application/vnd.apache.parquet",         # Parquet (nécessite pyarrow)
+    "npy": "application/octet-stream",                   # Tableau structuré NumPy (.npy)
+}
+
+# Formats pouvant être envoyés en flux (page par page) et leur type MIME
+KLINE_STREAM_FORMATS = {
+    "json": "application/x-ndjson",                      # Une chandelle JSON par ligne
+    "columns": "application/x-ndjson",                   # Un objet colonne JSON par page et par ligne
+    "arrow": "application/vnd.apache.arrow.stream",      # Arrow IPC, un record batch par page
+}
+
+
+class KlineFormatter:
+    """
+    Utilitaires pour manipuler des chandelles en représentation colonne :
+    un dictionnaire {"timestamp": int64[], "open": float64[], ..., "volume": float64[]}.
+    """
+
+    @staticmethod
+    def interval_to_ms(interval: str) -> int:
+        """
+        Convertit un intervalle ("1m", "4h", "1d", "1w", "1M") en millisecondes.
+        Lève une ValueError pour un intervalle invalide ou de durée nulle ("0m").
+        """
+        unit = interval[-1:]
+        if unit not in INTERVAL_UNITS_MS or not interval[:-1].isdigit() or int(interval[:-1]) == 0:
+            raise ValueError(f"Invalid interval '{interval}'")
+        return int(interval[:-1]) * INTERVAL_UNITS_MS[unit]
+
+    @staticmethod
+    def bucket_starts(timestamps, interval: str) -> np.ndarray:
+        """
+        Timestamp d'ouverture (ms) de la chandelle de l'intervalle `interval` contenant chaque timestamp.
+        Les mois ("1M", "3M", ...) suivent le calendrier, les semaines commencent le lundi.
+        """
+        KlineFormatter.interval_to_ms(interval)  # Validation
+        count, unit = int(interval[:-1]), interval[-1]
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        if unit == "M":
+            months = timestamps.astype("datetime64[ms]").astype("datetime64[M]").astype(np.int64)
+            months -= months % count
+            return months.astype("datetime64[M]").astype("datetime64[ms]").astype(np.int64)
+        origin = WEEK_ORIGIN_MS if unit == "w" else 0
+        return timestamps - (timestamps - origin) % KlineFormatter.interval_to_ms(interval)
+
+    @staticmethod
+    def next_bucket_start(timestamp: int, interval: str) -> int:
+        """Timestamp d'ouverture (ms) de la chandelle qui suit celle contenant `timestamp`."""
+        start = int(KlineFormatter.bucket_starts([timestamp], interval)[0])
+        if interval[-1] == "M":
+            month = np.datetime64(start, "ms").astype("datetime64[M]") + int(interval[:-1])
+            return int(month.astype("datetime64[ms]").astype(np.int64))
+        return start + KlineFormatter.interval_to_ms(interval)
+
+    @staticmethod
+    def bucket_count(start_time: int, end_time: int, interval: str) -> int:
+        """Nombre de chandelles de l'intervalle `interval` qui s'ouvrent dans [start_time, end_time] (ms)."""
+        first = int(KlineFormatter.bucket_starts([start_time], interval)[0])
+        if first < start_time:
+            first = KlineFormatter.next_bucket_start(start_time, interval)
+        last = int(KlineFormatter.bucket_starts([end_time], interval)[0])
+        if last < first:
+            return 0
+        if interval[-1] == "M":
+            months = np.array([first, last], dtype=np.int64).astype("datetime64[ms]").astype("datetime64[M]").astype(np.int64)
+            return int(months[1] - months[0]) // int(interval[:-1]) + 1
+        return (last - first) // KlineFormatter.interval_to_ms(interval) + 1
+
+    @staticmethod
+    def resample(columns: dict[str, np.ndarray], interval: str) -> dict[str, np.ndarray]:
+        """
+        Agrège des chandelles triées en chandelles de l'intervalle `interval` (plus long) :
+        open de la première, high max, low min, close de la dernière, volumes additionnés.
+        """
+        timestamps = columns["timestamp"]
+        if not len(timestamps):
+            return KlineFormatter.empty()
+        buckets = KlineFormatter.bucket_starts(timestamps, interval)
+        # Les colonnes étant triées, chaque chandelle agrégée est un segment contigu
+        starts = np.concatenate(([0], np.flatnonzero(buckets[1:] != buckets[:-1]) + 1))
+        ends = np.append(starts[1:], len(timestamps)) - 1
+        return {
+            "timestamp": buckets[starts],
+            "open": columns["open"][starts],
+            "high": np.maximum.reduceat(columns["high"], starts),
+            "low": np.minimum.reduceat(columns["low"], starts),
+            "close": columns["close"][ends],
+            "volume": np.add.reduceat(columns["volume"], starts),
+        }
+
+    @staticmethod
+    def empty() -> dict[str, np.ndarray]:
+        """Retourne un jeu de colonnes vide."""
+        columns = {"timestamp": np.empty(0, dtype=np.int64)}
+        for field in KLINE_FIELDS:
+            columns[field] = np.empty(0, dtype=np.float64)
+        return columns
+
+    @staticmethod
+    def from_raw(klines: list[list], indices: tuple[int, ...], time_scale: int = 1) -> dict[str, np.ndarray]:
+        """
+        Convertit en bloc des chandelles brutes (listes renvoyées par l'API d'un exchange)
+        en colonnes typées, sans construire d'objet Python par chandelle. Seules les colonnes
+        utiles sont lues, chacune directement dans son type (sans tableau intermédiaire de chaînes).
+
+        :param klines: Chandelles brutes, chaque chandelle étant une liste de valeurs (nombres ou chaînes).
+        :param indices: Position dans la chandelle brute du timestamp, puis de open, high, low, close et volume.
+        :param time_scale: Facteur pour convertir le timestamp en ms (1000 si l'exchange renvoie des secondes).
+        :return: Dictionnaire de colonnes numpy.
+        """
+        if not len(klines):
+            return KlineFormatter.empty()
+        count = len(klines)
+        columns = {"timestamp": np.array([kline[indices[0]] for kline in klines], dtype=np.int64) * time_scale}
+        for field, index in zip(KLINE_FIELDS, indices[1:]):
+            columns[field] = np.fromiter((kline[index] for kline in klines), dtype=np.float64, count=count)
+        return columns
+
+    @staticmethod
+    def to_records(columns: dict[str, np.ndarray]) -> list[dict]:
+        """
+        Convertit des colonnes en liste de chandelles au format ligne, avec la date lisible.
+        Les NaN sont renvoyés comme None pour rester sérialisables en JSON.
+        """
+        timestamps = columns["timestamp"]
+        dates = np.char.replace(
+            np.datetime_as_string(timestamps.astype("datetime64[ms]"), unit="s"), "T", " "
+        )
+        values = {}
+        for field in KLINE_FIELDS:
+            values[field] = np.where(np.isnan(columns[field]), None, columns[field]).tolist()
+        return [
+            {
+                "timestamp": ts,
+                "date": date,
+                **{field: values[field][i] for field in KLINE_FIELDS},
+            }
+            for i, (ts, date) in enumerate(zip(timestamps.tolist(), dates.tolist()))
+        ]
+
+    @staticmethod
+    def merge(*parts: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+        """
+        Concatène plusieurs jeux de colonnes, trie par timestamp et supprime les doublons.
+        En cas de doublon, la dernière occurrence (la plus récente) est conservée.
+        """
+        parts = [part for part in parts if len(part["timestamp"])]
+        if not parts:
+            return KlineFormatter.empty()
+        timestamps = np.concatenate([part["timestamp"] for part in parts])
+        order = np.argsort(timestamps, kind="stable")
+        sorted_ts = timestamps[order]
+        keep = np.ones(len(sorted_ts), dtype=bool)
+        keep[:-1] = sorted_ts[1:] != sorted_ts[:-1]
+        index = order[keep]
+        merged = {"timestamp": timestamps[index]}
+        for field in KLINE_FIELDS:
+            merged[field] = np.concatenate([part[field] for part in parts])[index]
+        return merged
+
+    @staticmethod
+    def slice(columns: dict[str, np.ndarray], start_time: int, end_time: int) -> dict[str, np.ndarray]:
+        """
+        Retourne les chandelles dont le timestamp est compris dans [start_time, end_time].
+        Les colonnes doivent être triées par timestamp.
+        """
+        timestamps = columns["timestamp"]
+        lo = np.searchsorted(timestamps, start_time, side="left")
+        hi = np.searchsorted(timestamps, end_time, side="right")
+        return {key: values[lo:hi] for key, values in columns.items()}
+
+    @staticmethod
+    def align(series: dict[str, dict[str, np.ndarray]], fill: str = "none") -> tuple[np.ndarray, dict[str, dict[str, np.ndarray]]]:
+        """
+        Aligne plusieurs séries de chandelles (ex: une par exchange) sur l'union de leurs timestamps.
+
+        :param series: Mapping nom -> colonnes triées.
+        :param fill: Traitement des chandelles absentes d'une série :
+                     "none" les laisse à NaN ; "ffill" les remplace par une chandelle plate au dernier
+                     close connu, de volume nul (les trous précédant la première chandelle restent à NaN).
+        :return: L'index commun et, pour chaque série, ses colonnes alignées sur cet index.
+        """
+        if fill not in ("none", "ffill"):
+            raise ValueError(f"Invalid fill '{fill}'. Valid values are: none, ffill")
+        parts = [columns["timestamp"] for columns in series.values()]
+        index = np.unique(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int64)
+        aligned = {}
+        for name, columns in series.items():
+            positions = np.searchsorted(index, columns["timestamp"])
+            present = np.zeros(len(index), dtype=bool)
+            present[positions] = True
+            result = {"timestamp": index}
+            for field in KLINE_FIELDS:
+                result[field] = np.full(len(index), np.nan)
+                result[field][positions] = columns[field]
+            if fill == "ffill":
+                # Position de la dernière chandelle présente pour chaque point de l'index (-1 si aucune)
+                last = np.maximum.accumulate(np.where(present, np.arange(len(index)), -1))
+                missing = ~present & (last >= 0)
+                last_close = result["close"][last[missing]]
+                for field in ("open", "high", "low", "close"):
+                    result[field][missing] = last_close
+                result["volume"][missing] = 0.0
+            aligned[name] = result
+        return index, aligned
+
+    @staticmethod
+    def composite(aligned: dict[str, dict[str, np.ndarray]]) -> dict[str, np.ndarray]:
+        """
+        Série composite pondérée par les volumes de plusieurs séries alignées (voir align) :
+        chaque prix est la moyenne des prix des séries pondérée par leur volume, le volume est la somme.
+        Sans volume sur un point de l'index, on retient la moyenne simple des prix disponibles.
+        """
+        series = list(aligned.values())
+        if not series:
+            return KlineFormatter.empty()
+        volumes = np.stack([columns["volume"] for columns in series])
+        total_volume = np.nansum(volumes, axis=0)
+        result = {"timestamp": series[0]["timestamp"]}
+        with np.errstate(invalid="ignore", divide="ignore"):
+            for field in ("open", "high", "low", "close"):
+                prices = np.stack([columns[field] for columns in series])
+                weights = np.where(np.isnan(prices), 0.0, np.nan_to_num(volumes))
+                weighted = np.nansum(prices * weights, axis=0) / weights.sum(axis=0)
+                simple = np.nansum(prices, axis=0) / (~np.isnan(prices)).sum(axis=0)
+                result[field] = np.where(weights.sum(axis=0) > 0, weighted, simple)
+        result["volume"] = np.where(np.all(np.isnan(volumes), axis=0), np.nan, total_volume)
+        return result
+
+    @staticmethod
+    def concat_labeled(parts: list[tuple[dict[str, str], dict[str, np.ndarray]]], labels: tuple[str, ...]) -> dict[str, np.ndarray]:
+        """
+        Concatène plusieurs séries en une seule table "longue", en ajoutant à chaque chandelle
+        les étiquettes de sa série (ex: {"exchange": "binance", "symbol": "BTC-USD"}) sous forme de colonnes.
+        """
+        lengths = [len(columns["timestamp"]) for _, columns in parts]
+        result = {
+            label: np.repeat(np.array([part_labels[label] for part_labels, _ in parts], dtype=str), lengths)
+            for label in labels
+        }
+        for key, values in KlineFormatter.empty().items():
+            result[key] = np.concatenate([values] + [columns[key] for _, columns in parts])
+        return result
+
+    @staticmethod
+    def to_columns_json(columns: dict[str, np.ndarray]) -> dict[str, list]:
+        """
+        Convertit des colonnes en dictionnaire JSON (un tableau par champ), NaN remplacés par None.
+        """
+        result = {"timestamp": columns["timestamp"].tolist()}
+        for field in KLINE_FIELDS:
+            values = columns[field]
+            if np.isnan(values).any():
+                values = np.where(np.isnan(values), None, values)
+            result[field] = values.tolist()
+        return result
+
+    @staticmethod
+    def to_arrow_table(columns: dict[str, np.ndarray]):
+        """
+        Convertit des colonnes en table Arrow (sans copie pour les types numériques).
+        Les colonnes supplémentaires (ex: "exchange" et "symbol" d'un lot) sont conservées.
+        pyarrow est une dépendance optionnelle : une ImportError est levée s'il n'est pas installé.
+        """
+        import pyarrow as pa
+        return pa.table(dict(columns))
+
+    @staticmethod
+    def to_structured_array(columns: dict[str, np.ndarray]) -> np.ndarray:
+        """Convertit des colonnes en tableau structuré NumPy (un champ par colonne)."""
+        dtype = [("timestamp", "<i8")] + [(field, "<f8") for field in KLINE_FIELDS]
+        array = np.empty(len(columns["timestamp"]), dtype=dtype)
+        for key, _ in dtype:
+            array[key] = columns[key]
+        return array
+
+    @staticmethod
+    def encode(columns: dict[str, np.ndarray], fmt: str) -> bytes:
+        """
+        Sérialise des colonnes dans un format binaire ("arrow", "parquet" ou "npy").
+        """
+        buffer = io.BytesIO()
+        if fmt == "arrow":
+            import pyarrow as pa
+            table = KlineFormatter.to_arrow_table(columns)
+            with pa.ipc.new_stream(buffer, table.schema) as writer:
+                writer.write_table(table)
+        elif fmt == "parquet":
+            import pyarrow.parquet as pq
+            pq.write_table(KlineFormatter.to_arrow_table(columns), buffer)
+        elif fmt == "npy":
+            np.save(buffer, KlineFormatter.to_structured_array(columns), allow_pickle=False)
+        else:
+            raise ValueError(f"Unsupported binary format '{fmt}'")
+        return buffer.getvalue()
+
+
+class KlineStreamEncoder:
+    """
+    Sérialise des pages de chandelles (au format colonne) au fil de l'eau, pour une réponse en flux.
+    encode(page) renvoie les octets à envoyer pour une page, close() ceux qui terminent le flux.
+    """
+
+    def __init__(self, fmt: str):
+        if fmt not in KLINE_STREAM_FORMATS:
+            raise ValueError(f"Format '{fmt}' cannot be streamed")
+        self.fmt = fmt
+        self.buffer = io.BytesIO()
+        self.writer = None
+        if fmt == "arrow":
+            # ImportError si pyarrow n'est pas installé, levée avant l'envoi du premier octet
+            import pyarrow  # noqa: F401
+
+    def _flush(self) -> bytes:
+        data = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return data
+
+    def encode(self, page: dict[str, np.ndarray]) -> bytes:
+        if self.fmt == "json":
+            return "".join(
+                json.dumps(record, separators=(",", ":")) + "\n" for record in KlineFormatter.to_records(page)
+            ).encode()
+        if self.fmt == "columns":
+            return (json.dumps(KlineFormatter.to_columns_json(page), separators=(",", ":")) + "\n").encode()
+        table = KlineFormatter.to_arrow_table(page)
+        self._open_writer(table.schema)
+        self.writer.write_table(table)
+        return self._flush()
+
+    def _open_writer(self, schema):
+        if self.writer is None:
+            import pyarrow as pa
+            self.writer = pa.ipc.new_stream(self.buffer, schema)
+
+    def close(self) -> bytes:
+        if self.fmt != "arrow":
+            return b""
+        # Sans aucune page, on envoie tout de même un flux valide (schéma seul)
+        self._open_writer(KlineFormatter.to_arrow_table(KlineFormatter.empty()).schema)
+        self.writer.close()
+        return self._flush()
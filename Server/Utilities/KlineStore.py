@@ -0,0 +1,307 @@
+import asyncio
+import os
+import re
+import time
+import numpy as np
+from Utilities.KlineFormatter import KlineFormatter, KLINE_FIELDS
+
+# Intervalles calendaires dont les bornes ne tombent pas sur une grille fixe :
+# on ne les persiste pas, ils sont toujours récupérés directement auprès de l'exchange.
+CALENDAR_INTERVALS = {"1M", "3M"}
+
+# Nombre de chandelles lues ou recopiées à la fois : la mémoire utilisée ne dépend pas de la taille de la série
+CHUNK_SIZE = 65536
+
+
+class KlineStore:
+    """
+    Stockage local, sur disque, des chandelles clôturées.
+
+    Chaque série (exchange, symbole, intervalle) est enregistrée dans un tableau structuré .npy
+    (un champ par colonne), lu par tranches via une projection en mémoire, et la liste des plages
+    de temps déjà couvertes ("coverage") dans un fichier .coverage.npy voisin.
+    Lors d'une requête, seules les sous-plages absentes de la couverture sont demandées à
+    l'exchange ; les chandelles encore ouvertes ne sont jamais persistées.
+    """
+
+    def __init__(self, base_dir: str = "Server/Data/klines", persist_pages: int = 10):
+        """
+        :param base_dir: Répertoire des séries.
+        :param persist_pages: Nombre de pages téléchargées en flux (iter_klines) persistées ensemble.
+        """
+        self.base_dir = base_dir
+        self.persist_pages = persist_pages
+        self.locks = {}  # mapping : (exchange, symbol, interval) -> asyncio.Lock
+
+    def _path(self, exchange: str, symbol: str, interval: str, suffix: str = ".npy") -> str:
+        # "1m" et "1M" entreraient en collision sur un système de fichiers insensible à la casse
+        interval_key = interval.replace("M", "mo")
+        symbol_key = re.sub(r"[^A-Za-z0-9_-]", "_", symbol)
+        return os.path.join(self.base_dir, exchange, symbol_key, f"{interval_key}{suffix}")
+
+    def open_records(self, exchange: str, symbol: str, interval: str) -> np.ndarray:
+        """
+        Tableau structuré des chandelles stockées, projeté en mémoire : seules les parties lues sont chargées.
+        Une série de l'ancien format (.npz) est lue en entier, puis réécrite au nouveau format au prochain enregistrement.
+        """
+        path = self._path(exchange, symbol, interval)
+        if os.path.exists(path):
+            return np.load(path, mmap_mode="r")
+        legacy_path = self._path(exchange, symbol, interval, ".npz")
+        if os.path.exists(legacy_path):
+            with np.load(legacy_path) as data:
+                return KlineFormatter.to_structured_array({key: data[key] for key in ("timestamp", *KLINE_FIELDS)})
+        return KlineFormatter.to_structured_array(KlineFormatter.empty())
+
+    def load_coverage(self, exchange: str, symbol: str, interval: str) -> np.ndarray:
+        """Couverture d'une série (vide si la série n'existe pas encore)."""
+        path = self._path(exchange, symbol, interval, ".coverage.npy")
+        if os.path.exists(path):
+            return np.load(path)
+        legacy_path = self._path(exchange, symbol, interval, ".npz")
+        if os.path.exists(legacy_path):
+            with np.load(legacy_path) as data:
+                return data["coverage"]
+        return np.empty((0, 2), dtype=np.int64)
+
+    def read(self, exchange: str, symbol: str, interval: str, start_time: int, end_time: int, limit: int = None) -> dict[str, np.ndarray]:
+        """
+        Chandelles stockées de [start_time, end_time] au format colonne (au plus `limit` chandelles),
+        sans charger le reste de la série.
+        """
+        records = self.open_records(exchange, symbol, interval)
+        timestamps = records["timestamp"]
+        lo = int(np.searchsorted(timestamps, start_time, side="left"))
+        hi = int(np.searchsorted(timestamps, end_time, side="right"))
+        if limit is not None:
+            hi = min(hi, lo + limit)
+        return {key: np.array(records[key][lo:hi]) for key in ("timestamp", *KLINE_FIELDS)}
+
+    def save(self, exchange: str, symbol: str, interval: str, columns: dict[str, np.ndarray], coverage: np.ndarray):
+        """
+        Fusionne des chandelles clôturées avec la série stockée puis écrit la série et sa couverture
+        de manière atomique (fichiers temporaires puis renommage). La série est recopiée par blocs
+        de CHUNK_SIZE chandelles : la mémoire utilisée dépend de `columns`, pas de la taille de la série.
+        La série est écrite avant la couverture : une interruption entre les deux ne fait
+        qu'omettre de la couverture des chandelles déjà stockées, qui seront redemandées.
+        """
+        path = self._path(exchange, symbol, interval)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if len(columns["timestamp"]):
+            records = self.open_records(exchange, symbol, interval)
+            timestamps = records["timestamp"]
+            lo = int(np.searchsorted(timestamps, columns["timestamp"][0], side="left"))
+            hi = int(np.searchsorted(timestamps, columns["timestamp"][-1], side="right"))
+            overlap = {key: np.array(records[key][lo:hi]) for key in ("timestamp", *KLINE_FIELDS)}
+            middle = KlineFormatter.to_structured_array(KlineFormatter.merge(overlap, columns))
+            tmp_path = f"{path}.tmp"
+            output = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=records.dtype, shape=(lo + len(middle) + len(records) - hi,))
+            for start in range(0, lo, CHUNK_SIZE):
+                end = min(start + CHUNK_SIZE, lo)
+                output[start:end] = records[start:end]
+            output[lo:lo + len(middle)] = middle
+            offset = lo + len(middle) - hi
+            for start in range(hi, len(records), CHUNK_SIZE):
+                end = min(start + CHUNK_SIZE, len(records))
+                output[start + offset:end + offset] = records[start:end]
+            output.flush()
+            # Les projections doivent être fermées avant le renommage (Windows)
+            del output, records, timestamps
+            os.replace(tmp_path, path)
+
+        coverage_path = self._path(exchange, symbol, interval, ".coverage.npy")
+        tmp_path = f"{coverage_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, coverage)
+        os.replace(tmp_path, coverage_path)
+        legacy_path = self._path(exchange, symbol, interval, ".npz")
+        if os.path.exists(legacy_path):
+            os.remove(legacy_path)
+
+    @staticmethod
+    def missing_ranges(coverage: np.ndarray, start_time: int, end_time: int) -> list[tuple[int, int]]:
+        """
+        Calcule les sous-plages [début, fin[ de [start_time, end_time[ absentes de la couverture.
+        La couverture est une liste triée de plages [début, fin[ disjointes.
+        """
+        gaps = []
+        cursor = start_time
+        for covered_start, covered_end in coverage.tolist():
+            if covered_end <= cursor:
+                continue
+            if covered_start >= end_time:
+                break
+            if covered_start > cursor:
+                gaps.append((cursor, covered_start))
+            cursor = max(cursor, covered_end)
+            if cursor >= end_time:
+                break
+        if cursor < end_time:
+            gaps.append((cursor, end_time))
+        return gaps
+
+    @staticmethod
+    def add_coverage(coverage: np.ndarray, ranges: list[tuple[int, int]]) -> np.ndarray:
+        """
+        Ajoute des plages à la couverture puis fusionne les plages qui se chevauchent ou se touchent.
+        """
+        intervals = sorted(coverage.tolist() + [list(r) for r in ranges if r[1] > r[0]])
+        merged = []
+        for start, end in intervals:
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        return np.array(merged, dtype=np.int64).reshape(-1, 2)
+
+    @staticmethod
+    def aligned_gaps(coverage: np.ndarray, start_time: int, end_time: int, interval: str) -> list[tuple[int, int]]:
+        """
+        Plages manquantes de [start_time, end_time] (bornes incluses), alignées sur les chandelles de l'intervalle
+        (voir KlineFormatter.bucket_starts : semaines commençant le lundi) pour ne jamais couvrir une chandelle partielle.
+        """
+        return [
+            (int(KlineFormatter.bucket_starts([gap_start], interval)[0]), KlineFormatter.next_bucket_start(gap_end - 1, interval))
+            for gap_start, gap_end in KlineStore.missing_ranges(coverage, start_time, end_time + 1)
+        ]
+
+    @staticmethod
+    def fetched_coverage(pages: list[dict[str, np.ndarray]], gap_start: int, gap_end: int, interval: str, closed_until: int,
+                         complete: bool = True) -> tuple[int, int]:
+        """
+        Plage couverte par les pages téléchargées pour le trou [gap_start, gap_end[, limitée aux chandelles clôturées.
+        Une fois tout le trou téléchargé (complete), il est couvert en entier, même sans chandelle renvoyée :
+        plage antérieure à la cotation de la paire, chandelles sans transaction omises par Coinbase, historique
+        au-delà des ~720 chandelles servies par Kraken. Ces chandelles clôturées n'existeront jamais chez l'exchange.
+        Pour un lot intermédiaire d'un téléchargement en flux, la couverture s'arrête à la dernière chandelle reçue.
+        Retourne None si la plage couverte est vide.
+        """
+        # Fin de la dernière chandelle clôturée (début de la chandelle en cours)
+        end = min(gap_end, KlineFormatter.next_bucket_start(closed_until - 1, interval))
+        if not complete:
+            timestamps = np.concatenate([page["timestamp"] for page in pages]) if pages else np.empty(0, dtype=np.int64)
+            timestamps = timestamps[(timestamps >= gap_start) & (timestamps < gap_end)]
+            if not len(timestamps):
+                return None
+            end = min(end, KlineFormatter.next_bucket_start(int(timestamps.max()), interval))
+        if end <= gap_start:
+            return None
+        return gap_start, end
+
+    async def persist(self, key: tuple, fetched: list[dict[str, np.ndarray]], new_coverage: list[tuple[int, int]], closed_until: int):
+        """
+        Enregistre les chandelles clôturées des pages téléchargées et étend la couverture.
+        Doit être appelée sous le verrou de la série.
+        """
+        result = KlineFormatter.merge(*fetched)
+        # Seules les chandelles clôturées sont persistées
+        is_closed = result["timestamp"] < closed_until
+        closed = {field: values[is_closed] for field, values in result.items()}
+        coverage = self.add_coverage(await asyncio.to_thread(self.load_coverage, *key), new_coverage)
+        await asyncio.to_thread(self.save, *key, closed, coverage)
+
+    async def get_klines(self, exchange_obj, symbol: str, interval: str, start_time: int, end_time: int) -> dict[str, np.ndarray]:
+        """
+        Retourne les chandelles de [start_time, end_time] (timestamps Unix en ms, bornes incluses)
+        au format colonne, en ne demandant à l'exchange que les plages manquantes.
+        """
+        if interval in CALENDAR_INTERVALS:
+            klines = await exchange_obj.get_historical_klines(symbol, interval, start_time, end_time)
+            return KlineFormatter.slice(klines, start_time, end_time)
+
+        key = (exchange_obj.name, symbol, interval)
+        lock = self.locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            step = KlineFormatter.interval_to_ms(interval)
+            coverage = await asyncio.to_thread(self.load_coverage, *key)
+
+            # Une chandelle est clôturée si son timestamp d'ouverture + l'intervalle est dans le passé
+            closed_until = int(time.time() * 1000) - step + 1
+
+            fetched = []
+            new_coverage = []
+            for gap_start, gap_end in self.aligned_gaps(coverage, start_time, end_time, interval):
+                print(f"[KlineStore] Fetching {key} from {gap_start} to {gap_end}")
+                page = await exchange_obj.get_historical_klines(symbol, interval, gap_start, gap_end - 1)
+                fetched.append(page)
+                covered = self.fetched_coverage([page], gap_start, gap_end, interval, closed_until)
+                if covered is not None:
+                    new_coverage.append(covered)
+
+            if fetched:
+                await self.persist(key, fetched, new_coverage, closed_until)
+            stored = await asyncio.to_thread(self.read, *key, start_time, end_time)
+
+        # Les chandelles encore ouvertes, jamais persistées, proviennent des pages téléchargées
+        return KlineFormatter.slice(KlineFormatter.merge(stored, *fetched), start_time, end_time)
+
+    async def _iter_stored(self, key: tuple, start_time: int, end_time: int):
+        """Chandelles stockées de [start_time, end_time], lues par tranches de CHUNK_SIZE chandelles."""
+        while start_time <= end_time:
+            page = await asyncio.to_thread(self.read, *key, start_time, end_time, CHUNK_SIZE)
+            if not len(page["timestamp"]):
+                return
+            yield page
+            start_time = int(page["timestamp"][-1]) + 1
+
+    async def iter_klines(self, exchange_obj, symbol: str, interval: str, start_time: int, end_time: int):
+        """
+        Variante de get_klines qui renvoie les chandelles par pages, dans l'ordre chronologique,
+        dès qu'elles sont disponibles : d'abord les portions déjà stockées (lues par tranches), puis
+        chaque page téléchargée pour combler les trous. Les pages téléchargées sont persistées
+        par lots de persist_pages pages : la mémoire utilisée ne dépend pas de la plage demandée.
+        """
+        if interval in CALENDAR_INTERVALS:
+            async for page in exchange_obj.iter_historical_klines(symbol, interval, start_time, end_time):
+                page = KlineFormatter.slice(page, start_time, end_time)
+                if len(page["timestamp"]):
+                    yield page
+            return
+
+        key = (exchange_obj.name, symbol, interval)
+        lock = self.locks.setdefault(key, asyncio.Lock())
+        step = KlineFormatter.interval_to_ms(interval)
+        async with lock:
+            coverage = await asyncio.to_thread(self.load_coverage, *key)
+        closed_until = int(time.time() * 1000) - step + 1
+
+        cursor = start_time  # Début de la portion pas encore renvoyée
+        for gap_start, gap_end in self.aligned_gaps(coverage, start_time, end_time, interval):
+            async for cached in self._iter_stored(key, cursor, gap_start - 1):
+                yield cached
+            print(f"[KlineStore] Streaming {key} from {gap_start} to {gap_end}")
+            batch = []
+            covered_until = None  # Fin de la plage couverte par les lots déjà persistés de ce trou
+            async for page in exchange_obj.iter_historical_klines(symbol, interval, gap_start, gap_end - 1):
+                batch.append(page)
+                page = KlineFormatter.slice(page, max(cursor, start_time), end_time)
+                if len(page["timestamp"]):
+                    yield page
+                if len(batch) >= self.persist_pages:
+                    covered_until = await self._persist_batch(key, lock, batch, gap_start, gap_end, covered_until, interval, closed_until, False)
+                    batch = []
+            # Dernier lot (éventuellement vide) : le trou est entièrement téléchargé
+            await self._persist_batch(key, lock, batch, gap_start, gap_end, covered_until, interval, closed_until, True)
+            cursor = max(cursor, gap_end)
+
+        async for cached in self._iter_stored(key, cursor, end_time):
+            yield cached
+
+    async def _persist_batch(self, key: tuple, lock: asyncio.Lock, pages: list[dict[str, np.ndarray]], gap_start: int, gap_end: int,
+                             covered_until: int, interval: str, closed_until: int, complete: bool) -> int:
+        """
+        Persiste un lot de pages consécutives d'un trou. La couverture du lot prolonge celle du lot précédent
+        (covered_until), les pages arrivant dans l'ordre chronologique. `complete` indique le dernier lot du trou
+        (voir fetched_coverage). Retourne la nouvelle fin de couverture.
+        """
+        covered = self.fetched_coverage(pages, gap_start, gap_end, interval, closed_until, complete)
+        if covered is None:
+            return covered_until
+        if covered_until is not None:
+            covered = (covered_until, covered[1])
+        async with lock:
+            await self.persist(key, pages, [covered], closed_until)
+        return covered[1]
+
+
+kline_store = KlineStore()
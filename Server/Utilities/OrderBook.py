@@ -0,0 +1,179 @@
+from array import array
+from bisect import bisect_left
+from decimal import Decimal
+
+# Pas utilisé pour les prix et quantités d'un instrument dont on ne connaît pas les caractéristiques
+DEFAULT_STEP = "0.00000001"
+# Plus grande valeur d'un tableau array("q")
+INT64_MAX = 2 ** 63 - 1
+
+
+class SequenceGap(Exception):
+    """Levée lorsqu'une mise à jour ne suit pas la précédente : le carnet doit être resynchronisé."""
+
+
+class BookSide:
+    """
+    Un côté du carnet d'ordres : niveaux de prix triés du meilleur au moins bon, stockés dans deux
+    tableaux d'entiers alignés (prix en ticks, quantités en lots). Les N meilleurs niveaux se lisent sans tri.
+    Si une valeur dépasse les entiers 64 bits (ex: énorme quantité comptée en lots de 1e-8),
+    le côté passe à des listes d'entiers Python, sans limite de taille.
+    """
+
+    def __init__(self, descending: bool):
+        """
+        :param descending: True pour les bids (meilleur prix = plus haut), False pour les asks.
+        """
+        self.descending = descending
+        self.keys = array("q")   # Clés de tri croissantes : -prix pour les bids, prix pour les asks (en ticks)
+        self.sizes = array("q")  # Quantité (en lots) de chaque niveau
+
+    def update(self, price: int, size: int):
+        """Met à jour un niveau de prix ; une quantité nulle supprime le niveau."""
+        key = -price if self.descending else price
+        if isinstance(self.sizes, array) and (abs(key) > INT64_MAX or abs(size) > INT64_MAX):
+            self.keys, self.sizes = list(self.keys), list(self.sizes)
+        index = bisect_left(self.keys, key)
+        found = index < len(self.keys) and self.keys[index] == key
+        if size > 0:
+            if found:
+                self.sizes[index] = size
+            else:
+                self.keys.insert(index, key)
+                self.sizes.insert(index, size)
+        elif found:
+            del self.keys[index]
+            del self.sizes[index]
+
+    def clear(self):
+        del self.keys[:]
+        del self.sizes[:]
+
+    def truncate(self, depth: int):
+        """Ne garde que les `depth` meilleurs niveaux."""
+        del self.keys[depth:]
+        del self.sizes[depth:]
+
+    def top(self, depth: int = None) -> list[tuple[int, int]]:
+        """Les `depth` meilleurs niveaux (tous si None), sous la forme [(prix en ticks, quantité en lots), ...]."""
+        sign = -1 if self.descending else 1
+        return [(sign * key, size) for key, size in zip(self.keys[:depth], self.sizes[:depth])]
+
+    def __len__(self):
+        return len(self.keys)
+
+
+def step_decimals(step: str) -> int:
+    """Nombre de décimales d'un pas de cotation ("0.0100" -> 2, "5" -> 0)."""
+    return max(-Decimal(step).normalize().as_tuple().exponent, 0)
+
+
+class OrderBook:
+    """
+    Carnet d'ordres L2 maintenu à partir d'un snapshot puis de mises à jour incrémentielles (deltas).
+
+    Les prix et quantités sont stockés en nombres entiers de ticks et de lots de l'instrument
+    (voir SymbolCatalog) : deux prix égaux tombent toujours sur le même niveau, sans erreur d'arrondi.
+
+    Si l'exchange numérote ses messages, chaque delta est vérifié par rapport au précédent
+    (voir apply_delta) : en cas de trou, une SequenceGap est levée et le carnet est marqué
+    comme désynchronisé jusqu'au prochain snapshot.
+    """
+
+    def __init__(self, depth: int = None, tick_size: str = None, lot_size: str = None):
+        """
+        :param depth: Nombre maximal de niveaux conservés par côté (None : pas de limite).
+        :param tick_size: Pas de prix de l'instrument (ex: "0.01"), DEFAULT_STEP s'il est inconnu.
+        :param lot_size: Pas de quantité de l'instrument (ex: "0.00001"), DEFAULT_STEP s'il est inconnu.
+        """
+        tick_size = tick_size if tick_size and Decimal(tick_size) > 0 else DEFAULT_STEP
+        lot_size = lot_size if lot_size and Decimal(lot_size) > 0 else DEFAULT_STEP
+        self.depth = depth
+        self.tick_size = float(tick_size)
+        self.lot_size = float(lot_size)
+        self.price_decimals = step_decimals(tick_size)
+        self.size_decimals = step_decimals(lot_size)
+        self.bids = BookSide(descending=True)
+        self.asks = BookSide(descending=False)
+        self.sequence = None   # Numéro du dernier message appliqué
+        self.timestamp = None
+        self.synced = False    # True une fois un snapshot appliqué, False après un trou
+        self.pending = []      # Deltas reçus en attendant le snapshot (voir Binance)
+
+    def apply_snapshot(self, bids, asks, sequence: int = None, timestamp=None):
+        """
+        Remplace tout le carnet.
+
+        :param bids: Niveaux [[prix, quantité], ...] (nombres ou chaînes).
+        :param asks: Idem.
+        :param sequence: Numéro de séquence du snapshot (ex: lastUpdateId chez Binance, seqId chez OKX).
+        """
+        self.bids.clear()
+        self.asks.clear()
+        self._apply_levels(bids, asks)
+        self.sequence = sequence
+        self.timestamp = timestamp
+        self.synced = True
+
+    def apply_delta(self, bids, asks, sequence: int = None, prev_sequence: int = None, first_sequence: int = None, timestamp=None) -> bool:
+        """
+        Applique une mise à jour incrémentielle.
+
+        Deux façons de vérifier la continuité, selon l'exchange :
+        - prev_sequence (OKX) : numéro du message précédent, qui doit être le dernier appliqué ;
+        - first_sequence (Binance) : premier numéro couvert par le message, qui doit suivre immédiatement
+          le dernier appliqué. Les messages entièrement antérieurs au carnet sont ignorés.
+
+        :param sequence: Numéro (dernier numéro couvert) du message.
+        :return: False si le message a été ignoré car déjà inclus dans le carnet.
+        :raises SequenceGap: si des messages ont été perdus ou si le carnet n'est pas synchronisé.
+        """
+        if not self.synced:
+            raise SequenceGap("order book is not synced")
+        if self.sequence is not None and sequence is not None:
+            if prev_sequence is not None:
+                # Le message suit directement le dernier appliqué, même si la numérotation a été réinitialisée
+                if prev_sequence != self.sequence:
+                    if sequence <= self.sequence:
+                        return False
+                    self.synced = False
+                    raise SequenceGap(f"expected previous sequence {self.sequence}, got {prev_sequence}")
+            elif sequence <= self.sequence:
+                return False
+            elif first_sequence is not None and first_sequence > self.sequence + 1:
+                self.synced = False
+                raise SequenceGap(f"expected sequence {self.sequence + 1}, got {first_sequence}")
+        self._apply_levels(bids, asks)
+        if sequence is not None:
+            self.sequence = sequence
+        if timestamp is not None:
+            self.timestamp = timestamp
+        return True
+
+    def _apply_levels(self, bids, asks):
+        tick_size, lot_size = self.tick_size, self.lot_size
+        for level in bids:
+            self.bids.update(round(float(level[0]) / tick_size), round(float(level[1]) / lot_size))
+        for level in asks:
+            self.asks.update(round(float(level[0]) / tick_size), round(float(level[1]) / lot_size))
+        if self.depth is not None:
+            self.bids.truncate(self.depth)
+            self.asks.truncate(self.depth)
+
+    def snapshot(self, depth: int = None) -> dict:
+        """
+        Carnet au format standardisé des adapters : {"bids": [[prix, quantité], ...], "asks": [...], "timestamp": ...}.
+        Les prix et quantités sont arrondis au nombre de décimales de leur pas ("price_decimals", "size_decimals") :
+        un même prix donne toujours le même float, quel que soit l'exchange.
+        "stale" indique un carnet désynchronisé (connexion perdue ou message manquant) en attente d'un snapshot.
+        """
+        tick_size, lot_size = self.tick_size, self.lot_size
+        price_decimals, size_decimals = self.price_decimals, self.size_decimals
+        return {
+            "bids": [[round(price * tick_size, price_decimals), round(size * lot_size, size_decimals)] for price, size in self.bids.top(depth)],
+            "asks": [[round(price * tick_size, price_decimals), round(size * lot_size, size_decimals)] for price, size in self.asks.top(depth)],
+            "timestamp": self.timestamp,
+            "stale": not self.synced,
+            "price_decimals": price_decimals,
+            "size_decimals": size_decimals
+        }
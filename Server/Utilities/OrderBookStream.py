@@ -0,0 +1,291 @@
+import asyncio
+import random
+import aiohttp
+from Utilities.OrderBook import OrderBook
+from Utilities.RateLimiter import RateLimiter
+
+
+class StreamConnection:
+    """
+    Connexion WebSocket d'un exchange, partagée par plusieurs symboles.
+    Les messages envoyés (abonnements, désabonnements) respectent la limite de débit de l'exchange.
+    """
+
+    def __init__(self, message_rate: float):
+        self.symbols = set()
+        self.ws = None
+        self.task = None
+        self.rate_limiter = RateLimiter(capacity=message_rate, refill_rate=message_rate)
+
+    async def send(self, message: dict):
+        """
+        Envoie un message sur la connexion. Sans connexion ouverte, le message est abandonné :
+        les abonnements sont de toute façon envoyés à l'ouverture de la connexion.
+        """
+        if self.ws is None or self.ws.closed:
+            return
+        await self.rate_limiter.acquire()
+        await self.ws.send_json(message)
+
+
+class OrderBookStream:
+    """
+    Gestionnaire des flux de carnets d'ordres d'un exchange.
+
+    Les symboles sont multiplexés sur quelques connexions WebSocket (au plus exchange.ws_max_symbols
+    par connexion) au lieu d'ouvrir une connexion par symbole. Un symbole est ajouté ou retiré
+    d'une connexion ouverte par un simple message d'abonnement ou de désabonnement, sans reconnexion.
+    Les connexions perdues sont rouvertes automatiquement (voir _run).
+
+    L'adapter de l'exchange fournit :
+    - ws_order_book_url : URL de la connexion ;
+    - order_book_subscribe_message(symbols, depth) / order_book_unsubscribe_message(symbols, depth) ;
+    - handle_order_book_message(stream, connection, data) : met à jour stream.books
+      et appelle stream.publish(symbol) pour chaque carnet modifié.
+    """
+
+    def __init__(self, exchange):
+        self.exchange = exchange
+        self.connections = []
+        self.books = {}        # mapping : symbole -> OrderBook
+        self.subscribers = {}  # mapping : symbole -> liste de (callback, futur résolu au désabonnement, profondeur)
+        self.symbol_connections = {}  # mapping : symbole -> StreamConnection
+        self.tasks = {}        # mapping : symbole -> tâche annexe (ex: snapshot REST)
+        self.venue_depths = {}  # mapping : symbole -> profondeur de l'abonnement auprès de l'exchange (truncate_order_book)
+        self.resubscribe_lock = asyncio.Lock()  # Les réabonnements sont envoyés dans l'ordre où ils sont décidés
+
+    async def subscribe(self, symbol: str, callback, depth: int = None) -> asyncio.Future:
+        """
+        Abonne `callback` au carnet de `symbol` (format natif) et retourne un futur
+        résolu lorsque l'abonnement est arrêté par unsubscribe(symbol, callback).
+
+        :param depth: Nombre de niveaux par côté souhaités (exchange.order_book_depth par défaut).
+        """
+        done = asyncio.get_running_loop().create_future()
+        subscribers = self.subscribers.setdefault(symbol, [])
+        subscribers.append((callback, done, depth or self.exchange.order_book_depth))
+        if len(subscribers) > 1:
+            # Symbole déjà suivi : le nouvel abonné reçoit immédiatement le carnet courant
+            self._update_venue_depth(symbol)
+            book = self.books.get(symbol)
+            if book is not None and book.synced:
+                callback(book.snapshot(self.depth(symbol)))
+            return done
+
+        connection = next(
+            (c for c in self.connections if len(c.symbols) < self.exchange.ws_max_symbols),
+            None
+        )
+        if connection is None:
+            connection = StreamConnection(self.exchange.ws_message_rate)
+            self.connections.append(connection)
+        connection.symbols.add(symbol)
+        self.symbol_connections[symbol] = connection
+        specs = self.exchange.instruments.get(symbol, {})
+        venue_depth = self.venue_depth(symbol)
+        if venue_depth is not None:
+            self.venue_depths[symbol] = venue_depth
+        self.books[symbol] = OrderBook(
+            depth=venue_depth,
+            tick_size=specs.get("tick_size"),
+            lot_size=specs.get("lot_size")
+        )
+        if connection.task is None:
+            connection.task = asyncio.create_task(self._run(connection))
+        else:
+            await connection.send(self.exchange.order_book_subscribe_message([symbol], venue_depth))
+        return done
+
+    def stop(self, symbol: str, callback=None):
+        """Résout le futur des abonnements de `symbol` (tous, ou seulement celui de `callback`)."""
+        for subscriber, done, _ in self.subscribers.get(symbol, []):
+            if (callback is None or subscriber is callback) and not done.done():
+                done.set_result(None)
+
+    async def unsubscribe(self, symbol: str, callback):
+        """
+        Retire l'abonnement de `callback`. Le dernier abonné d'un symbole le retire de sa connexion,
+        et une connexion sans symbole est fermée.
+        """
+        subscribers = [
+            subscription for subscription in self.subscribers.get(symbol, [])
+            if subscription[0] is not callback
+        ]
+        if subscribers:
+            self.subscribers[symbol] = subscribers
+            self._update_venue_depth(symbol)
+            return
+        self.subscribers.pop(symbol, None)
+        self.books.pop(symbol, None)
+        venue_depth = self.venue_depths.pop(symbol, None)
+        task = self.tasks.pop(symbol, None)
+        if task is not None:
+            task.cancel()
+        connection = self.symbol_connections.pop(symbol, None)
+        if connection is None:
+            return
+        connection.symbols.discard(symbol)
+        if connection.symbols:
+            try:
+                await connection.send(self.exchange.order_book_unsubscribe_message([symbol], venue_depth))
+            except Exception as e:
+                print(f"[{self.exchange.name}] Error unsubscribing from {symbol}: {e}")
+        else:
+            connection.task.cancel()
+            self.connections.remove(connection)
+
+    def depth(self, symbol: str) -> int:
+        """Nombre de niveaux publiés pour `symbol` : le plus grand demandé par ses abonnés."""
+        return max((depth for _, _, depth in self.subscribers.get(symbol, [])), default=self.exchange.order_book_depth)
+
+    def venue_depth(self, symbol: str) -> int:
+        """
+        Profondeur de l'abonnement auprès d'un exchange qui tronque ses carnets (exchange.truncate_order_book) :
+        la plus petite de exchange.order_book_depths qui couvre depth(symbol), à défaut la plus grande.
+        None pour un exchange qui diffuse le carnet complet.
+        """
+        if not self.exchange.truncate_order_book:
+            return None
+        choices = sorted(self.exchange.order_book_depths) or [self.exchange.order_book_depth]
+        depth = self.depth(symbol)
+        return next((choice for choice in choices if choice >= depth), choices[-1])
+
+    def set_depth(self, symbol: str, callback, depth: int = None):
+        """
+        Change le nombre de niveaux demandés par l'abonnement de `callback`.
+        Les carnets sont conservés en entier : la nouvelle profondeur s'applique dès la publication suivante,
+        déclenchée ici si elle augmente. Un exchange qui tronque ses carnets est réabonné à la profondeur
+        qui convient (voir venue_depth).
+        """
+        previous = self.depth(symbol)
+        self.subscribers[symbol] = [
+            (subscriber, done, depth or self.exchange.order_book_depth) if subscriber is callback else (subscriber, done, current)
+            for subscriber, done, current in self.subscribers.get(symbol, [])
+        ]
+        self._update_venue_depth(symbol)
+        book = self.books.get(symbol)
+        if self.depth(symbol) > previous and book is not None and book.synced:
+            self.publish(symbol)
+
+    def _update_venue_depth(self, symbol: str):
+        """
+        Réabonne `symbol` si la profondeur d'abonnement qui convient à ses abonnés a changé (truncate_order_book).
+        Le carnet est conservé ; l'exchange envoie un nouveau snapshot à la profondeur demandée.
+        """
+        previous = self.venue_depths.get(symbol)
+        venue_depth = self.venue_depth(symbol)
+        if previous is None or venue_depth == previous:
+            return
+        self.venue_depths[symbol] = venue_depth
+        book = self.books.get(symbol)
+        if book is not None:
+            book.depth = venue_depth
+        connection = self.symbol_connections.get(symbol)
+        if connection is not None:
+            asyncio.create_task(self._resubscribe(connection, symbol, previous, venue_depth))
+
+    async def _resubscribe(self, connection: StreamConnection, symbol: str, previous: int, depth: int):
+        async with self.resubscribe_lock:
+            # Le symbole a pu être désabonné entre-temps
+            if self.symbol_connections.get(symbol) is not connection:
+                return
+            print(f"[{self.exchange.name}] Resubscribing to {symbol} with depth {depth}")
+            try:
+                await connection.send(self.exchange.order_book_unsubscribe_message([symbol], previous))
+                await connection.send(self.exchange.order_book_subscribe_message([symbol], depth))
+            except Exception as e:
+                print(f"[{self.exchange.name}] Error resubscribing to {symbol}: {e}")
+
+    def start_task(self, symbol: str, coroutine):
+        """
+        Lance une tâche annexe liée au symbole (ex: téléchargement d'un snapshot),
+        annulée si le symbole est désabonné. Une seule tâche par symbole à la fois.
+        """
+        task = self.tasks.get(symbol)
+        if task is not None and not task.done():
+            coroutine.close()
+            return task
+        task = asyncio.create_task(coroutine)
+        self.tasks[symbol] = task
+        return task
+
+    def publish(self, symbol: str):
+        """
+        Envoie les meilleurs niveaux du carnet de `symbol` à ses abonnés (voir depth).
+        Un carnet désynchronisé est envoyé avec "stale": True (voir OrderBook.snapshot).
+        """
+        book = self.books.get(symbol)
+        if book is None:
+            return
+        snapshot = book.snapshot(self.depth(symbol))
+        for callback, _, _ in list(self.subscribers.get(symbol, [])):
+            callback(snapshot)
+
+    def mark_stale(self, symbol: str):
+        """Signale aux abonnés que le carnet de `symbol` n'est plus à jour, en attendant sa resynchronisation."""
+        book = self.books.get(symbol)
+        if book is not None:
+            book.synced = False
+            self.publish(symbol)
+
+    def _reset_connection(self, connection: StreamConnection):
+        """
+        Après la perte d'une connexion : les carnets de ses symboles sont marqués périmés
+        et les synchronisations en cours abandonnées (elles seront relancées après reconnexion).
+        """
+        for symbol in list(connection.symbols):
+            task = self.tasks.pop(symbol, None)
+            if task is not None:
+                task.cancel()
+            book = self.books.get(symbol)
+            if book is not None:
+                book.pending = []
+            self.mark_stale(symbol)
+
+    def reconnect_delay(self, attempt: int) -> float:
+        """Délai exponentiel plafonné, avec gigue pour éviter que toutes les connexions se rouvrent en même temps."""
+        delay = min(self.exchange.ws_reconnect_delay * 2 ** attempt, self.exchange.ws_max_reconnect_delay)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    async def _run(self, connection: StreamConnection):
+        """
+        Lit les messages d'une connexion et les transmet à l'adapter.
+
+        La connexion est supervisée : si elle tombe (fermeture, erreur, absence de réponse au heartbeat),
+        les carnets de ses symboles sont marqués périmés, puis elle est rouverte après reconnect_delay(tentative) ;
+        les symboles sont réabonnés et chaque carnet est reconstruit à partir d'un nouveau snapshot.
+        """
+        name = self.exchange.name
+        attempt = 0
+        while connection.symbols:
+            try:
+                async with self.exchange.get_session().ws_connect(self.exchange.ws_order_book_url, heartbeat=self.exchange.ws_heartbeat) as ws:
+                    connection.ws = ws
+                    print(f"[{name}] Order book connection opened for {len(connection.symbols)} symbols")
+                    # Un message par profondeur d'abonnement (une seule sauf truncate_order_book)
+                    by_depth = {}
+                    for symbol in sorted(connection.symbols):
+                        by_depth.setdefault(self.venue_depths.get(symbol), []).append(symbol)
+                    for depth, symbols in by_depth.items():
+                        await connection.send(self.exchange.order_book_subscribe_message(symbols, depth))
+                    async for msg in ws:
+                        if msg.type == aiohttp.WSMsgType.TEXT:
+                            attempt = 0  # La connexion fonctionne : le délai repart du minimum
+                            try:
+                                await self.exchange.handle_order_book_message(self, connection, msg.json())
+                            except Exception as e:
+                                # Un message invalide ne doit pas couper la connexion des autres symboles ;
+                                # un delta perdu est détecté par le contrôle des numéros de séquence
+                                print(f"[{name}] Error handling order book message: {e!r}")
+                        elif msg.type == aiohttp.WSMsgType.ERROR:
+                            print(f"[{name}] WebSocket error: {ws.exception()}")
+                            break
+            except Exception as e:
+                print(f"[{name}] Order book connection error: {e}")
+            finally:
+                connection.ws = None
+            self._reset_connection(connection)
+            delay = self.reconnect_delay(attempt)
+            attempt += 1
+            print(f"[{name}] Order book connection lost, reconnecting in {delay:.1f}s")
+            await asyncio.sleep(delay)
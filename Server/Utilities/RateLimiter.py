@@ -0,0 +1,83 @@
+import asyncio
+import time
+
+
+class RateLimiter:
+    """
+    Limiteur de débit de type "token bucket" pondéré, partagé par toutes les requêtes REST d'un exchange.
+
+    Le seau contient au plus `capacity` unités de poids et se remplit de `refill_rate` unités par seconde.
+    Chaque requête consomme son poids (ex: 2 pour les klines Binance) et attend si le seau est vide.
+    Les en-têtes de réponse permettent de resynchroniser le seau avec le compteur de l'exchange
+    (`used_weight_header`) et de respecter les pauses imposées (`Retry-After`).
+    """
+
+    def __init__(self, capacity: float, refill_rate: float, used_weight_header: str = None, default_backoff: float = 1.0):
+        """
+        :param capacity: Poids maximal disponible (taille du seau).
+        :param refill_rate: Poids regagné par seconde.
+        :param used_weight_header: En-tête renvoyant le poids déjà consommé sur la fenêtre de l'exchange (optionnel).
+        :param default_backoff: Pause (s) appliquée sur un 429 sans en-tête Retry-After.
+        """
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.used_weight_header = used_weight_header
+        self.default_backoff = default_backoff
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        # Le verrou sert la file d'attente dans l'ordre d'arrivée
+        self.lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_rate)
+        self.updated_at = now
+
+    async def acquire(self, weight: float = 1):
+        """
+        Attend que `weight` unités soient disponibles puis les consomme.
+        """
+        weight = min(weight, self.capacity)
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self.blocked_until - now
+                if wait <= 0:
+                    if self.tokens >= weight:
+                        self.tokens -= weight
+                        return
+                    wait = (weight - self.tokens) / self.refill_rate
+                await asyncio.sleep(wait)
+
+    def penalize(self, delay: float):
+        """
+        Bloque toutes les requêtes pendant `delay` secondes et vide le seau (ex: après un 429).
+        """
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens = 0
+        self.blocked_until = max(self.blocked_until, now + delay)
+
+    def update_from_headers(self, status: int, headers) -> bool:
+        """
+        Met à jour le seau à partir d'une réponse HTTP.
+        Retourne True si la requête a été refusée pour dépassement de limite et doit être rejouée.
+        """
+        if self.used_weight_header and self.used_weight_header in headers:
+            try:
+                used = float(headers[self.used_weight_header])
+                self._refill(time.monotonic())
+                self.tokens = min(self.tokens, max(self.capacity - used, 0))
+            except ValueError:
+                pass
+
+        if status in (418, 429):
+            try:
+                delay = float(headers.get("Retry-After", self.default_backoff))
+            except ValueError:
+                delay = self.default_backoff
+            print(f"Rate limit reached (HTTP {status}), pausing requests for {delay}s")
+            self.penalize(delay)
+            return True
+        return False
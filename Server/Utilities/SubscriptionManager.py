@@ -1,131 +1,505 @@
 import asyncio
+import json
+from bisect import bisect_left, insort
+from collections import deque
+from decimal import Decimal, InvalidOperation
 from fastapi import WebSocket
+from Utilities.OrderBook import step_decimals
 from Exchanges import exchange_dict  # Nos instances d'exchanges (Binance, OKX, Kraken, etc.)
 
+# Modes de diffusion du carnet agrégé (voir AggregatedSubscription)
+PUBLISH_MODES = ("full", "delta")
+DEFAULT_DEPTH = 10   # Niveaux par côté diffusés sans paramètre "depth"
+MAX_DEPTH = 500      # Niveaux par côté demandés aux exchanges au maximum (et pour les vues regroupées)
+
+def encode_message(message: dict) -> str:
+    """Sérialise un message une seule fois, quel que soit le nombre de clients destinataires."""
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+def parse_view_options(message: dict) -> dict:
+    """
+    Lit les paramètres de diffusion d'un message d'abonnement /ws (voir BookView) :
+    - "depth" : nombre de niveaux par côté (DEFAULT_DEPTH par défaut, au plus MAX_DEPTH) ;
+    - "max_rate" : nombre maximal de diffusions par seconde ;
+    - "group" : pas de regroupement des prix (ex: 1 pour des niveaux de 1 $).
+    Lève une ValueError si un paramètre est invalide.
+    """
+    depth = message.get("depth", DEFAULT_DEPTH)
+    if not isinstance(depth, int) or isinstance(depth, bool) or not 1 <= depth <= MAX_DEPTH:
+        raise ValueError(f"depth must be an integer between 1 and {MAX_DEPTH}")
+    max_rate = message.get("max_rate")
+    if max_rate is not None and (not isinstance(max_rate, (int, float)) or isinstance(max_rate, bool) or max_rate <= 0):
+        raise ValueError("max_rate must be a positive number of updates per second")
+    group = message.get("group")
+    if group is not None:
+        try:
+            group = Decimal(str(group)).normalize()
+        except InvalidOperation:
+            raise ValueError("group must be a positive price step")
+        if not group.is_finite() or group <= 0:
+            raise ValueError("group must be a positive price step")
+    return {"depth": depth, "max_rate": max_rate, "group": group}
+
+
+class ClientConnection:
+    """
+    Connexion d'un client /ws. Les messages sont placés dans une file bornée puis envoyés
+    par une tâche dédiée : un client lent ne retarde ni la diffusion ni les autres clients.
+
+    - Un message portant une clé (ex: carnet d'un symbole) remplace le message de même clé
+      encore en attente : un client en retard reçoit directement l'état le plus récent.
+    - Si la file dépasse max_queue messages, ou si un envoi dure plus de send_timeout secondes,
+      le client est déconnecté (code 1013 : réessayer plus tard).
+    """
+
+    def __init__(self, websocket: WebSocket, max_queue: int = 256, send_timeout: float = 10):
+        self.websocket = websocket
+        self.max_queue = max_queue
+        self.send_timeout = send_timeout
+        self.queue = deque()   # messages en attente : [clé, payload]
+        self.pending = {}      # mapping : clé -> message en attente (modifié sur place lors d'un remplacement)
+        self.ready = asyncio.Event()
+        self.closed = False
+        self.writer_task = asyncio.create_task(self._write())
+
+    def push(self, payload: str, key=None, conflate=None) -> bool:
+        """
+        Met un payload déjà sérialisé en file. Si un message de même clé attend encore,
+        il est remplacé par `payload` (ou par conflate(), qui fournit un état complet, si les deux
+        messages ne peuvent pas se substituer l'un à l'autre, comme deux deltas successifs).
+        Retourne False si le client est déconnecté.
+        """
+        if self.closed:
+            return False
+        if key is not None and key in self.pending:
+            self.pending[key][1] = conflate() if conflate is not None else payload
+            return True
+        if len(self.queue) >= self.max_queue:
+            print("[ClientConnection] Send queue full, disconnecting slow client")
+            self.disconnect()
+            return False
+        message = [key, payload]
+        self.queue.append(message)
+        if key is not None:
+            self.pending[key] = message
+        self.ready.set()
+        return True
+
+    async def send_json(self, data: dict):
+        """Même interface que WebSocket.send_json, en passant par la file du client."""
+        self.push(encode_message(data))
+
+    async def _write(self):
+        try:
+            while True:
+                while not self.queue:
+                    self.ready.clear()
+                    await self.ready.wait()
+                key, payload = message = self.queue.popleft()
+                if key is not None and self.pending.get(key) is message:
+                    del self.pending[key]
+                await asyncio.wait_for(self.websocket.send_text(payload), self.send_timeout)
+        except asyncio.TimeoutError:
+            print("[ClientConnection] Send timed out, disconnecting slow client")
+            self.closed = True
+            await self.websocket.close(code=1013)
+        except Exception:
+            # Client déconnecté : l'endpoint se charge de ses abonnements
+            self.closed = True
+
+    def disconnect(self):
+        """Ferme la connexion d'un client trop lent."""
+        self.close()
+        asyncio.create_task(self.websocket.close(code=1013))
+
+    def close(self):
+        """Arrête l'envoi des messages (à la fin de la connexion)."""
+        self.closed = True
+        self.writer_task.cancel()
+
+
+class BookView:
+    """
+    Diffusion d'un carnet agrégé pour un jeu de paramètres : profondeur, débit maximal et pas de regroupement
+    des prix. Une vue est partagée par tous les clients qui ont demandé les mêmes paramètres : le carnet
+    n'est regroupé et sérialisé qu'une fois par vue, quel que soit le nombre de clients.
+
+    Deux modes de diffusion (voir PUBLISH_MODES) :
+    - "full" : les niveaux de la vue à chaque diffusion ;
+    - "delta" : un snapshot numéroté, puis seulement les niveaux modifiés ; chaque diffusion incrémente
+      le numéro de séquence, ce qui permet au client de détecter un message manquant et de demander
+      un nouveau snapshot (action "resync").
+
+    Les prix sont regroupés par tranches de `group` : vers le bas pour les bids, vers le haut pour les asks,
+    de sorte qu'un niveau regroupé n'annonce jamais un meilleur prix que ceux qu'il contient.
+    Une vue n'est diffusée que si ses niveaux ont changé, au plus une fois par `interval` secondes.
+    """
+
+    def __init__(self, subscription: "AggregatedSubscription", key: tuple, depth: int, interval: float, group: Decimal = None):
+        self.subscription = subscription
+        self.key = key
+        self.depth = depth
+        self.interval = interval
+        self.group = group
+        # Pas de regroupement en prix entiers (voir AggregatedSubscription._rescale)
+        self.step = int(group.scaleb(subscription.price_decimals)) if group is not None else 1
+        self.clients = {}          # mapping : ClientConnection abonnée -> mode de diffusion ("full" ou "delta")
+        self.sent = {"bids": {}, "asks": {}}  # niveaux diffusés : côté -> {prix entier: niveau}, du meilleur au moins bon
+        self.sent_stale = []
+        self.sequence = 0          # numéro de la dernière diffusion
+        self.changed = asyncio.Event()
+        self.published_at = 0.0
+        self.task = None
+
+    def rescale(self, factor: int):
+        """Suit le changement d'échelle des prix entiers de l'abonnement."""
+        if self.group is not None:
+            self.step *= factor
+        for side in ("bids", "asks"):
+            self.sent[side] = {price * factor: level for price, level in self.sent[side].items()}
+
+    def _levels(self, side: str) -> dict:
+        """
+        Les `depth` meilleurs niveaux regroupés d'un côté : {prix entier: niveau}, du meilleur au moins bon.
+        Seuls les prix du carnet agrégé nécessaires pour remplir la vue sont parcourus.
+        """
+        subscription = self.subscription
+        price_scale, size_scale = 10 ** subscription.price_decimals, 10 ** subscription.size_decimals
+        step, levels = self.step, subscription.levels[side]
+        buckets = {}
+        for key in subscription.prices[side]:
+            price = abs(key)
+            bucket = price // step * step if side == "bids" else -(-price // step) * step
+            quantities = buckets.get(bucket)
+            if quantities is None:
+                if len(buckets) == self.depth:
+                    break
+                quantities = buckets[bucket] = {}
+            for exchange, qty in levels[price].items():
+                quantities[exchange] = quantities.get(exchange, 0) + round(qty * size_scale)
+        return {
+            bucket: {
+                "price": bucket / price_scale,
+                "exchanges": {exchange: qty / size_scale for exchange, qty in quantities.items()},
+                "total": sum(quantities.values()) / size_scale
+            }
+            for bucket, quantities in buckets.items()
+        }
+
+    def publish(self) -> tuple[dict, dict]:
+        """
+        Recalcule les niveaux de la vue et retourne le message complet (mode "full") et le message
+        différentiel (mode "delta"), ou None si rien n'a changé depuis la diffusion précédente.
+        Un niveau supprimé ou sorti de la vue figure dans le delta avec un total nul.
+        """
+        stale = sorted(self.subscription.stale)
+        levels = {side: self._levels(side) for side in ("bids", "asks")}
+        changes = {}
+        for side in ("bids", "asks"):
+            new, old = levels[side], self.sent[side]
+            changed = [price for price, level in new.items() if old.get(price) != level]
+            changed += [price for price in old if price not in new]
+            changes[side] = sorted(changed, reverse=side == "bids")
+        if not changes["bids"] and not changes["asks"] and stale == self.sent_stale:
+            return None
+
+        self.sequence += 1
+        price_scale = 10 ** self.subscription.price_decimals
+        standard_symbol = self.subscription.standard_symbol
+        full = {"standard_symbol": standard_symbol}
+        delta = {"type": "delta", "standard_symbol": standard_symbol, "sequence": self.sequence}
+        for side in ("bids", "asks"):
+            full[side] = list(levels[side].values())
+            delta[side] = [
+                levels[side].get(price, {"price": price / price_scale, "exchanges": {}, "total": 0})
+                for price in changes[side]
+            ]
+        full["stale"] = delta["stale"] = stale
+        self.sent, self.sent_stale = levels, stale
+        return full, delta
+
+    def current(self) -> dict:
+        """
+        Message du mode "full" pour la vue telle qu'elle a été diffusée en dernier,
+        envoyé à un client qui la rejoint sans attendre le prochain changement.
+        """
+        message = {"standard_symbol": self.subscription.standard_symbol}
+        for side in ("bids", "asks"):
+            message[side] = list(self.sent[side].values())
+        message["stale"] = self.sent_stale
+        return message
+
+    def snapshot(self) -> dict:
+        """
+        Snapshot du mode "delta" : la vue telle qu'elle a été diffusée sous le numéro self.sequence
+        (les changements en attente arriveront dans le delta suivant).
+        """
+        message = {"type": "snapshot", "standard_symbol": self.subscription.standard_symbol, "sequence": self.sequence}
+        for side in ("bids", "asks"):
+            message[side] = list(self.sent[side].values())
+        message["stale"] = self.sent_stale
+        return message
+
+    def broadcast(self, full: dict, delta: dict):
+        """
+        Place la diffusion dans la file de chaque client (voir ClientConnection), sans attendre les envois.
+        Chaque message n'est sérialisé qu'une fois, et seulement si un client de la vue utilise son mode.
+        Un client en retard en mode "delta" reçoit un snapshot à la place de ses deltas en attente.
+        """
+        modes = set(self.clients.values())
+        payloads = {mode: encode_message(message) for mode, message in (("full", full), ("delta", delta)) if mode in modes}
+        snapshot = []
+
+        def snapshot_payload():
+            if not snapshot:
+                snapshot.append(encode_message(self.snapshot()))
+            return snapshot[0]
+
+        key = self.subscription.standard_symbol
+        for client, mode in list(self.clients.items()):
+            conflate = snapshot_payload if mode == "delta" else None
+            if not client.push(payloads[mode], key=(key, mode), conflate=conflate):
+                self.clients.pop(client, None)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.changed.wait()
+            # Au plus une diffusion par interval : les changements intermédiaires sont regroupés
+            wait = self.published_at + self.interval - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self.changed.clear()
+            messages = self.publish()
+            if messages is not None:
+                self.published_at = loop.time()
+                self.broadcast(*messages)
+
+
 class AggregatedSubscription:
-    def __init__(self, standard_symbol: str):
+    """
+    Carnet agrégé d'un symbole standard sur plusieurs exchanges.
+
+    L'agrégat est mis à jour à chaque carnet reçu d'un exchange, en ne touchant que les niveaux
+    de prix qui ont changé. Il est diffusé par des vues (voir BookView), une par jeu de paramètres
+    demandé par les clients ; chaque exchange transmet assez de niveaux pour remplir la plus profonde.
+
+    Les prix et quantités sont convertis en entiers à l'échelle la plus fine des exchanges
+    (voir OrderBook.snapshot) : les niveaux se regroupent et s'additionnent exactement.
+    """
+
+    def __init__(self, standard_symbol: str, min_publish_interval: float = 0.1):
         self.standard_symbol = standard_symbol  # ex: "BTC-USD"
+        self.min_publish_interval = min_publish_interval
         self.exchange_data = {}   # mapping : exchange -> dernière donnée (order book)
         self.feed_tasks = {}      # mapping : exchange -> tâche asynchrone du flux
-        self.clients = set()      # ensemble des WebSocket abonnés à ce symbole agrégé
-        self.broadcast_task = None
+        self.feed_callbacks = {}  # mapping : exchange -> (symbole natif, callback du flux)
+        self.clients = {}         # mapping : ClientConnection abonnée -> BookView
+        self.views = {}           # mapping : (depth, interval, group) -> BookView
+        self.venue_depth = DEFAULT_DEPTH  # niveaux par côté demandés à chaque exchange
+
+        self.stale = set()        # exchanges dont le carnet est périmé, exclus de l'agrégat
+        self.price_decimals = 0   # échelle des prix et quantités entiers (10 ** décimales)
+        self.size_decimals = 0
+        self.exchange_levels = {}  # mapping : exchange -> {côté: {prix entier: quantité}}
+        self.levels = {"bids": {}, "asks": {}}   # mapping : côté -> {prix entier: {exchange: quantité}}
+        self.prices = {"bids": [], "asks": []}   # prix entiers triés du meilleur au moins bon (négatifs pour les bids)
 
     async def add_exchange(self, exchange: str, exchange_specific_symbol: str):
         # Si nous sommes déjà abonnés à cet exchange, on ne fait rien
         if exchange in self.feed_tasks:
             return
 
-        # Définir une fonction callback qui met à jour self.exchange_data pour cet exchange
+        # Chaque carnet reçu de l'exchange met à jour l'agrégat
         def callback(data, exchange=exchange):
-            self.exchange_data[exchange] = data
+            self.update(exchange, data)
+
+        async def feed():
+            # La profondeur est lue au démarrage de la tâche : elle tient compte des vues créées entre-temps
+            await exchange_dict[exchange].subscribe_order_book(exchange_specific_symbol, callback, self.venue_depth)
 
         # Démarrer le flux de l'exchange en passant la callback
-        task = asyncio.create_task(
-            exchange_dict[exchange].subscribe_order_book(exchange_specific_symbol, callback)
-        )
-        self.feed_tasks[exchange] = task
+        self.feed_callbacks[exchange] = (exchange_specific_symbol, callback)
+        self.feed_tasks[exchange] = asyncio.create_task(feed())
 
     async def remove_exchange(self, exchange: str):
         if exchange in self.feed_tasks:
             self.feed_tasks[exchange].cancel()
             del self.feed_tasks[exchange]
-            if exchange in self.exchange_data:
-                del self.exchange_data[exchange]
+            self.feed_callbacks.pop(exchange, None)
+            self.exchange_data.pop(exchange, None)
+            self.stale.discard(exchange)
+            self._set_levels(exchange, {}, {})
 
-    async def run(self):
-        try:
-            while True:
-                await asyncio.sleep(1)
-                if self.exchange_data:
-                    # On va créer deux dictionnaires d'agrégation pour les bids et les asks.
-                    aggregated_bids = {}
-                    aggregated_asks = {}
-                    # Parcours de chaque flux provenant d'un exchange
-                    for exch, data in self.exchange_data.items():
-                        # On suppose que 'data' est un dictionnaire avec les clés "bids" et "asks"
-                        # et que chacune est une liste de [price, quantity].
-                        for bid in data.get("bids", []):
-                            price, qty = bid[0], bid[1]
-                            # Ajout dans aggregated_bids
-                            if price in aggregated_bids:
-                                aggregated_bids[price][exch] = qty
-                            else:
-                                aggregated_bids[price] = {exch: qty}
-                        for ask in data.get("asks", []):
-                            price, qty = ask[0], ask[1]
-                            if price in aggregated_asks:
-                                aggregated_asks[price][exch] = qty
-                            else:
-                                aggregated_asks[price] = {exch: qty}
-                    
-                    # Conversion des dictionnaires en listes de niveaux triées.
-                    bids_list = []
-                    for price, exch_data in aggregated_bids.items():
-                        total = sum(exch_data.values())
-                        bids_list.append({
-                            "price": price,
-                            "exchanges": exch_data,
-                            "total": total
-                        })
-                    # Les bids sont triées par prix décroissant (meilleur bid en premier)
-                    bids_list.sort(key=lambda x: x["price"], reverse=True)
-                    
-                    asks_list = []
-                    for price, exch_data in aggregated_asks.items():
-                        total = sum(exch_data.values())
-                        asks_list.append({
-                            "price": price,
-                            "exchanges": exch_data,
-                            "total": total
-                        })
-                    # Les asks sont triées par prix croissant (meilleur ask en premier)
-                    asks_list.sort(key=lambda x: x["price"])
-                    
-                    # Construction du JSON agrégé final
-                    aggregated = {
-                        "standard_symbol": self.standard_symbol,
-                        "bids": bids_list,
-                        "asks": asks_list
-                    }
-                    
-                    # Diffusion à tous les clients abonnés
-                    for client in list(self.clients):
-                        try:
-                            await client.send_json(aggregated)
-                        except Exception:
-                            self.clients.remove(client)
-        except asyncio.CancelledError:
-            for task in self.feed_tasks.values():
-                task.cancel()
-            raise
+    def add_client(self, client: ClientConnection, mode: str = "full", depth: int = DEFAULT_DEPTH,
+                   max_rate: float = None, group: Decimal = None) -> BookView:
+        """
+        Rattache le client à la vue de ses paramètres (créée si besoin), en le retirant de sa vue précédente.
+        Retourne la vue, ou None si le client y était déjà abonné dans le même mode.
+        """
+        interval = max(self.min_publish_interval, 1 / max_rate) if max_rate else self.min_publish_interval
+        key = (depth, interval, group)
+        view = self.views.get(key)
+        if view is None:
+            if group is not None and step_decimals(str(group)) > self.price_decimals:
+                # Le pas de regroupement doit être un nombre entier de prix entiers
+                self._rescale(step_decimals(str(group)))
+            view = self.views[key] = BookView(self, key, depth, interval, group)
+            view.publish()  # Premier snapshot, avant l'arrivée des clients
+            view.task = asyncio.create_task(view.run())
+        elif view.clients.get(client) == mode:
+            return None
+        if self.clients.get(client) not in (None, view):
+            self.remove_client(client)
+        self.clients[client] = view
+        view.clients[client] = mode
+        self._update_venue_depth()
+        return view
+
+    def remove_client(self, client: ClientConnection):
+        """Retire le client de sa vue ; une vue sans client est supprimée."""
+        view = self.clients.pop(client, None)
+        if view is None:
+            return
+        view.clients.pop(client, None)
+        if not view.clients:
+            view.task.cancel()
+            del self.views[view.key]
+            self._update_venue_depth()
+
+    def _update_venue_depth(self):
+        """Ajuste le nombre de niveaux transmis par les exchanges à la vue la plus profonde."""
+        depth = max(
+            (MAX_DEPTH if view.group is not None else view.depth for view in self.views.values()),
+            default=DEFAULT_DEPTH
+        )
+        if depth != self.venue_depth:
+            self.venue_depth = depth
+            for exchange, (symbol, callback) in self.feed_callbacks.items():
+                exchange_dict[exchange].set_order_book_depth(symbol, callback, depth)
+
+    def close(self):
+        """Arrête les vues et les flux des exchanges (dernier client désabonné)."""
+        for view in self.views.values():
+            view.task.cancel()
+        for task in self.feed_tasks.values():
+            task.cancel()
+
+    def _notify(self):
+        for view in self.views.values():
+            view.changed.set()
+
+    def update(self, exchange: str, data: dict):
+        """Intègre le dernier carnet d'un exchange à l'agrégat."""
+        self.exchange_data[exchange] = data
+        if data.get("stale"):
+            if exchange not in self.stale:
+                self.stale.add(exchange)
+                self._set_levels(exchange, {}, {})
+                self._notify()
+            return
+        if exchange in self.stale:
+            self.stale.discard(exchange)
+            self._notify()
+
+        # Exchange plus précis que les précédents : on passe à son échelle
+        self.size_decimals = max(self.size_decimals, data.get("size_decimals", 8))
+        if data.get("price_decimals", 8) > self.price_decimals:
+            self._rescale(data.get("price_decimals", 8))
+        scale = 10 ** self.price_decimals
+        self._set_levels(
+            exchange,
+            {round(price * scale): qty for price, qty in data.get("bids", [])},
+            {round(price * scale): qty for price, qty in data.get("asks", [])}
+        )
+
+    def _set_levels(self, exchange: str, bids: dict, asks: dict):
+        """Remplace les niveaux d'un exchange en ne modifiant que les prix qui ont changé."""
+        previous = self.exchange_levels.setdefault(exchange, {"bids": {}, "asks": {}})
+        changed = False
+        for side, new in (("bids", bids), ("asks", asks)):
+            old = previous[side]
+            levels, prices = self.levels[side], self.prices[side]
+            sign = -1 if side == "bids" else 1
+            for price in old.keys() - new.keys():
+                level = levels[price]
+                del level[exchange]
+                changed = True
+                if not level:
+                    del levels[price]
+                    del prices[bisect_left(prices, sign * price)]
+            for price, qty in new.items():
+                if old.get(price) != qty:
+                    level = levels.get(price)
+                    if level is None:
+                        level = levels[price] = {}
+                        insort(prices, sign * price)
+                    level[exchange] = qty
+                    changed = True
+            previous[side] = new
+        if changed:
+            self._notify()
+
+    def _rescale(self, price_decimals: int):
+        """
+        Passe les prix entiers à une échelle plus fine. L'ordre des prix est conservé :
+        les listes triées et les niveaux déjà diffusés par les vues restent valables.
+        """
+        factor = 10 ** (price_decimals - self.price_decimals)
+        self.price_decimals = price_decimals
+        for side in ("bids", "asks"):
+            self.levels[side] = {price * factor: level for price, level in self.levels[side].items()}
+            self.prices[side] = [price * factor for price in self.prices[side]]
+        for levels in self.exchange_levels.values():
+            for side in ("bids", "asks"):
+                levels[side] = {price * factor: qty for price, qty in levels[side].items()}
+        for view in self.views.values():
+            view.rescale(factor)
 
 class AggregatedSubscriptionManager:
-    def __init__(self):
+    def __init__(self, min_publish_interval: float = 0.1):
+        """
+        :param min_publish_interval: Délai minimal (s) entre deux diffusions d'un même carnet agrégé.
+        """
+        self.min_publish_interval = min_publish_interval
         # Clé: symbole standard (ex: "BTC-USD")
         # Valeur: instance d'AggregatedSubscription
         self.subscriptions = {}
 
-    async def subscribe(self, client: WebSocket, exchange: str, symbol: str, formatter) -> None:
+    async def subscribe(self, client: ClientConnection, exchange: str, symbol: str, formatter, mode: str = "full",
+                        depth: int = DEFAULT_DEPTH, max_rate: float = None, group: Decimal = None) -> None:
         """
         Ajoute le client à l'abonnement agrégé pour le symbole standard obtenu depuis l'input.
         La méthode ajoute aussi le flux de l'exchange (au format spécifique) s'il n'est pas déjà présent.
+        Les paramètres depth, max_rate et group choisissent la vue diffusée au client (voir parse_view_options).
+        Le client reçoit aussitôt l'état courant de cette vue : le carnet en mode "full",
+        un snapshot numéroté en mode "delta" (voir BookView).
         """
         # On convertit l'input en format standard, ex: "BTC-USD"
         standard_symbol = formatter.to_standard(symbol)
         # On obtient le symbole propre à l'exchange (par exemple "BTCUSDT" pour Binance)
         exchange_specific_symbol = formatter.format_input(symbol, exchange)
         if standard_symbol not in self.subscriptions:
-            agg_sub = AggregatedSubscription(standard_symbol)
-            agg_sub.clients.add(client)
-            self.subscriptions[standard_symbol] = agg_sub
-            await agg_sub.add_exchange(exchange, exchange_specific_symbol)
-            agg_sub.broadcast_task = asyncio.create_task(agg_sub.run())
-        else:
-            agg_sub = self.subscriptions[standard_symbol]
-            agg_sub.clients.add(client)
-            await agg_sub.add_exchange(exchange, exchange_specific_symbol)
+            self.subscriptions[standard_symbol] = AggregatedSubscription(standard_symbol, self.min_publish_interval)
+        agg_sub = self.subscriptions[standard_symbol]
+        view = agg_sub.add_client(client, mode, depth, max_rate, group)
+        if view is not None:
+            await client.send_json(view.snapshot() if mode == "delta" else view.current())
+        await agg_sub.add_exchange(exchange, exchange_specific_symbol)
 
-    async def unsubscribe(self, client: WebSocket, exchange: str, symbol: str, formatter) -> None:
+    async def resync(self, client: ClientConnection, symbol: str, formatter) -> bool:
+        """
+        Renvoie au client un snapshot numéroté de sa vue du carnet agrégé (après un trou dans les numéros de séquence).
+        Retourne False si le client n'est pas abonné au symbole.
+        """
+        agg_sub = self.subscriptions.get(formatter.to_standard(symbol))
+        view = agg_sub.clients.get(client) if agg_sub is not None else None
+        if view is None:
+            return False
+        await client.send_json(view.snapshot())
+        return True
+
+    async def unsubscribe(self, client: ClientConnection, exchange: str, symbol: str, formatter) -> None:
         """
         Retire le client de l'abonnement agrégé pour le symbole standard.
         Si plus aucun client n'est abonné, l'abonnement est annulé.
@@ -133,14 +507,9 @@ class AggregatedSubscriptionManager:
         standard_symbol = formatter.to_standard(symbol)
         if standard_symbol in self.subscriptions:
             agg_sub = self.subscriptions[standard_symbol]
-            if client in agg_sub.clients:
-                agg_sub.clients.remove(client)
+            agg_sub.remove_client(client)
             # Optionnel : on peut retirer le flux de l'exchange en cas de désabonnement individuel
             # (selon votre logique métier)
             if not agg_sub.clients:
-                if agg_sub.broadcast_task:
-                    agg_sub.broadcast_task.cancel()
-                for task in agg_sub.feed_tasks.values():
-                    task.cancel()
+                agg_sub.close()
                 del self.subscriptions[standard_symbol]
-
@@ -0,0 +1,130 @@
+import asyncio
+import json
+import os
+import time
+from Utilities.SymbolFormatter import AdvancedSymbolFormatter
+from Exchanges import exchange_dict
+
+
+class SymbolCatalog:
+    """
+    Catalogue des paires de trading de chaque exchange (avec leurs pas de prix et de quantité),
+    et AdvancedSymbolFormatter construit à partir de celui-ci.
+
+    Au démarrage, le catalogue est chargé depuis un instantané sur disque (quelques millisecondes),
+    sans dépendre de la disponibilité des exchanges. Il est ensuite rafraîchi en tâche de fond :
+    les exchanges sont interrogés en parallèle, l'instantané est réécrit et un nouveau formatter
+    remplace l'ancien d'un seul coup (les requêtes en cours gardent l'ancien).
+    """
+
+    def __init__(self, exchanges: dict, path: str = "Server/Data/symbols.json", ttl: float = 24 * 3600):
+        """
+        :param exchanges: Mapping nom -> instance d'exchange (voir Exchanges.exchange_dict).
+        :param path: Chemin de l'instantané sur disque.
+        :param ttl: Durée (s) au-delà de laquelle l'instantané est considéré comme périmé et rafraîchi.
+        """
+        self.exchanges = exchanges
+        self.path = path
+        self.ttl = ttl
+        self.pairs = {}  # mapping : exchange -> liste des paires au format natif
+        self.instruments = {}  # mapping : exchange -> {paire: {"tick_size": ..., "lot_size": ...}}
+        self.updated_at = 0.0
+        self.formatter = AdvancedSymbolFormatter({})
+        self.refresh_task = None
+
+    def load_snapshot(self) -> bool:
+        """
+        Charge l'instantané sur disque s'il existe. Retourne True en cas de succès.
+        """
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[SymbolCatalog] No usable snapshot at {self.path}: {e}")
+            return False
+        if "instruments" not in snapshot:
+            # Ancien format, sans les pas de cotation : on garde les paires mais on le rafraîchit tout de suite
+            self.instruments = {name: dict.fromkeys(pairs, {}) for name, pairs in snapshot["exchanges"].items()}
+            self.updated_at = 0.0
+        else:
+            self.instruments = snapshot["instruments"]
+            self.updated_at = snapshot["updated_at"]
+        self.pairs = {name: list(instruments) for name, instruments in self.instruments.items()}
+        self.formatter = AdvancedSymbolFormatter(self.pairs)
+        self._share_instruments()
+        print(f"[SymbolCatalog] Loaded {sum(len(p) for p in self.pairs.values())} pairs from snapshot")
+        return True
+
+    def save_snapshot(self):
+        """Écrit l'instantané de manière atomique (fichier temporaire puis renommage)."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"updated_at": self.updated_at, "instruments": self.instruments}, f)
+        os.replace(tmp_path, self.path)
+
+    def _share_instruments(self):
+        """Transmet les pas de cotation aux adapters, qui en ont besoin pour leurs carnets d'ordres."""
+        for name, specs in self.instruments.items():
+            if name in self.exchanges:
+                self.exchanges[name].instruments = specs
+
+    def is_stale(self) -> bool:
+        return time.time() - self.updated_at > self.ttl
+
+    async def refresh(self):
+        """
+        Récupère les instruments de tous les exchanges en parallèle puis remplace le formatter.
+        Un exchange en erreur conserve les instruments de l'instantané précédent.
+        """
+        names = list(self.exchanges.keys())
+        results = await asyncio.gather(
+            *(self.exchanges[name].get_instruments() for name in names),
+            return_exceptions=True
+        )
+        instruments = dict(self.instruments)
+        for name, result in zip(names, results):
+            if isinstance(result, Exception):
+                print(f"[SymbolCatalog] Error fetching pairs for {name}: {result}")
+            else:
+                instruments[name] = result
+        if all(isinstance(result, Exception) for result in results):
+            raise Exception("no exchange answered")
+        pairs = {name: list(specs) for name, specs in instruments.items()}
+        formatter = await asyncio.to_thread(AdvancedSymbolFormatter, pairs)
+        # Remplacement atomique : une seule affectation, visible par toutes les requêtes suivantes
+        self.instruments, self.pairs, self.formatter, self.updated_at = instruments, pairs, formatter, time.time()
+        self._share_instruments()
+        await asyncio.to_thread(self.save_snapshot)
+        print(f"[SymbolCatalog] Refreshed {sum(len(p) for p in pairs.values())} pairs")
+
+    async def _refresh_loop(self):
+        while True:
+            if self.is_stale():
+                try:
+                    await self.refresh()
+                except Exception as e:
+                    print(f"[SymbolCatalog] Refresh failed: {e}")
+            await asyncio.sleep(max(self.updated_at + self.ttl - time.time(), 60))
+
+    def start(self):
+        """
+        Charge l'instantané puis lance le rafraîchissement périodique en tâche de fond
+        (immédiat si l'instantané est absent ou périmé).
+        """
+        self.load_snapshot()
+        self.refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self.refresh_task is not None:
+            self.refresh_task.cancel()
+            self.refresh_task = None
+
+    async def get_pairs(self, exchange: str) -> list[str]:
+        """Paires d'un exchange, depuis le catalogue (ou directement depuis l'exchange s'il est encore vide)."""
+        if exchange not in self.pairs:
+            return await self.exchanges[exchange].get_available_trading_pairs()
+        return self.pairs[exchange]
+
+
+symbol_catalog = SymbolCatalog(exchange_dict)
@@ -1,14 +1,52 @@
+class QuoteTrie:
+    """
+    Trie des quotes construit sur les caractères inversés : retrouve en un seul parcours de la fin
+    du symbole toutes les quotes qui le terminent (ex: "ETHBUSD" -> "USD", "BUSD").
+    """
+
+    def __init__(self, quotes=()):
+        self.root = {}
+        for quote in quotes:
+            self.add(quote)
+
+    def add(self, quote: str):
+        node = self.root
+        for char in reversed(quote.upper()):
+            node = node.setdefault(char, {})
+        node[""] = quote.upper()  # Marque la fin d'une quote
+
+    def suffixes(self, symbol: str) -> list[str]:
+        """
+        Quotes qui terminent `symbol` en laissant une base non vide, de la plus courte à la plus longue.
+        """
+        found = []
+        node = self.root
+        for char in reversed(symbol[1:]):
+            node = node.get(char)
+            if node is None:
+                break
+            if "" in node:
+                found.append(node[""])
+        return found
+
+
 class SymbolFormatter:
     # On définit ici les quotes courantes qui, lorsqu’on les reçoit, seront ramenées à "USD"
     standard_quotes = {"USDT", "USDC", "BUSD", "USD"}
+    # Quotes reconnues à la fin d'un symbole sans séparateur (ex: "ETHBTC")
+    known_quotes = ("USDT", "USDC", "BUSD", "USD", "FDUSD", "TUSD", "DAI", "EUR", "GBP", "JPY", "TRY", "BTC", "ETH", "BNB")
+    quote_trie = QuoteTrie(known_quotes)
+    # Codes de base propres à certains exchanges (Kraken : "XBT/USD")
+    base_aliases = {"XBT": "BTC", "XDG": "DOGE"}
 
     @staticmethod
-    def parse_symbol(symbol: str) -> tuple[str, str]:
+    def parse_symbol(symbol: str, quote_trie: QuoteTrie = None, known_bases: set = frozenset()) -> tuple[str, str]:
         """
         Extrait la partie "base" et "quote" d'un symbole.
         On essaie de détecter un séparateur ( '-' ou '/' ).
-        Si aucun séparateur n'est trouvé, on tente de déterminer la quote en vérifiant si
-        le symbole se termine par l'une des quotes connues.
+        Si aucun séparateur n'est trouvé, on retient la plus longue quote connue qui termine le symbole
+        (de préférence en laissant une base connue), ce qui rend le résultat déterministe
+        (ex: "ETHBUSD" -> ("ETH", "BUSD") et non ("ETHB", "USD")).
         """
         symbol = symbol.strip()
         if '-' in symbol:
@@ -19,15 +57,25 @@ class SymbolFormatter:
             return parts[0].upper(), parts[1].upper()
         else:
             symbol_upper = symbol.upper()
-            # On cherche si le symbole se termine par l'une des quotes connues.
-            for quote in SymbolFormatter.standard_quotes:
-                if symbol_upper.endswith(quote):
-                    base = symbol_upper[:-len(quote)]
-                    return base, quote
+            quotes = (quote_trie or SymbolFormatter.quote_trie).suffixes(symbol_upper)
+            if quotes:
+                quote = next(
+                    (q for q in reversed(quotes) if symbol_upper[:-len(q)] in known_bases),
+                    quotes[-1]
+                )
+                return symbol_upper[:-len(quote)], quote
             # Sinon, on effectue une division approximative.
             mid = len(symbol) // 2
             return symbol_upper[:mid], symbol_upper[mid:]
 
+    @staticmethod
+    def standardize(base: str, quote: str) -> str:
+        """Construit le symbole standard "BASE-QUOTE" (quotes dollar ramenées à "USD", alias de base résolus)."""
+        base = SymbolFormatter.base_aliases.get(base, base)
+        if quote in {"USDT", "USDC", "BUSD"}:
+            quote = "USD"
+        return f"{base}-{quote}"
+
     @staticmethod
     def to_standard(symbol: str) -> str:
         """
@@ -38,10 +86,7 @@ class SymbolFormatter:
           "BTCUSDT"  -> "BTC-USD"
           "btc-usd"  -> "BTC-USD"
         """
-        base, quote = SymbolFormatter.parse_symbol(symbol)
-        if quote in {"USDT", "USDC", "BUSD"}:
-            quote = "USD"
-        return f"{base}-{quote}"
+        return SymbolFormatter.standardize(*SymbolFormatter.parse_symbol(symbol))
 
     @staticmethod
     def from_standard(standard_symbol: str, exchange: str) -> str:
@@ -84,29 +129,92 @@ class SymbolFormatter:
 
 
 class AdvancedSymbolFormatter(SymbolFormatter):
-    def __init__(self, exchange_pairs: dict[str, list[str]]):
+    # Ordre de préférence des quotes natives lorsqu'un symbole standard correspond à plusieurs paires
+    # d'un même exchange (ex: "BTC-USD" -> "BTCUSDT" plutôt que "BTCUSDC" sur Binance)
+    quote_preference = ("USDT", "USD", "USDC", "BUSD")
+
+    def __init__(self, exchange_pairs: dict[str, list[str]], cache_size: int = 4096):
         """
         Initialise le formatter avancé en chargeant, pour chaque exchange, la liste des trading pairs
-        disponibles (dans leur format natif) et en calculant l'ensemble des bases connues.
+        disponibles (dans leur format natif) et en précalculant les index de conversion :
+        symbole natif -> standard et standard -> symbole natif, par exchange.
 
         :param exchange_pairs: dictionnaire avec comme clés les noms d'exchange (par ex. "binance", "okx", "kraken")
                                et comme valeurs la liste des trading pairs disponibles sur cet exchange.
+        :param cache_size: nombre maximal de conversions mémorisées.
         """
-        self.exchange_pairs = {}  # mapping exchange -> set de symboles en format standard (ex: "BTC-USD")
-        self.base_symbols = {}    # mapping exchange -> set des bases (ex: "BTC", "ETH", ...)
+        self.exchange_pairs = {}       # mapping exchange -> set de symboles en format standard (ex: "BTC-USD")
+        self.base_symbols = {}         # mapping exchange -> set des bases (ex: "BTC", "ETH", ...)
+        self.native_to_standard = {}   # mapping exchange -> {symbole natif: symbole standard}
+        self.standard_to_native = {}   # mapping exchange -> {symbole standard: symbole natif}
+        self.compact_to_native = {}    # mapping exchange -> {symbole natif sans séparateur: symbole natif}
+        self.listings = {}             # mapping symbole standard -> {exchange: symbole natif}
+        self.cache_size = cache_size
+        self.cache = {}                # mapping (symbole, exchange) -> résultat de format_input
+
+        # Les paires avec séparateur (OKX, Kraken, Coinbase) font connaître les quotes et bases réellement
+        # utilisées, qui servent ensuite à découper les paires sans séparateur (Binance)
+        self.quote_trie = QuoteTrie(self.known_quotes)
+        self.known_bases = set()
+        for pairs in exchange_pairs.values():
+            for pair in pairs:
+                if '-' in pair or '/' in pair:
+                    base, quote = SymbolFormatter.parse_symbol(pair)
+                    self.quote_trie.add(quote)
+                    self.known_bases.add(base)
+
         for exchange, pairs in exchange_pairs.items():
             exchange_lower = exchange.lower()
-            standard_pairs = set()
+            native_to_standard = {}
             for pair in pairs:
                 try:
-                    standard_pair = self.to_standard(pair)
-                    standard_pairs.add(standard_pair)
+                    native_to_standard[pair] = self.to_standard(pair)
                 except Exception as e:
                     print(f"Error processing pair '{pair}' for exchange '{exchange}': {e}")
-            self.exchange_pairs[exchange_lower] = standard_pairs
+            self.native_to_standard[exchange_lower] = native_to_standard
+            self.compact_to_native[exchange_lower] = {self.compact(pair): pair for pair in sorted(native_to_standard)}
+            self.standard_to_native[exchange_lower] = self._preferred_natives(native_to_standard, exchange_lower)
+            self.exchange_pairs[exchange_lower] = set(native_to_standard.values())
             # Extraire la base pour chaque pair standard (si le format "BASE-QUOTE" est respecté)
-            bases = {pair.split('-')[0] for pair in standard_pairs if '-' in pair}
+            bases = {pair.split('-')[0] for pair in self.exchange_pairs[exchange_lower] if '-' in pair}
             self.base_symbols[exchange_lower] = bases
+            for standard, native in self.standard_to_native[exchange_lower].items():
+                self.listings.setdefault(standard, {})[exchange_lower] = native
+
+    @staticmethod
+    def compact(symbol: str) -> str:
+        """Forme sans séparateur ni casse d'un symbole, pour reconnaître un symbole natif saisi librement."""
+        return symbol.strip().upper().replace('-', '').replace('/', '')
+
+    def _preferred_natives(self, native_to_standard: dict[str, str], exchange: str) -> dict[str, str]:
+        """
+        Pour chaque symbole standard, choisit de manière déterministe le symbole natif à utiliser :
+        celui de from_standard s'il est listé, sinon selon quote_preference puis l'ordre alphabétique.
+        """
+        candidates = {}
+        for native, standard in native_to_standard.items():
+            candidates.setdefault(standard, []).append(native)
+        preferred = {}
+        for standard, natives in candidates.items():
+            expected = self.from_standard(standard, exchange)
+            if expected in natives:
+                preferred[standard] = expected
+                continue
+
+            def rank(native):
+                quote = SymbolFormatter.parse_symbol(native, self.quote_trie, self.known_bases)[1]
+                order = self.quote_preference.index(quote) if quote in self.quote_preference else len(self.quote_preference)
+                return order, native
+            preferred[standard] = min(natives, key=rank)
+        return preferred
+
+    def parse_symbol(self, symbol: str) -> tuple[str, str]:
+        """Comme SymbolFormatter.parse_symbol, avec les quotes et bases connues des exchanges."""
+        return SymbolFormatter.parse_symbol(symbol, self.quote_trie, self.known_bases)
+
+    def to_standard(self, symbol: str) -> str:
+        """Comme SymbolFormatter.to_standard, avec les quotes et bases connues des exchanges."""
+        return SymbolFormatter.standardize(*self.parse_symbol(symbol))
 
     def is_valid(self, symbol: str, exchange: str) -> bool:
         """
@@ -114,33 +222,58 @@ class AdvancedSymbolFormatter(SymbolFormatter):
         disponibles pour l'exchange donné.
         """
         exchange_lower = exchange.lower()
-        standard_symbol = self.to_standard(symbol)
-        return standard_symbol in self.exchange_pairs.get(exchange_lower, set())
+        return (
+            self.compact(symbol) in self.compact_to_native.get(exchange_lower, {})
+            or self.to_standard(symbol) in self.standard_to_native.get(exchange_lower, {})
+        )
+
+    def get_listings(self, symbol: str) -> dict[str, str]:
+        """
+        Exchanges listant le symbole (quel que soit son format d'entrée), avec leur symbole natif.
+        Ex: get_listings("BTC-USD") -> {"binance": "BTCUSDT", "kraken": "XBT/USD", ...}
+        """
+        return dict(self.listings.get(self.to_standard(symbol), {}))
+
+    def is_listed(self, symbol: str, exchange: str) -> bool:
+        """
+        Indique si l'exchange liste le symbole. Un exchange dont les paires ne sont pas (encore) connues
+        est considéré comme listant tous les symboles, pour ne rien bloquer avant le chargement du catalogue.
+        """
+        exchange_lower = exchange.lower()
+        if exchange_lower not in self.standard_to_native:
+            return True
+        return self.is_valid(symbol, exchange_lower)
 
     def format_input(self, symbol: str, exchange: str) -> str:
         """
         Convertit l'input de l'utilisateur (peu importe son format) en symbole de trading
-        formaté pour l'exchange, en se basant sur la liste préchargée.
-        
-        Si la conversion standard donne un symbole présent dans la liste des trading pairs,
-        on retourne sa version spécifique à l'exchange.
-        Sinon, on tente d'identifier heuristiquement la base en se basant sur les bases connues.
+        formaté pour l'exchange, en se basant sur les index préchargés (recherches en temps constant,
+        résultats mémorisés).
+
+        Si l'input désigne directement une paire native de l'exchange (ex: "btc/usdc" -> "BTCUSDC"), on la retourne.
+        Sinon, on retourne la paire native correspondant à sa conversion standard.
         En dernier recours, on retourne la conversion standard.
         """
+        key = (symbol, exchange)
+        if key in self.cache:
+            return self.cache[key]
+
         exchange_lower = exchange.lower()
-        standard_symbol = self.to_standard(symbol)
-        if standard_symbol in self.exchange_pairs.get(exchange_lower, set()):
-            return self.from_standard(standard_symbol, exchange_lower)
-        # Tentative heuristique : si l'input commence par une base connue
-        for base in self.base_symbols.get(exchange_lower, set()):
-            if symbol.upper().startswith(base):
-                quote_candidate = symbol.upper()[len(base):]
-                if quote_candidate in self.standard_quotes:
-                    candidate_standard = f"{base}-{quote_candidate}"
-                    if candidate_standard in self.exchange_pairs[exchange_lower]:
-                        return self.from_standard(candidate_standard, exchange_lower)
-        # En dernier recours, retourne la conversion standard
-        return self.from_standard(standard_symbol, exchange_lower)
+        native = self.compact_to_native.get(exchange_lower, {}).get(self.compact(symbol))
+        if native is None:
+            standard_symbol = self.to_standard(symbol)
+            native = self.standard_to_native.get(exchange_lower, {}).get(standard_symbol)
+            if native is None:
+                native = self.from_standard(standard_symbol, exchange_lower)
+
+        if len(self.cache) >= self.cache_size:
+            self.cache.clear()
+        self.cache[key] = native
+        return native
+
+    def to_exchange(self, symbol: str, exchange: str) -> str:
+        """Comme SymbolFormatter.to_exchange, en s'appuyant sur les paires réellement listées (voir format_input)."""
+        return self.format_input(symbol, exchange)
 
 
 # Exemple d'utilisation
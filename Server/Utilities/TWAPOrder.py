@@ -31,17 +31,17 @@ async def simulate_twap_order(order_id: str, username: str, symbol: str, side: s
     # (dans une application réelle, utilisez un formatter avancé)
     binance_symbol = SymbolFormatter.from_standard(symbol, "binance")
     
-    # On démarre une souscription Binance pour mettre à jour le carnet d'ordre global
-    # Si ce n'est pas déjà fait, lancez la souscription (en tâche de fond)
-    if symbol not in binance_order_books:
-        asyncio.create_task(exchange_dict['binance'].subscribe_order_book(binance_symbol, lambda data: update_binance_order_book(symbol, data)))
+    # On démarre une souscription Binance (en tâche de fond) pour mettre à jour le carnet d'ordre global.
+    # Le flux est partagé avec les autres abonnés du symbole : à la fin, on ne retire que notre callback.
+    callback = lambda data: update_binance_order_book(symbol, data)
+    asyncio.create_task(exchange_dict['binance'].subscribe_order_book(binance_symbol, callback))
     await asyncio.sleep(2)  # Laisser le temps de récupérer les premières données
     slice_qty = total_quantity / (duration // interval)
     executed = 0.0
     for i in range(0, duration, interval):
         await asyncio.sleep(interval)
         order_book = binance_order_books.get(symbol)
-        if not order_book:
+        if not order_book or order_book.get("stale"):
             print(f"Slice {i // interval}: no order book data for {symbol}")
             continue
         
@@ -71,4 +71,4 @@ async def simulate_twap_order(order_id: str, username: str, symbol: str, side: s
             print(f"Slice {i // interval}: price condition not met for {symbol}")
 
     dbm.close_order(order_id)
-    exchange_dict["binance"].unsubscribe_order_book(binance_symbol)
\ No newline at end of file
+    exchange_dict["binance"].unsubscribe_order_book(binance_symbol, callback)
\ No newline at end of file
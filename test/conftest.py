@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Les modules du serveur s'importent depuis Server/, comme au lancement de Server.py
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "Server"))
@@ -0,0 +1,94 @@
+import pytest
+from Utilities.OrderBook import OrderBook, SequenceGap
+
+
+def test_snapshot_levels():
+    """Vérifie qu'un snapshot remplace le carnet et que les niveaux sont triés du meilleur au moins bon."""
+    book = OrderBook(tick_size="0.01", lot_size="0.001")
+    book.apply_snapshot([["100.00", "1"], ["101.50", "2"]], [["102.00", "0.5"], ["101.75", "3"]], sequence=10)
+
+    data = book.snapshot()
+    assert data["bids"] == [[101.5, 2.0], [100.0, 1.0]], f"Unexpected bids: {data['bids']}"
+    assert data["asks"] == [[101.75, 3.0], [102.0, 0.5]], f"Unexpected asks: {data['asks']}"
+    assert data["stale"] is False
+
+
+def test_delta_updates_and_removes_levels():
+    """Vérifie qu'un delta modifie les niveaux existants et qu'une quantité nulle supprime le niveau."""
+    book = OrderBook(tick_size="0.01", lot_size="0.001")
+    book.apply_snapshot([["100", "1"], ["99", "1"]], [["101", "1"]], sequence=1)
+
+    assert book.apply_delta([["100", "0"], ["99", "4"]], [["101.5", "2"]], sequence=2, first_sequence=2)
+
+    data = book.snapshot()
+    assert data["bids"] == [[99.0, 4.0]], f"Unexpected bids: {data['bids']}"
+    assert data["asks"] == [[101.0, 1.0], [101.5, 2.0]], f"Unexpected asks: {data['asks']}"
+    assert book.sequence == 2
+
+
+def test_delta_before_snapshot_raises():
+    """Un delta reçu avant tout snapshot ne peut pas être appliqué."""
+    book = OrderBook()
+    with pytest.raises(SequenceGap):
+        book.apply_delta([["100", "1"]], [], sequence=1)
+
+
+def test_first_sequence_gap():
+    """
+    Numérotation à la Binance (first_sequence) : un message déjà inclus est ignoré,
+    un message qui saute des numéros lève une SequenceGap et désynchronise le carnet.
+    """
+    book = OrderBook()
+    book.apply_snapshot([["100", "1"]], [["101", "1"]], sequence=100)
+
+    assert book.apply_delta([["100", "5"]], [], sequence=100, first_sequence=95) is False
+    assert book.snapshot()["bids"] == [[100.0, 1.0]], "An outdated delta should be ignored"
+    assert book.apply_delta([["100", "2"]], [], sequence=105, first_sequence=98)
+
+    with pytest.raises(SequenceGap):
+        book.apply_delta([["100", "3"]], [], sequence=110, first_sequence=107)
+    assert book.snapshot()["stale"] is True
+
+    # Le carnet reste désynchronisé jusqu'au prochain snapshot
+    with pytest.raises(SequenceGap):
+        book.apply_delta([["100", "3"]], [], sequence=111, first_sequence=111)
+    book.apply_snapshot([["100", "3"]], [["101", "1"]], sequence=120)
+    assert book.apply_delta([["100", "4"]], [], sequence=121, first_sequence=121)
+
+
+def test_prev_sequence_gap():
+    """
+    Numérotation à la OKX (prev_sequence) : chaque message doit suivre le dernier appliqué,
+    même si la numérotation est réinitialisée.
+    """
+    book = OrderBook()
+    book.apply_snapshot([["100", "1"]], [["101", "1"]], sequence=50)
+
+    assert book.apply_delta([["100", "2"]], [], sequence=51, prev_sequence=50)
+    assert book.apply_delta([["100", "3"]], [], sequence=3, prev_sequence=51), "A sequence reset should be accepted"
+    assert book.apply_delta([["100", "4"]], [], sequence=2, prev_sequence=1) is False
+
+    with pytest.raises(SequenceGap):
+        book.apply_delta([["100", "5"]], [], sequence=10, prev_sequence=8)
+    assert not book.synced
+
+
+def test_depth_truncates_levels():
+    """Le carnet ne garde que les `depth` meilleurs niveaux par côté."""
+    book = OrderBook(depth=2)
+    book.apply_snapshot([["100", "1"], ["99", "1"], ["98", "1"]], [["101", "1"], ["102", "1"], ["103", "1"]])
+
+    data = book.snapshot()
+    assert [level[0] for level in data["bids"]] == [100.0, 99.0]
+    assert [level[0] for level in data["asks"]] == [101.0, 102.0]
+
+
+def test_huge_size_falls_back_to_python_ints():
+    """Une quantité qui dépasse les entiers 64 bits est conservée exactement (listes d'entiers Python)."""
+    book = OrderBook(tick_size="0.01", lot_size="0.00000001")
+    book.apply_snapshot([["100", "1"]], [["101", "1"]])
+
+    book.apply_delta([["99", "1e12"]], [])
+
+    assert isinstance(book.bids.sizes, list)
+    assert book.snapshot()["bids"] == [[100.0, 1.0], [99.0, 1e12]]
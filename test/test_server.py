@@ -1,3 +1,4 @@
+import json
 import pytest
 import requests
 from os import getenv
@@ -74,6 +75,18 @@ def test_symbols():
         assert "symbols" in data, f"Response has no 'symbols': {data}"
 
 
+def test_listings():
+    """
+    Teste l'endpoint /listings/{symbol} : exchanges listant la paire, avec leur symbole natif.
+    """
+    resp = requests.get(f"{BASE_URL}/listings/BTC-USD")
+
+    assert resp.status_code == 200, f"Expecting 200, got {resp.status_code}"
+    data = resp.json()
+    assert data["symbol"] == "BTC-USD"
+    assert data["exchanges"].get("binance") == "BTCUSDT", f"Unexpected listings: {data['exchanges']}"
+
+
 def test_klines(token_fixture):
     """
     Teste l'endpoint /klines/{exchange}/{symbol} (ex: binance / BTCUSDT) 
@@ -92,6 +105,108 @@ def test_klines(token_fixture):
 
 
 
+def test_klines_columns_format():
+    """
+    Teste le format colonne de l'endpoint /klines/{exchange}/{symbol} :
+    un tableau par champ, tous de même longueur.
+    """
+    url = f"{BASE_URL}/klines/binance/BTC-USD"
+
+    resp = requests.get(url, params={"format": "columns"})
+
+    assert resp.status_code == 200, f"Expecting 200, got {resp.status_code}"
+    data = resp.json()
+    assert isinstance(data, dict), f"Expecting dict of columns, got {type(data)}"
+    lengths = {len(data[field]) for field in ["timestamp", "open", "high", "low", "close", "volume"]}
+    assert len(lengths) == 1, f"Columns have different lengths: {lengths}"
+
+
+def test_klines_etag():
+    """
+    Teste le cache HTTP de /klines : une plage passée renvoie un ETag, et une requête
+    conditionnelle avec cet ETag reçoit un 304 sans corps.
+    """
+    url = f"{BASE_URL}/klines/binance/BTC-USD"
+    params = {"start_date": "2025-01-01", "end_date": "2025-01-07"}
+
+    resp = requests.get(url, params=params)
+
+    assert resp.status_code == 200, f"Expecting 200, got {resp.status_code}"
+    etag = resp.headers.get("ETag")
+    assert etag, "Expecting an ETag header"
+    assert "immutable" in resp.headers.get("Cache-Control", "")
+
+    resp = requests.get(url, params=params, headers={"If-None-Match": etag})
+    assert resp.status_code == 304, f"Expecting 304, got {resp.status_code}"
+
+
+def test_klines_stream():
+    """
+    Teste la réponse en flux de l'endpoint /klines/{exchange}/{symbol} :
+    une chandelle JSON par ligne (NDJSON).
+    """
+    url = f"{BASE_URL}/klines/binance/BTC-USD"
+
+    resp = requests.get(url, params={"stream": "true", "interval": "1h"}, stream=True)
+
+    assert resp.status_code == 200, f"Expecting 200, got {resp.status_code}"
+    lines = [json.loads(line) for line in resp.iter_lines() if line]
+    assert len(lines) > 0, "Expecting at least one kline"
+    timestamps = [kline["timestamp"] for kline in lines]
+    assert timestamps == sorted(timestamps), "Klines should be streamed in chronological order"
+
+
+def test_aligned_klines():
+    """
+    Teste l'endpoint /klines/{symbol} : séries de plusieurs exchanges alignées sur un index commun.
+    """
+    url = f"{BASE_URL}/klines/BTC-USD"
+
+    resp = requests.get(url, params={"exchanges": "binance,okx", "composite": "true"})
+
+    assert resp.status_code == 200, f"Expecting 200, got {resp.status_code}"
+    data = resp.json()
+    length = len(data["timestamp"])
+    for columns in [*data["exchanges"].values(), data["composite"]]:
+        assert len(columns["close"]) == length, "Series should be aligned on the common index"
+
+
+def test_aligned_klines_daily_timestamps_coincide():
+    """
+    Teste l'alignement de /klines/{symbol} en 1d : les chandelles journalières des exchanges s'ouvrent
+    toutes à 00:00 UTC, donc au moins un timestamp porte une chandelle de chacun des deux exchanges.
+    """
+    url = f"{BASE_URL}/klines/BTC-USD"
+    params = {"exchanges": "binance,okx", "interval": "1d", "start_date": "2025-01-01", "end_date": "2025-01-07"}
+
+    resp = requests.get(url, params=params)
+
+    assert resp.status_code == 200, f"Expecting 200, got {resp.status_code}"
+    data = resp.json()
+    closes = [data["exchanges"][name]["close"] for name in ("binance", "okx")]
+    common = [ts for ts, *values in zip(data["timestamp"], *closes) if all(value is not None for value in values)]
+    assert common, f"Daily candles should share timestamps across exchanges: {data['timestamp']}"
+    assert all(ts % 86_400_000 == 0 for ts in data["timestamp"]), "Daily candles should open at 00:00 UTC"
+
+
+def test_klines_batch():
+    """
+    Teste l'endpoint POST /klines/batch : plusieurs paires en une requête, table longue au format colonne.
+    """
+    url = f"{BASE_URL}/klines/batch"
+    body = {
+        "pairs": [{"exchange": "binance", "symbol": "BTC-USD"}, {"exchange": "okx", "symbol": "ETH-USD"}],
+        "interval": "1h"
+    }
+
+    resp = requests.post(url, json=body)
+
+    assert resp.status_code == 200, f"Expecting 200, got {resp.status_code}"
+    data = resp.json()
+    assert set(data["exchange"]) == {"binance", "okx"}, f"Expecting klines for both pairs, got {set(data['exchange'])}"
+    assert len(data["symbol"]) == len(data["timestamp"]) == len(data["close"])
+
+
 def test_orders_CRUD(token_fixture):
     """
     Test minimal sur l’API /orders/twap ou /orders 
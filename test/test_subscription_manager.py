@@ -0,0 +1,374 @@
+import asyncio
+import json
+import pytest
+from decimal import Decimal
+from Utilities.SubscriptionManager import AggregatedSubscription, BookView, ClientConnection, parse_view_options, DEFAULT_DEPTH
+from Utilities.OrderBookStream import OrderBookStream, StreamConnection
+from Exchanges import exchange_dict
+
+
+class FakeWebSocket:
+    """WebSocket de test : enregistre les messages envoyés ; les envois attendent que `open` soit levé."""
+
+    def __init__(self, blocked=False):
+        self.sent = []
+        self.close_code = None
+        self.open = asyncio.Event()
+        if not blocked:
+            self.open.set()
+
+    async def send_text(self, payload: str):
+        await self.open.wait()
+        self.sent.append(payload)
+
+    async def close(self, code: int = 1000):
+        self.close_code = code
+
+
+class FakeExchangeSocket:
+    """Connexion WebSocket d'un exchange, déjà ouverte : enregistre les messages d'abonnement envoyés."""
+
+    def __init__(self):
+        self.closed = False
+        self.sent = []
+
+    async def send_json(self, message: dict):
+        self.sent.append(message)
+
+
+def book(bids, asks, stale=False):
+    """Carnet au format standardisé des adapters (voir OrderBook.snapshot)."""
+    return {"bids": bids, "asks": asks, "stale": stale, "price_decimals": 2, "size_decimals": 3}
+
+
+def make_subscription():
+    """Carnet agrégé BTC-USD alimenté par binance et okx."""
+    subscription = AggregatedSubscription("BTC-USD")
+    subscription.update("binance", book([[100.0, 1.0], [99.5, 2.0]], [[100.5, 1.0]]))
+    subscription.update("okx", book([[100.0, 0.5]], [[100.5, 2.0], [101.0, 1.0]]))
+    return subscription
+
+
+def make_view(depth=10, group=None):
+    """Vue du carnet agrégé de make_subscription, diffusée manuellement (sans tâche)."""
+    subscription = make_subscription()
+    view = subscription.views[(depth, 0.1, group)] = BookView(subscription, (depth, 0.1, group), depth, 0.1, group)
+    return subscription, view
+
+
+def test_publish_aggregates_exchanges():
+    """Vérifie que les quantités des exchanges sont additionnées par niveau de prix."""
+    _, view = make_view()
+
+    full, delta = view.publish()
+
+    assert full["bids"][0] == {"price": 100.0, "exchanges": {"binance": 1.0, "okx": 0.5}, "total": 1.5}
+    assert [level["price"] for level in full["bids"]] == [100.0, 99.5]
+    assert [level["price"] for level in full["asks"]] == [100.5, 101.0]
+    assert delta["sequence"] == 1 and delta["bids"] == full["bids"], "The first delta should contain every level"
+
+
+def test_publish_only_when_changed():
+    """Une vue inchangée n'est pas diffusée, et son numéro de séquence n'avance pas."""
+    subscription, view = make_view()
+    view.publish()
+
+    assert view.publish() is None
+    subscription.update("binance", book([[100.0, 1.0], [99.5, 2.0]], [[100.5, 1.0]]))
+    assert view.publish() is None
+    assert view.sequence == 1
+
+
+def test_delta_contains_only_changed_levels():
+    """Le delta ne contient que les niveaux modifiés ; un niveau supprimé y figure avec un total nul."""
+    subscription, view = make_view()
+    view.publish()
+
+    subscription.update("binance", book([[100.0, 3.0]], [[100.5, 1.0]]))
+    full, delta = view.publish()
+
+    assert delta["sequence"] == 2
+    assert delta["bids"] == [
+        {"price": 100.0, "exchanges": {"binance": 3.0, "okx": 0.5}, "total": 3.5},
+        {"price": 99.5, "exchanges": {}, "total": 0}
+    ], f"Unexpected delta: {delta['bids']}"
+    assert delta["asks"] == []
+    assert [level["price"] for level in full["bids"]] == [100.0]
+
+
+def test_stale_exchange_is_excluded():
+    """Un exchange désynchronisé sort de l'agrégat et est signalé dans "stale"."""
+    subscription, view = make_view()
+    view.publish()
+
+    subscription.update("okx", book([], [], stale=True))
+    full, delta = view.publish()
+
+    assert full["stale"] == delta["stale"] == ["okx"]
+    assert full["bids"][0]["exchanges"] == {"binance": 1.0}
+    assert [level["price"] for level in full["asks"]] == [100.5]
+
+
+def test_snapshot_matches_last_publication():
+    """Le snapshot porte le numéro de la dernière diffusion et les niveaux diffusés sous ce numéro."""
+    subscription, view = make_view()
+    full, _ = view.publish()
+
+    # Un changement pas encore diffusé n'apparaît pas dans le snapshot
+    subscription.update("binance", book([[100.0, 3.0]], [[100.5, 1.0]]))
+    snapshot = view.snapshot()
+
+    assert snapshot["type"] == "snapshot" and snapshot["sequence"] == 1
+    assert snapshot["bids"] == full["bids"] and snapshot["asks"] == full["asks"]
+    assert view.current()["bids"] == full["bids"]
+
+
+def test_client_sends_in_order():
+    """Les messages sont envoyés dans l'ordre de leur mise en file."""
+    async def scenario():
+        websocket = FakeWebSocket()
+        client = ClientConnection(websocket)
+        client.push("a")
+        await client.send_json({"b": 1})
+        await asyncio.sleep(0.01)
+        client.close()
+        return websocket.sent
+
+    assert asyncio.run(scenario()) == ["a", '{"b":1}']
+
+
+def test_client_replaces_pending_message_with_same_key():
+    """
+    Un message en attente est remplacé par le suivant de même clé ; le message en cours d'envoi
+    et les messages d'autres clés ne sont pas touchés.
+    """
+    async def scenario():
+        websocket = FakeWebSocket(blocked=True)
+        client = ClientConnection(websocket)
+        client.push("book 1", key="BTC-USD")
+        await asyncio.sleep(0.01)  # "book 1" est en cours d'envoi
+        client.push("book 2", key="BTC-USD")
+        client.push("other", key="ETH-USD")
+        client.push("book 3", key="BTC-USD")
+        websocket.open.set()
+        await asyncio.sleep(0.01)
+        client.close()
+        return websocket.sent
+
+    assert asyncio.run(scenario()) == ["book 1", "book 3", "other"]
+
+
+def test_lagging_delta_client_receives_snapshot():
+    """
+    Deux deltas successifs ne se remplacent pas : un client en retard en mode "delta" reçoit
+    un snapshot de la dernière diffusion, un client en mode "full" le dernier carnet complet.
+    """
+    async def scenario():
+        subscription, view = make_view()
+        delta_socket, full_socket = FakeWebSocket(blocked=True), FakeWebSocket(blocked=True)
+        delta_client, full_client = ClientConnection(delta_socket), ClientConnection(full_socket)
+        view.clients = {delta_client: "delta", full_client: "full"}
+
+        view.broadcast(*view.publish())
+        subscription.update("binance", book([[100.0, 3.0]], [[100.5, 1.0]]))
+        last_full, last_delta = view.publish()
+        view.broadcast(last_full, last_delta)
+        delta_socket.open.set()
+        full_socket.open.set()
+        await asyncio.sleep(0.01)
+        delta_client.close()
+        full_client.close()
+        return [json.loads(payload) for payload in delta_socket.sent], [json.loads(payload) for payload in full_socket.sent], last_full
+
+    delta_messages, full_messages, last_full = asyncio.run(scenario())
+    assert len(delta_messages) == 1, f"Expecting a single conflated message, got {delta_messages}"
+    assert delta_messages[0]["type"] == "snapshot" and delta_messages[0]["sequence"] == 2
+    assert delta_messages[0]["bids"] == last_full["bids"]
+    assert full_messages == [last_full]
+
+
+def test_broadcast_serializes_only_used_modes(monkeypatch):
+    """Une diffusion ne sérialise que les messages des modes utilisés par les clients de la vue."""
+    import Utilities.SubscriptionManager as subscription_manager
+    encoded = []
+    encode_message = subscription_manager.encode_message
+    monkeypatch.setattr(subscription_manager, "encode_message", lambda message: encoded.append(message) or encode_message(message))
+
+    async def scenario():
+        _, view = make_view()
+        client = ClientConnection(FakeWebSocket())
+        view.clients = {client: "full"}
+        view.broadcast(*view.publish())
+        client.close()
+
+    asyncio.run(scenario())
+    assert len(encoded) == 1 and "type" not in encoded[0], f"Only the full message should be serialized: {encoded}"
+
+
+def test_client_disconnected_when_queue_overflows():
+    """Un client dont la file dépasse max_queue messages est déconnecté avec le code 1013."""
+    async def scenario():
+        websocket = FakeWebSocket(blocked=True)
+        client = ClientConnection(websocket, max_queue=2)
+        results = [client.push(str(i)) for i in range(3)]
+        await asyncio.sleep(0.01)
+        return results, client.closed, websocket.close_code, client.push("late")
+
+    results, closed, close_code, late = asyncio.run(scenario())
+    assert results == [True, True, False]
+    assert closed and close_code == 1013
+    assert late is False, "A disconnected client should not accept messages"
+
+
+def test_client_disconnected_when_send_times_out():
+    """Un client qui ne lit plus ses messages est déconnecté après send_timeout secondes."""
+    async def scenario():
+        websocket = FakeWebSocket(blocked=True)
+        client = ClientConnection(websocket, send_timeout=0.05)
+        client.push("book")
+        await asyncio.sleep(0.2)
+        return client.closed, websocket.close_code
+
+    assert asyncio.run(scenario()) == (True, 1013)
+
+
+def test_parse_view_options():
+    """Vérifie les valeurs par défaut et la lecture des paramètres d'abonnement /ws."""
+    assert parse_view_options({}) == {"depth": DEFAULT_DEPTH, "max_rate": None, "group": None}
+    options = parse_view_options({"depth": 5, "max_rate": 2, "group": 0.5})
+    assert options == {"depth": 5, "max_rate": 2, "group": Decimal("0.5")}
+
+
+@pytest.mark.parametrize("message", [
+    {"depth": 0}, {"depth": 501}, {"depth": "10"}, {"depth": True},
+    {"max_rate": 0}, {"max_rate": "fast"},
+    {"group": 0}, {"group": -1}, {"group": "abc"}, {"group": "NaN"}
+])
+def test_parse_view_options_rejects_invalid_values(message):
+    """Un paramètre invalide lève une ValueError (renvoyée au client comme message d'erreur)."""
+    with pytest.raises(ValueError):
+        parse_view_options(message)
+
+
+def test_grouping_rounds_away_from_the_spread():
+    """
+    Les prix sont regroupés vers le bas pour les bids et vers le haut pour les asks :
+    un niveau regroupé n'annonce jamais un meilleur prix que ceux qu'il contient.
+    """
+    _, view = make_view(group=Decimal("1"))
+
+    full, _ = view.publish()
+
+    assert full["bids"] == [
+        {"price": 100.0, "exchanges": {"binance": 1.0, "okx": 0.5}, "total": 1.5},
+        {"price": 99.0, "exchanges": {"binance": 2.0}, "total": 2.0}
+    ], f"Unexpected bids: {full['bids']}"
+    assert full["asks"] == [{"price": 101.0, "exchanges": {"binance": 1.0, "okx": 3.0}, "total": 4.0}]
+
+
+def test_grouping_respects_depth():
+    """La profondeur d'une vue regroupée compte les niveaux regroupés."""
+    _, view = make_view(depth=1, group=Decimal("0.5"))
+
+    full, _ = view.publish()
+
+    assert [level["price"] for level in full["bids"]] == [100.0]
+    assert [level["price"] for level in full["asks"]] == [100.5]
+
+
+def test_rescale_keeps_views_consistent():
+    """
+    Un exchange plus précis fait passer les prix entiers à une échelle plus fine : le pas de regroupement
+    et les niveaux déjà diffusés suivent, sans diffusion inutile.
+    """
+    subscription, view = make_view(group=Decimal("0.5"))
+    view.publish()
+    assert view.step == 50
+
+    subscription.update("kraken", {**book([], []), "price_decimals": 4})
+
+    assert subscription.price_decimals == 4 and view.step == 5000
+    assert view.publish() is None, "Rescaling alone should not change the view"
+    subscription.update("kraken", {**book([[99.9999, 1.0]], []), "price_decimals": 4})
+    full, delta = view.publish()
+    assert full["bids"][1] == {"price": 99.5, "exchanges": {"binance": 2.0, "kraken": 1.0}, "total": 3.0}
+    assert [level["price"] for level in delta["bids"]] == [99.5]
+
+
+def test_fine_group_rescales_subscription():
+    """Un pas de regroupement plus fin que les prix de l'agrégat fait passer celui-ci à son échelle."""
+    async def scenario():
+        subscription = make_subscription()
+        client = ClientConnection(FakeWebSocket())
+        view = subscription.add_client(client, "full", depth=5, group=Decimal("0.001"))
+        subscription.close()
+        client.close()
+        return subscription, view
+
+    subscription, view = asyncio.run(scenario())
+    assert subscription.price_decimals == 3 and view.step == 1
+    assert [level["price"] for level in view.current()["bids"]] == [100.0, 99.5]
+
+
+def test_clients_share_views():
+    """Les clients qui demandent les mêmes paramètres partagent une vue ; une vue sans client est supprimée."""
+    async def scenario():
+        subscription = make_subscription()
+        first, second = ClientConnection(FakeWebSocket()), ClientConnection(FakeWebSocket())
+        first_view = subscription.add_client(first, "full", depth=5)
+        second_view = subscription.add_client(second, "delta", depth=5)
+        shared = first_view is second_view
+        other_view = subscription.add_client(second, "full", depth=20, group=Decimal("1"))
+        views = len(subscription.views)
+        venue_depth = subscription.venue_depth
+        subscription.remove_client(first)
+        remaining = list(subscription.views.values())
+        subscription.close()
+        first.close()
+        second.close()
+        return shared, other_view, views, venue_depth, remaining
+
+    shared, other_view, views, venue_depth, remaining = asyncio.run(scenario())
+    assert shared, "Clients with the same options should share a view"
+    assert views == 2
+    assert venue_depth == 500, "A grouped view should request the maximum depth from exchanges"
+    assert remaining == [other_view]
+
+
+def test_grouped_view_raises_kraken_subscription_depth():
+    """
+    Kraken ne diffuse que les meilleurs niveaux de son abonnement : une vue regroupée (MAX_DEPTH niveaux)
+    le fait réabonner à la profondeur qui la couvre, et son carnet local n'est plus tronqué à 10 niveaux.
+    """
+    async def scenario():
+        kraken = exchange_dict["kraken"]
+        stream = kraken.order_book_stream = OrderBookStream(kraken)
+        connection = StreamConnection(kraken.ws_message_rate)
+        connection.ws = socket = FakeExchangeSocket()
+        connection.task = asyncio.create_task(asyncio.sleep(0))  # Connexion déjà ouverte
+        stream.connections.append(connection)
+
+        subscription = make_subscription()
+        callback = lambda data: subscription.update("kraken", data)
+        subscription.feed_callbacks["kraken"] = ("XBT/USD", callback)
+        await stream.subscribe("XBT/USD", callback, subscription.venue_depth)
+        client = ClientConnection(FakeWebSocket())
+        subscription.add_client(client, "full", depth=5, group=Decimal("1"))
+        await asyncio.sleep(0.01)
+        book_depth = stream.books["XBT/USD"].depth
+
+        subscription.remove_client(client)
+        await asyncio.sleep(0.01)
+        subscription.close()
+        client.close()
+        kraken.order_book_stream = None
+        return socket.sent, book_depth
+
+    sent, book_depth = asyncio.run(scenario())
+    depths = [(message["event"], message["subscription"]["depth"]) for message in sent]
+    assert depths == [
+        ("subscribe", 10),
+        ("unsubscribe", 10), ("subscribe", 500),
+        ("unsubscribe", 500), ("subscribe", 10)
+    ], f"Unexpected subscription messages: {depths}"
+    assert book_depth == 500